@@ -6,4 +6,5 @@ class AuthConfig(AppConfig):
     name = 'auth_'
 
     def ready(self):
-        import auth_.signals
\ No newline at end of file
+        import auth_.checks
+        import auth_.signals
@@ -0,0 +1,99 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac, constant_time_compare
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_.models import User, ClaimsUser
+from auth_.tokens import RefreshToken
+from common import messages
+
+# claims copied from the user into every token, enough for permissions and most views
+USER_CLAIMS = {
+    'username': 'username',
+    'roles': 'roles',
+    'cur_city': 'cur_city_id',
+}
+
+
+def set_claims(token, user):
+    for claim, attname in USER_CLAIMS.items():
+        token[claim] = getattr(user, attname)
+    return token
+
+
+def access_token_for(user):
+    return set_claims(AccessToken.for_user(user), user)
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    # request.user comes from the signed claims without reading the user table, a changed role or city
+    # reaches the token on the next refresh
+
+    def get_user(self, validated_token):
+        if any(claim not in validated_token for claim in USER_CLAIMS):
+            # tokens issued before the claims were added
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(messages.INVALID_TOKEN)
+        return ClaimsUser.from_claims(**{api_settings.USER_ID_FIELD: user_id},
+                                      **{attname: validated_token[claim] for claim, attname in USER_CLAIMS.items()})
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    # a verified username and password pair is remembered for BASIC_AUTH_CACHE_TIMEOUT seconds under an HMAC of
+    # the pair, so the password hasher runs once per client, not on every request; the cached entry is bound to
+    # the password hash, a changed password or a deactivated user goes through the full check again
+
+    def authenticate_credentials(self, userid, password, request=None):
+        cache = caches[settings.BASIC_AUTH_CACHE]
+        key = 'basic-auth:' + salted_hmac('basic-auth', f'{userid}:{password}', algorithm='sha256').hexdigest()
+        cached = cache.get(key)
+        if cached is not None:
+            user = User.objects.filter(id=cached[0], is_active=True).first()
+            if user is not None and constant_time_compare(self.fingerprint(user), cached[1]):
+                return user, None
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (user.id, self.fingerprint(user)), settings.BASIC_AUTH_CACHE_TIMEOUT)
+        return user, auth
+
+    @staticmethod
+    def fingerprint(user):
+        return salted_hmac('basic-auth-password', user.password, algorithm='sha256').hexdigest()
+
+
+class ClaimsTokenObtainSerializer(TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+    @classmethod
+    def get_token(cls, user):
+        return set_claims(super().get_token(user), user)
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RefreshToken
+
+    def validate(self, attrs):
+        # the same steps as TokenRefreshSerializer.validate on one token, so the blacklist is checked once;
+        # the claims are read again, so a refresh picks up role and city changes
+        refresh = self.token_class(attrs['refresh'])
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]},
+                                   is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed(messages.USER_DONT_FOUND)
+        data = {'access': str(set_claims(refresh.access_token, user))}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(set_claims(refresh, user))
+        return data
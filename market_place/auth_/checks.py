@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from common.cache import versions_shared
+
+
+@register(Tags.caches)
+def check_blacklist_filter(app_configs, **kwargs):
+    # the blacklist filter is only trusted when every worker sees the version bumped by a blacklisting
+    if settings.DEBUG or versions_shared():
+        return []
+    return [Warning('Refresh tokens are checked against the token blacklist in the database on every refresh.',
+                    hint='Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by all workers '
+                         'to check them against the blacklist filter first.',
+                    id='auth_.W001')]
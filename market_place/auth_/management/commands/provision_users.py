@@ -0,0 +1,40 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from auth_.provisioning import UserProvisioner, PROVISION_CHUNK_SIZE
+from common import messages
+from market.importer import READERS
+
+
+class Command(BaseCommand):
+    help = 'Create users from a CSV or JSONL file with their profiles and carts, existing usernames are skipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, "-" reads stdin')
+        parser.add_argument('--format', choices=sorted(READERS), help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=PROVISION_CHUNK_SIZE)
+        parser.add_argument('--processes', type=int, help='password hashing processes, defaults to the CPU count')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(messages.UNKNOWN_IMPORT_FORMAT)
+
+        provisioner = UserProvisioner(chunk_size=options['chunk_size'], processes=options['processes'])
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            for rows, elapsed in provisioner.run(READERS[file_format](file)):
+                if options['verbosity'] > 0:
+                    self.stdout.write(f'{rows} rows, {rows / elapsed:.0f} rows/sec')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        for line_number, error in provisioner.skipped:
+            self.stderr.write(f'line {line_number}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Provisioned {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/sec): '
+            f'{provisioner.created} created, {len(provisioner.skipped)} skipped'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from auth_.tokens import prune_tokens
+from market.models import BULK_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted refresh tokens in small chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        deleted = prune_tokens(options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'{deleted} expired tokens deleted'))
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:05
+
+import auth_.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_', '0002_user_cur_city'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClaimsUser',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('auth_.user',),
+            managers=[
+                ('objects', auth_.models.UserManager()),
+            ],
+        ),
+    ]
@@ -1,7 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
-from django.db import models
+from django.db import models, transaction, DEFAULT_DB_ALIAS
 from django.contrib.auth.models import AbstractUser
-from django.db.models import Count
 
 from common.constants import USER_ROLES, CUSTOMER, ADMIN, MANAGER, DIRECTOR
 from common.validators import validate_file_size, validate_extension
@@ -18,7 +17,9 @@ class UserManager(BaseUserManager):
         city = City.objects.all().first()
         user = self.model(username=username, email=email, first_name=first_name, last_name=last_name, cur_city=city, **extra_fields)
         user.set_password(password)
-        user.save(using=self._db)
+        # the user and the events of its post_save receivers are written together
+        with transaction.atomic(using=self._db):
+            user.save(using=self._db)
         return user
 
     def create_user(self, username, password, email, first_name, last_name):
@@ -38,9 +39,6 @@ class UserManager(BaseUserManager):
     def directors(self):
         return User.objects.filter(roles=DIRECTOR)
 
-    def count_orders(self):
-        return User.objects.annotate(num_orders=Count('orders')).order_by('num_orders')
-
 
 class User(AbstractUser):
     avatar = models.ImageField(upload_to='users_avatars', validators=[validate_file_size, validate_extension],
@@ -58,6 +56,24 @@ class User(AbstractUser):
         return self.first_name + " " + self.last_name
 
 
+class ClaimsUser(User):
+    # a user built from access token claims, the first field read outside the claims loads all the others
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, **values):
+        names = [field.attname for field in cls._meta.concrete_fields if field.attname in values]
+        return cls.from_db(DEFAULT_DB_ALIAS, names, [values[name] for name in names])
+
+    def refresh_from_db(self, using=None, fields=None):
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     phone = models.CharField(max_length=20, blank=True, null=True, verbose_name='Номер телефона')
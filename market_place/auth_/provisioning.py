@@ -0,0 +1,111 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from auth_.models import User, Profile
+from common import messages
+from common.constants import USER_ROLES, CUSTOMER, MANAGER
+from core.models import City
+from payments.models import Cart, ManagerLoad
+
+PROVISION_CHUNK_SIZE = 1000
+
+
+class UserProvisioner:
+    # creates users in chunked bulk inserts together with the profile, cart and manager load the USER_CREATED
+    # outbox handlers would have made, no post_save receivers run and no events are written; passwords are
+    # hashed in a process pool, the hasher is deliberately slow and takes most of the time
+    user_fields = ['username', 'email', 'first_name', 'last_name', 'roles']
+    profile_fields = ['phone', 'bio']
+
+    def __init__(self, chunk_size=PROVISION_CHUNK_SIZE, processes=None):
+        self.chunk_size = chunk_size
+        self.processes = processes or os.cpu_count()
+        self.created = 0
+        self.skipped = []
+        self.usernames = set()
+        self.city_id = None
+
+    def run(self, records):
+        # yields the number of processed rows and elapsed seconds after every chunk
+        started = time.perf_counter()
+        # the same default city as UserManager._create_user
+        city = City.objects.all().first()
+        self.city_id = city.id if city else None
+        rows = 0
+        chunk = []
+        with ProcessPoolExecutor(self.processes) as pool:
+            for line_number, record in records:
+                try:
+                    chunk.append((line_number, self.clean(record)))
+                except ValueError as e:
+                    self.skipped.append((line_number, str(e)))
+                rows += 1
+                if len(chunk) >= self.chunk_size:
+                    self.provision_chunk(chunk, pool)
+                    chunk = []
+                    yield rows, time.perf_counter() - started
+            if chunk:
+                self.provision_chunk(chunk, pool)
+        yield rows, time.perf_counter() - started
+
+    @staticmethod
+    def clean(record):
+        if not isinstance(record, dict):
+            raise ValueError(messages.INVALID_IMPORT_RECORD)
+        username = str(record.get('username') or '').strip()
+        if not username:
+            raise ValueError(messages.NO_USERNAME)
+        email = User.objects.normalize_email(str(record.get('email') or '').strip())
+        if not email:
+            raise ValueError(messages.NO_EMAIL)
+        roles = record.get('roles') or CUSTOMER
+        if roles not in dict(USER_ROLES):
+            raise ValueError(messages.INVALID_ROLE)
+        password = record.get('password')
+        return {
+            'username': username,
+            'email': email,
+            'first_name': str(record.get('first_name') or '').strip(),
+            'last_name': str(record.get('last_name') or '').strip(),
+            'roles': roles,
+            # an empty password gives an unusable one, as set_password(None) does
+            'password': str(password) if password not in (None, '') else None,
+            'phone': str(record.get('phone') or '').strip() or None,
+            'bio': str(record.get('bio') or '').strip(),
+        }
+
+    def provision_chunk(self, chunk, pool):
+        usernames = [record['username'] for _, record in chunk]
+        taken = self.usernames | set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        records = []
+        for line_number, record in chunk:
+            if record['username'] in taken:
+                self.skipped.append((line_number, messages.USERNAME_EXISTS))
+                continue
+            taken.add(record['username'])
+            records.append(record)
+        self.usernames.update(record['username'] for record in records)
+        if not records:
+            return
+
+        passwords = pool.map(make_password, [record['password'] for record in records],
+                             chunksize=max(1, len(records) // (self.processes * 4)))
+        users = [User(password=password, cur_city_id=self.city_id, **{field: record[field]
+                                                                      for field in self.user_fields})
+                 for record, password in zip(records, passwords)]
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            # SQLite does not return primary keys from bulk inserts
+            user_ids = dict(User.objects.filter(username__in=[user.username for user in users])
+                            .values_list('username', 'id'))
+            Profile.objects.bulk_create([Profile(user_id=user_ids[record['username']],
+                                                 **{field: record[field] for field in self.profile_fields})
+                                         for record in records])
+            Cart.objects.bulk_create([Cart(user_id=user_id) for user_id in user_ids.values()])
+            ManagerLoad.objects.bulk_create([ManagerLoad(manager_id=user_ids[record['username']], city_id=self.city_id)
+                                             for record in records if record['roles'] == MANAGER])
+        self.created += len(records)
@@ -3,7 +3,7 @@ import re
 
 from rest_framework import serializers
 
-from auth_.models import User
+from auth_.models import User, Profile
 from common import messages
 from common.constants import USER_ROLES
 from core.models import City
@@ -90,8 +90,7 @@ class ChangeDetailsSerializer(serializers.Serializer):
     def change_details(self):
         user = self.context['request'].user
         if self.validated_data.get('phone'):
-            user.profile.phone = self.validated_data['phone']
-            user.profile.save()
+            Profile.objects.update_or_create(user=user, defaults={'phone': self.validated_data['phone']})
         if self.validated_data.get('cur_city'):
             city = City.objects.get(id=self.validated_data['cur_city'])
             user.cur_city = city
@@ -1,17 +1,25 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
-from auth_.models import User, Profile
+from auth_.models import User, ClaimsUser, Profile
+from common.constants import USER_CREATED, USER_CHANGED
+from core import outbox
 from payments.models import Cart
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+@receiver(post_save, sender=ClaimsUser)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    # logins only touch last_login, other saves may change the role or the city; request.user is a
+    # ClaimsUser, a proxy sends its own class as the sender
     if created:
-        Profile.objects.create(user=instance)
-        Cart.objects.create(user=instance)
+        outbox.enqueue(USER_CREATED, user_id=instance.id)
+    elif update_fields is None or {'roles', 'cur_city'} & set(update_fields):
+        outbox.enqueue(USER_CHANGED, user_id=instance.id)
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+@outbox.handler(USER_CREATED)
+def create_user_profile(user_id):
+    if User.objects.filter(id=user_id).exists():
+        Profile.objects.get_or_create(user_id=user_id)
+        Cart.objects.cart_id(user_id)
@@ -1,3 +1,319 @@
-from django.test import TestCase
+import base64
+import datetime
+import json
+import tempfile
+import time
+import uuid
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.checks import run_checks
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.test import APIClient
+from rest_framework_simplejwt import tokens as simplejwt_tokens
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework.views import APIView
+
+from auth_.authentication import ClaimsJWTAuthentication, CachedBasicAuthentication
+from auth_.models import User, Profile
+from auth_.provisioning import UserProvisioner
+from auth_.tokens import RefreshToken, prune_tokens
+from common.benchmarks import benchmark, measure, report
+from common.constants import MANAGER, CUSTOMER
+from core import outbox
+from core.models import City, OutboxEvent
+from payments.models import Cart, ManagerLoad
+
+
+class ClaimsAuthenticationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='city')
+        cls.user = User.objects.create_user('user', 'password', 'user@mail.kz', 'first', 'last')
+
+    def login(self):
+        client = APIClient()
+        tokens = client.post('/account/login/', {'username': 'user', 'password': 'password'}).data
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        return client, tokens
+
+    def test_requests_do_not_read_the_user(self):
+        client, _ = self.login()
+        with self.assertNumQueries(0):
+            self.assertEqual(client.get('/payments/orders/managers/').status_code, 403)
+
+    def test_other_fields_are_loaded_once(self):
+        _, tokens = self.login()
+        user = ClaimsJWTAuthentication().get_user(AccessToken(tokens['access']))
+        self.assertEqual((user.id, user.username, user.roles), (self.user.id, 'user', self.user.roles))
+        with self.assertNumQueries(1):
+            self.assertEqual((user.email, user.first_name, user.is_staff), ('user@mail.kz', 'first', False))
+
+    def test_refresh_picks_up_role_changes(self):
+        client, tokens = self.login()
+        User.objects.filter(id=self.user.id).update(roles=MANAGER)
+        self.assertEqual(client.get('/payments/orders/managers/').status_code, 403)
+
+        access = client.post('/account/login/refresh/', {'refresh': tokens['refresh']}).data['access']
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(client.get('/payments/orders/managers/').status_code, 200)
+
+    def test_city_change_moves_the_manager_load(self):
+        User.objects.filter(id=self.user.id).update(roles=MANAGER, cur_city=self.city)
+        while outbox.process():
+            pass
+        self.assertEqual(ManagerLoad.objects.get(manager=self.user).city_id, self.city.id)
+        other = City.objects.create(name='other')
+        client, _ = self.login()
+        response = client.post('/account/cur-city/', json.dumps({'city_id': other.id}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        while outbox.process():
+            pass
+        self.assertEqual(list(ManagerLoad.objects.filter(manager=self.user).values_list('city_id', flat=True)),
+                         [other.id])
+
+
+class RefreshTokenBlacklistTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user', 'password', 'user@mail.kz', 'first', 'last')
+
+    def login(self):
+        client = APIClient()
+        tokens = client.post('/account/login/', {'username': 'user', 'password': 'password'}).data
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {tokens["access"]}')
+        return client, tokens
+
+    def test_rotated_token_is_rejected(self):
+        client, tokens = self.login()
+        response = client.post('/account/login/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(client.post('/account/login/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+        self.assertEqual(client.post('/account/login/refresh/', {'refresh': response.data['refresh']}).status_code,
+                         200)
+
+    def test_logged_out_token_is_rejected(self):
+        client, tokens = self.login()
+        self.assertEqual(client.post('/account/logout/', {'refresh_token': tokens['refresh']}).status_code, 205)
+        self.assertEqual(client.post('/account/login/refresh/', {'refresh': tokens['refresh']}).status_code, 401)
+
+    def test_prune_deletes_expired_tokens_only(self):
+        now = timezone.now()
+        for i in range(5):
+            token = OutstandingToken.objects.create(user=self.user, jti=f'expired{i}', token='',
+                                                    expires_at=now - datetime.timedelta(days=1))
+            BlacklistedToken.objects.create(token=token)
+        live = OutstandingToken.objects.create(user=self.user, jti='live', token='',
+                                               expires_at=now + datetime.timedelta(days=1))
+        BlacklistedToken.objects.create(token=live)
+
+        out = StringIO()
+        call_command('prune_tokens', chunk_size=2, stdout=out)
+        self.assertIn('5 expired tokens deleted', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertEqual(list(BlacklistedToken.objects.values_list('token_id', flat=True)), [live.id])
+
+    def test_blacklisting_by_another_worker_is_seen(self):
+        _, tokens = self.login()
+        token = RefreshToken(tokens['refresh'])
+        # another worker blacklists the token, the version it bumps lives in its own cache
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+        with self.assertRaises(simplejwt_tokens.TokenError):
+            RefreshToken(tokens['refresh'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': tempfile.mkdtemp()}})
+    def test_shared_versions_use_the_filter(self):
+        _, tokens = self.login()
+        RefreshToken(tokens['refresh'])
+        # a Bloom filter miss needs no query
+        with self.assertNumQueries(0):
+            RefreshToken(tokens['refresh'])
+        RefreshToken(tokens['refresh']).blacklist()
+        with self.assertRaises(simplejwt_tokens.TokenError):
+            RefreshToken(tokens['refresh'])
+
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': tempfile.mkdtemp()}})
+    def test_refresh_checks_the_blacklist_once(self):
+        _, tokens = self.login()
+        with patch.object(RefreshToken, 'check_blacklist', autospec=True,
+                          side_effect=RefreshToken.check_blacklist) as check_blacklist:
+            response = APIClient().post('/account/login/refresh/', {'refresh': tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(check_blacklist.call_count, 1)
+
+    def test_production_needs_shared_versions_for_the_filter(self):
+        with override_settings(DEBUG=False):
+            self.assertIn('auth_.W001', [message.id for message in run_checks()])
+        with override_settings(DEBUG=False, CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': tempfile.mkdtemp()}}):
+            self.assertNotIn('auth_.W001', [message.id for message in run_checks()])
+
+class UserProvisioningTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='city')
+        User.objects.create_user('taken', 'password', 'taken@mail.kz', 'first', 'last')
+
+    def state(self, username):
+        user = User.objects.get(username=username)
+        return (user.email, user.first_name, user.last_name, user.roles, user.cur_city_id,
+                user.check_password('password'), Profile.objects.filter(user=user).count(),
+                Cart.objects.filter(user=user).count(), ManagerLoad.objects.filter(manager=user, city=self.city).count())
+
+    def test_same_end_state_as_create_user(self):
+        for username, roles in (('customer', CUSTOMER), ('manager', MANAGER)):
+            user = User.objects.create_user(username, 'password', f'{username}@Mail.KZ', 'first', 'last')
+            User.objects.filter(id=user.id).update(roles=roles)
+        while outbox.process():
+            pass
+        events = OutboxEvent.objects.count()
+
+        records = [(1, {'username': 'bulk_customer', 'password': 'password', 'email': 'bulk_customer@Mail.KZ',
+                        'first_name': 'first', 'last_name': 'last'}),
+                   (2, {'username': 'bulk_manager', 'password': 'password', 'email': 'bulk_manager@Mail.KZ',
+                        'first_name': 'first', 'last_name': 'last', 'roles': MANAGER, 'phone': '+77001234567'}),
+                   (3, {'username': 'taken', 'password': 'password', 'email': 'taken@mail.kz'}),
+                   (4, {'username': 'bulk_customer', 'password': 'password', 'email': 'other@mail.kz'}),
+                   (5, {'username': 'no_email', 'password': 'password'}),
+                   (6, {'username': 'bulk_admin', 'email': 'admin@mail.kz', 'roles': 'ROOT'})]
+        provisioner = UserProvisioner(chunk_size=2, processes=2)
+        list(provisioner.run(records))
+
+        self.assertEqual(provisioner.created, 2)
+        self.assertEqual([line_number for line_number, _ in provisioner.skipped], [3, 4, 5, 6])
+        self.assertEqual(OutboxEvent.objects.count(), events)
+        for username in ('customer', 'manager'):
+            expected = self.state(username)
+            self.assertEqual(self.state(f'bulk_{username}'), (f'bulk_{expected[0]}',) + expected[1:])
+        self.assertEqual(Profile.objects.get(user__username='bulk_manager').phone, '+77001234567')
+
+
+def basic_credentials(username, password):
+    return 'Basic ' + base64.b64encode(f'{username}:{password}'.encode()).decode()
+
+
+class AuthProfileTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        City.objects.create(name='city')
+        cls.user = User.objects.create_user('user', 'password', 'user@mail.kz', 'first', 'last')
+
+    def setUp(self):
+        caches[settings.BASIC_AUTH_CACHE].clear()
+
+    def test_api_requests_skip_the_session(self):
+        response = self.client.get('/core/cities/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        self.assertFalse(response.cookies)
+
+        response = self.client.get('/admin/login/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        response = APIClient(enforce_csrf_checks=True).post('/admin/login/', {'username': 'user'})
+        self.assertEqual(response.status_code, 403)
+
+    def test_basic_credentials_are_verified_once(self):
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=basic_credentials('user', 'password'))
+        self.assertEqual(CachedBasicAuthentication().authenticate(request)[0], self.user)
+        with patch.object(User, 'check_password') as check_password, self.assertNumQueries(1):
+            self.assertEqual(CachedBasicAuthentication().authenticate(request)[0], self.user)
+        check_password.assert_not_called()
+
+        self.user.set_password('new password')
+        self.user.save()
+        with self.assertRaises(AuthenticationFailed):
+            CachedBasicAuthentication().authenticate(request)
+
+
+@benchmark
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': tempfile.mkdtemp()}})
+class TokenRefreshBenchmark(TestCase):
+    # rotation with blacklisting leaves one outstanding and one blacklisted row per refresh
+    tokens = 10000000
+    expired = 0.9
+    refreshes = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('user', 'password', 'user@mail.kz', 'first', 'last')
+        now = timezone.now()
+        expired = (now - datetime.timedelta(days=1)).isoformat(' ')
+        live = (now + datetime.timedelta(days=1)).isoformat(' ')
+        chunk = 100000
+        with connection.cursor() as cursor:
+            for start in range(1, cls.tokens + 1, chunk):
+                ids = range(start, min(start + chunk, cls.tokens + 1))
+                cursor.executemany(f'INSERT INTO {OutstandingToken._meta.db_table} '
+                                   f'(id, user_id, jti, token, created_at, expires_at) VALUES (%s, %s, %s, %s, %s, %s)',
+                                   [(i, cls.user.id, uuid.uuid4().hex, '', now.isoformat(' '),
+                                     expired if i <= cls.tokens * cls.expired else live) for i in ids])
+                cursor.executemany(f'INSERT INTO {BlacklistedToken._meta.db_table} (id, token_id, blacklisted_at) '
+                                   f'VALUES (%s, %s, %s)', [(i, i, now.isoformat(' ')) for i in ids])
+        cls.refresh_tokens = [str(RefreshToken.for_user(cls.user)) for _ in range(cls.refreshes)]
+
+    def test_refresh(self):
+        def check(token_class):
+            def run():
+                for token in self.refresh_tokens:
+                    token_class(token)
+            return run
+
+        started = time.perf_counter()
+        RefreshToken(self.refresh_tokens[0])
+        report(f'blacklist filter over {self.tokens} tokens', build_ms=(time.perf_counter() - started) * 1000)
+        for name, token_class in (('database', simplejwt_tokens.RefreshToken), ('filter', RefreshToken)):
+            ms = measure(check(token_class), repeat=3)
+            report(f'{name} blacklist check over {self.tokens} tokens', refreshes_per_sec=self.refreshes / ms * 1000)
+
+        started = time.perf_counter()
+        deleted = prune_tokens(10000)
+        report(f'prune {deleted} expired tokens', seconds=time.perf_counter() - started)
+        self.assertEqual(OutstandingToken.objects.count(), self.tokens - deleted + self.refreshes)
+
+
+@benchmark
+class AuthProfileBenchmark(TestCase):
+    requests = 50
+
+    @classmethod
+    def setUpTestData(cls):
+        City.objects.create(name='city')
+        cls.user = User.objects.create_user('user', 'password', 'user@mail.kz', 'first', 'last')
+
+    def throughput(self, profile, credentials):
+        classes = [import_string(path) for path in settings.API_AUTH_PROFILES[profile]]
+        session_paths = ('/',) if profile == 'session' else ('/admin/',)
+        with override_settings(SESSION_PATHS=session_paths), patch.object(APIView, 'authentication_classes', classes):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=credentials)
+
+            def run():
+                for _ in range(self.requests):
+                    self.assertEqual(client.get('/core/cities/').status_code, 200)
+            return self.requests / measure(run, repeat=3) * 1000
+
+    def test_profiles(self):
+        access = APIClient().post('/account/login/', {'username': 'user', 'password': 'password'}).data['access']
+        basic = basic_credentials('user', 'password')
+        for profile, scheme, credentials in (('session', 'basic', basic), ('session', 'jwt', f'Bearer {access}'),
+                                             ('basic', 'basic', basic), ('jwt', 'jwt', f'Bearer {access}')):
+            report(f'{profile} profile, {scheme} credentials', requests_per_sec=self.throughput(profile, credentials))
@@ -0,0 +1,109 @@
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from common.bloom import BloomFilter
+from common.cache import get_version, bump_version, versions_shared
+
+TOKEN_BLACKLIST = 'token-blacklist'
+# ids are handed out before commit, so a row committed late can land below the last seen id; a sync reads
+# this many ids before it again
+SYNC_OVERLAP = 1000
+
+
+class BlacklistFilter:
+    # a process-local Bloom filter over the blacklisted refresh tokens that have not expired yet; a miss
+    # means the token is not blacklisted, a hit is confirmed in the database. Rows written since the last sync
+    # are added when the shared version is bumped by a blacklisting, or at least every TOKEN_BLACKLIST_POLL
+    # seconds; a full rebuild drops expired tokens every TOKEN_BLACKLIST_REBUILD
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.version = None
+        self.last_id = 0
+        self.built_at = 0
+        self.synced_at = 0
+
+    def __contains__(self, jti):
+        self.sync()
+        return jti in self.bloom
+
+    def sync(self):
+        version = get_version(TOKEN_BLACKLIST)
+        now = time.monotonic()
+        if version == self.version and now - self.synced_at < settings.TOKEN_BLACKLIST_POLL:
+            return
+        # with no new blacklisting known, requests keep the current filter while another thread syncs it
+        if not self.lock.acquire(blocking=self.bloom is None or version != self.version):
+            return
+        try:
+            if self.bloom is None or len(self.bloom) > self.bloom.capacity \
+                    or now - self.built_at >= settings.TOKEN_BLACKLIST_REBUILD:
+                self.rebuild()
+            else:
+                self.last_id = self.add_since(self.bloom, self.last_id)
+            self.version = version
+            self.synced_at = now
+        finally:
+            self.lock.release()
+
+    def rebuild(self):
+        capacity = settings.TOKEN_BLACKLIST_CAPACITY
+        if self.bloom is not None:
+            capacity = max(capacity, len(self.bloom) * 2)
+        bloom = BloomFilter(capacity)
+        self.last_id = self.add_since(bloom, 0, expires_after=timezone.now())
+        self.bloom = bloom
+        self.built_at = time.monotonic()
+
+    def add_since(self, bloom, last_id, expires_after=None):
+        # blacklist rows get growing ids, a sync reads the latest ones from the primary key
+        rows = BlacklistedToken.objects.filter(id__gt=last_id - SYNC_OVERLAP)
+        if expires_after is not None:
+            rows = rows.filter(token__expires_at__gt=expires_after)
+        for row_id, jti in rows.values_list('id', 'token__jti').iterator(chunk_size=10000):
+            if jti not in bloom:
+                bloom.add(jti)
+            last_id = max(last_id, row_id)
+        return last_id
+
+
+blacklist_filter = BlacklistFilter()
+
+
+class RefreshToken(tokens.RefreshToken):
+
+    def check_blacklist(self):
+        # a per-process version cache does not see blacklistings made by other workers, so every token is
+        # looked up in the database until the versions are shared
+        if not versions_shared() or self.payload[api_settings.JTI_CLAIM] in blacklist_filter:
+            super().check_blacklist()
+
+    def blacklist(self):
+        result = super().blacklist()
+        bump_version(TOKEN_BLACKLIST)
+        return result
+
+
+def prune_tokens(chunk_size, now=None):
+    # walks the expired tokens in id order, every chunk is deleted in its own short transaction
+    now = now or timezone.now()
+    deleted = 0
+    last_id = 0
+    while True:
+        ids = list(OutstandingToken.objects.filter(id__gt=last_id, expires_at__lte=now).order_by('id')
+                   .values_list('id', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            # the blacklist rows of the chunk go with their tokens
+            OutstandingToken.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        last_id = ids[-1]
@@ -5,7 +5,6 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework import viewsets, status, generics
-from rest_framework_simplejwt.tokens import RefreshToken
 
 from common.permissions import AdminPermission, DirectorPermission
 from auth_.serializers import UserSerializer, UserDetailsSerializer, RegistrationSerializer, ChangeDetailsSerializer, \
@@ -14,6 +13,8 @@ from common import messages
 
 from common.constants import ADMIN
 from core.models import City
+from auth_.authentication import access_token_for
+from auth_.tokens import RefreshToken
 from auth_.models import User
 import logging
 
@@ -118,6 +119,8 @@ class CurrentCityView(APIView):
             user = request.user
             user.cur_city = city
             user.save()
-            return Response({'info': 'Current city changed'}, status=status.HTTP_200_OK)
+            # the city is a token claim, the new access token carries it right away
+            return Response({'info': 'Current city changed', 'access': str(access_token_for(user))},
+                            status=status.HTTP_200_OK)
         except Exception as e:
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -0,0 +1,19 @@
+import os
+import time
+from unittest import skipUnless
+
+benchmark = skipUnless(os.getenv('BENCHMARK'), 'set BENCHMARK=1 to run benchmarks')
+
+
+def measure(func, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def report(title, **values):
+    print(f'\n{title}: ' + ', '.join(f'{name}={value:.2f}' if isinstance(value, float) else f'{name}={value}'
+                                    for name, value in values.items()))
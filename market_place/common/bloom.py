@@ -0,0 +1,29 @@
+import math
+
+
+class BloomFilter:
+    # answers "certainly not added" or "probably added"; the k bit positions of a key come from the two halves
+    # of one 64-bit hash, str hashes are salted per process, so a filter must not leave the process it was built in
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        value = hash(key) & 0xFFFFFFFFFFFFFFFF
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+        return [(low + i * high) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def __len__(self):
+        return self.count
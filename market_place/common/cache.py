@@ -0,0 +1,90 @@
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.utils.http import parse_etags
+
+CACHE_TIMEOUT = 60 * 60 * 24
+# a lock expires after LOCK_TIMEOUT seconds in case its holder died, a caller gives up after LOCK_WAIT seconds
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 5
+
+
+def is_shared(alias):
+    # LocMemCache lives in one process, every worker would keep its own versions
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def versions_shared():
+    return is_shared(settings.VERSION_CACHE)
+
+
+@contextmanager
+def cache_lock(cache, key, timeout=None, wait=None):
+    # cache.add only stores a missing key, on memcached and redis it is atomic across processes
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + (LOCK_WAIT if wait is None else wait)
+    while not cache.add(key, token, timeout or LOCK_TIMEOUT):
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f'"{key}" is locked')
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        if cache.get(key) == token:
+            cache.delete(key)
+
+
+def get_version(name):
+    cache = caches[settings.VERSION_CACHE]
+    key = f'version:{name}'
+    version = cache.get(key)
+    if version is None:
+        # versions are millisecond timestamps, so a lost key never brings back an old version
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    # bump again after commit, so a response built from a read that raced the transaction is not kept
+    transaction.on_commit(lambda: _bump(name))
+    return _bump(name)
+
+
+def _bump(name):
+    cache = caches[settings.VERSION_CACHE]
+    key = f'version:{name}'
+    version = max(int(time.time() * 1000), (cache.get(key) or 0) + 1)
+    cache.set(key, version, None)
+    return version
+
+
+def make_etag(name, version):
+    return f'"{name}-{version}"'
+
+
+def etag_matches(request, etag):
+    return etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+
+
+def model_version(model):
+    return get_version(model._meta.label_lower)
+
+
+def bump_model_version(model):
+    return bump_version(model._meta.label_lower)
+
+
+def track_changes(*models):
+    for model in models:
+        def receiver(sender, **kwargs):
+            bump_model_version(sender)
+        post_save.connect(receiver, sender=model, weak=False, dispatch_uid=f'version:{model._meta.label_lower}')
+        post_delete.connect(receiver, sender=model, weak=False, dispatch_uid=f'version:{model._meta.label_lower}')
@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from common.cache import is_shared
+
+
+@register(Tags.caches)
+def check_version_cache(app_configs, **kwargs):
+    # a DEBUG server runs in one process, any other deployment needs the version counters in a shared cache
+    if settings.DEBUG or is_shared(settings.VERSION_CACHE):
+        return []
+    return [Warning(f'The "{settings.VERSION_CACHE}" cache keeps version counters in one process.',
+                    hint='Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by all workers.',
+                    id='common.W001')]
@@ -24,4 +24,36 @@ ORDER_STATUSES = (
 DONT_ENOUGH_MONEY = 'DONT ENOUGH MONEY'
 MONEY_ENOUGH = 'MONEY ENOUGH'
 AVAILABLE = 'AVAILABLE'
-DONT_AVAILABLE = 'DONT AVALABLE'
\ No newline at end of file
+DONT_AVAILABLE = 'DONT AVALABLE'
+
+CATEGORY_TREE = 'category-tree'
+
+ACTIVE = 'ACTIVE'
+COMPLETED = 'COMPLETED'
+RELEASED = 'RELEASED'
+EXPIRED = 'EXPIRED'
+
+RESERVATION_STATUSES = (
+    (ACTIVE, ACTIVE),
+    (COMPLETED, COMPLETED),
+    (RELEASED, RELEASED),
+    (EXPIRED, EXPIRED),
+)
+
+ADD = 'add'
+UPDATE = 'update'
+REMOVE = 'remove'
+
+CART_OPERATIONS = (ADD, UPDATE, REMOVE)
+
+FAILED = 'FAILED'
+
+OUTBOX_STATUSES = (
+    (PENDING, PENDING),
+    (DONE, DONE),
+    (FAILED, FAILED),
+)
+
+USER_CREATED = 'user_created'
+USER_CHANGED = 'user_changed'
+ORDER_CREATED = 'order_created'
@@ -7,4 +7,20 @@ NOT_ALL_LETTERS = 'Фамилия-Имя не должно содержать ц
 NO_MONEY = 'Не достаточно средст на карте!'
 NO_CITY = 'Данного города нет в базе данных'
 SPECIAL_CHARACTERS = 'Специальные символы запрещены!'
-USER_DONT_FOUND = 'Пользователь не найден!'
\ No newline at end of file
+USER_DONT_FOUND = 'Пользователь не найден!'
+NO_PRODUCTS_SELECTED = 'Не выбраны товары!'
+CATEGORY_CYCLE = 'Категория не может быть вложена в свою подкатегорию!'
+NO_SKU = 'Не указан артикул!'
+NO_PRODUCT_NAME = 'Не указано наименование товара!'
+INVALID_PRICE = 'Неверная цена товара!'
+INVALID_CHARACTERISTICS = 'Неверный формат характеристик!'
+INVALID_IMPORT_RECORD = 'Неверный формат записи!'
+UNKNOWN_IMPORT_FORMAT = 'Неизвестный формат файла импорта!'
+EMPTY_CART = 'Корзина пуста!'
+NOT_AVAILABLE = 'Данных товаров нет в наличии'
+PRODUCT_NOT_FOUND = 'Товар не найден!'
+INVALID_CART_OPERATION = 'Неверная операция с корзиной!'
+INVALID_TOKEN = 'Токен не содержит идентификатор пользователя!'
+NO_USERNAME = 'Не указан username!'
+NO_EMAIL = 'Не указан email!'
+INVALID_ROLE = 'Неизвестная роль пользователя!'
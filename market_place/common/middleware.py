@@ -0,0 +1,50 @@
+import asyncio
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class PathScopedMiddleware:
+    # runs settings.SESSION_MIDDLEWARE only for paths under settings.SESSION_PATHS, the API authenticates
+    # every request itself and has no use for the session, CSRF and message handling
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # under ASGI a sync-only middleware would hold the request thread for the whole view
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+        self.middleware = []
+        handler = get_response
+        for path in reversed(settings.SESSION_MIDDLEWARE):
+            handler = import_string(path)(handler)
+            self.middleware.insert(0, handler)
+        self.scoped_response = handler
+
+    def scoped(self, request):
+        return request.path_info.startswith(tuple(settings.SESSION_PATHS))
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        if self.scoped(request):
+            return self.scoped_response(request)
+        return self.get_response(request)
+
+    async def acall(self, request):
+        if self.scoped(request):
+            return await self.scoped_response(request)
+        return await self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # the handler only calls process_view of the middleware listed in settings.MIDDLEWARE
+        if not self.scoped(request):
+            return None
+        for middleware in self.middleware:
+            if hasattr(middleware, 'process_view'):
+                response = middleware.process_view(request, view_func, view_args, view_kwargs)
+                if response is not None:
+                    return response
+        return None
@@ -0,0 +1,28 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+
+from common.cache import model_version
+
+
+class ConditionalGetMixin:
+    # models whose change counters decide whether list and retrieve responses are still fresh
+    version_models = ()
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(request, super().retrieve, *args, **kwargs)
+
+    def conditional_response(self, request, handler, *args, **kwargs):
+        # only an ETag is sent, Last-Modified has whole-second precision and would answer 304 to a client that
+        # read the list earlier in the same second as a change
+        version = max(model_version(model) for model in self.version_models)
+        etag = '"{}"'.format(hashlib.md5(f'{request.get_full_path()}:{version}'.encode()).hexdigest())
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+        return response
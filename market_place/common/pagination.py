@@ -0,0 +1,198 @@
+import base64
+import datetime
+import json
+from collections import OrderedDict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder cuts datetimes to milliseconds, a cursor needs the exact value or rows are skipped
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class KeysetPagination(BasePagination):
+    # pages continue from the last seen row of the queryset's own ordering, without COUNT(*) or OFFSET;
+    # rows ranked outside the database, e.g. by a search index, page through request.ranked_ids instead
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.positions = None
+        ranked_ids = getattr(request, 'ranked_ids', None)
+        if ranked_ids is not None and not queryset.query.order_by:
+            return self.paginate_ranking(queryset, ranked_ids, request)
+        self.ordering = self.get_ordering(queryset)
+        self.nullable = {field.lstrip('-') for field in self.ordering
+                         if self.is_nullable(queryset, field.lstrip('-'))}
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+
+        queryset = queryset.order_by(*(self.order_expression(self.invert(field) if reverse else field)
+                                       for field in self.ordering))
+        if cursor:
+            queryset = queryset.filter(self.keyset_filter(cursor['values'], reverse))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = results
+        return results
+
+    def paginate_ranking(self, queryset, ranked_ids, request):
+        # the cursor keeps the row's place in the ranking and its id, a page resumes after that id while it
+        # is still ranked and after the place otherwise
+        self.ordering = ['position', 'pk']
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        remaining = set(queryset.values_list('pk', flat=True))
+        ranked_ids = [pk for pk in ranked_ids if pk in remaining]
+        self.positions = {pk: position for position, pk in enumerate(ranked_ids)}
+
+        if cursor is None:
+            start, end = 0, page_size
+        else:
+            try:
+                position, pk = int(cursor['values'][0]), cursor['values'][1]
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            if cursor['reverse']:
+                end = self.positions.get(pk, position)
+                start = max(end - page_size, 0)
+            else:
+                start = self.positions[pk] + 1 if pk in self.positions else position
+                end = start + page_size
+        rows = queryset.in_bulk(ranked_ids[start:end])
+        self.page = [rows[pk] for pk in ranked_ids[start:end] if pk in rows]
+        self.has_next = end < len(ranked_ids)
+        self.has_previous = start > 0
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(page_size, self.max_page_size) if page_size > 0 else self.page_size
+
+    def get_ordering(self, queryset):
+        ordering = list(queryset.query.order_by or (queryset.query.default_ordering and queryset.model._meta.ordering))
+        if not all(isinstance(field, str) for field in ordering):
+            # expressions cannot be turned into a keyset, fall back to the primary key
+            ordering = []
+        pk_name = queryset.model._meta.pk.name
+        ordering = [field.replace('pk', pk_name) if field.lstrip('-') == 'pk' else field for field in ordering]
+        if pk_name not in [field.lstrip('-') for field in ordering]:
+            # the tie-breaker follows the direction of the first field so one composite index serves the page
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append(f'-{pk_name}' if descending else pk_name)
+        return ordering
+
+    def order_expression(self, field):
+        # NULLs sort above every value on every backend, last going up and first going down
+        name = field.lstrip('-')
+        if name not in self.nullable:
+            return field
+        return F(name).desc(nulls_first=True) if field.startswith('-') else F(name).asc(nulls_last=True)
+
+    def keyset_filter(self, values, reverse):
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            if value is None:
+                # going up nothing follows NULLs, going down every value does
+                if descending:
+                    condition |= equal & Q(**{f'{name}__isnull': False})
+                equal &= Q(**{f'{name}__isnull': True})
+                continue
+            after = Q(**{f'{name}__lt' if descending else f'{name}__gt': value})
+            if name in self.nullable and not descending:
+                after |= Q(**{f'{name}__isnull': True})
+            condition |= equal & after
+            equal &= Q(**{name: value})
+        return condition
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, instance, reverse):
+        if self.positions is not None:
+            values = [self.positions[instance.pk], instance.pk]
+        else:
+            values = [self.get_value(instance, field.lstrip('-')) for field in self.ordering]
+        data = json.dumps({'values': values, 'reverse': reverse}, cls=CursorEncoder)
+        cursor = base64.urlsafe_b64encode(data.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if len(cursor['values']) != len(self.ordering):
+                raise ValueError
+            return {'values': cursor['values'], 'reverse': bool(cursor['reverse'])}
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def is_nullable(queryset, field):
+        if field in queryset.query.annotations:
+            # an annotation is computed by the database, it is ordered and compared as if it could be NULL
+            return True
+        model = queryset.model
+        for name in field.split('__'):
+            model_field = model._meta.get_field(name)
+            if model_field.null:
+                return True
+            model = model_field.related_model
+        return False
+
+    @staticmethod
+    def get_value(instance, field):
+        for attr in field.split('__'):
+            instance = getattr(instance, attr)
+        return instance.pk if isinstance(instance, models.Model) else instance
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
@@ -1,5 +1,9 @@
+import json
 import random
 
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
 
 def random_csv():
     return random.randint(100, 999)
@@ -7,3 +11,12 @@ def random_csv():
 
 def random_nums():
     return random.randint(1000000000000000, 9999999999999999)
+
+
+def id_values(ids):
+    # SQLite limits the number of bound parameters, so long id lists go in as a single JSON array
+    ids = list(ids)
+    max_params = connection.features.max_query_params
+    if connection.vendor == 'sqlite' and max_params and len(ids) > max_params:
+        return RawSQL('SELECT value FROM json_each(%s)', [json.dumps(ids)])
+    return ids
@@ -0,0 +1,43 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.urls import URLPattern
+
+READ_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def run_read(view, request, *args, **kwargs):
+    # runs in a pool thread with its own database connection, closed after the request unless CONN_MAX_AGE
+    # keeps it; the response is rendered here too, so the event loop only sends the bytes
+    try:
+        response = view(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_read(view):
+    # under ASGI every sync view shares one thread; reads of the wrapped view run concurrently in the event loop's
+    # default executor instead, other methods keep the single thread
+    @wraps(view)
+    async def async_view(request, *args, **kwargs):
+        if request.method in READ_METHODS:
+            return await sync_to_async(run_read, thread_sensitive=False)(view, request, *args, **kwargs)
+        return await sync_to_async(view)(request, *args, **kwargs)
+    return async_view
+
+
+def read_view(view):
+    return async_read(view) if settings.ASYNC_READ_VIEWS else view
+
+
+def read_views(urlpatterns, names=None):
+    # the views of the given url names, or of all patterns, become async_read ones
+    if not settings.ASYNC_READ_VIEWS:
+        return urlpatterns
+    return [URLPattern(pattern.pattern, async_read(pattern.callback), pattern.default_args, pattern.name)
+            if names is None or pattern.name in names else pattern for pattern in urlpatterns]
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = 'Process outbox events in batches until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='seconds to wait when nothing is ready')
+        parser.add_argument('--once', action='store_true', help='stop when no event is ready')
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                processed = outbox.process(options['batch_size'])
+                total += processed
+                if processed and options['verbosity'] > 1:
+                    self.stdout.write(f'{processed} events processed')
+                if not processed:
+                    if options['once']:
+                        break
+                    time.sleep(options['idle_sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'{total} events processed'))
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:00
+
+import logging
+
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+
+def fill_paths(apps, schema_editor):
+    Category = apps.get_model('core', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    paths = {}
+    detached = []
+    for category_id in parents:
+        # walk up to a category with a known path or to a root, a category seen twice closes a cycle
+        chain, seen = [], set()
+        current = category_id
+        while current is not None and current not in paths:
+            if current in seen:
+                # the cycle is broken at its last category, it becomes a root
+                parents[chain[-1]] = None
+                detached.append(chain[-1])
+                current = None
+                break
+            chain.append(current)
+            seen.add(current)
+            current = parents[current]
+        prefix = paths[current] if current is not None else '/'
+        for node in reversed(chain):
+            paths[node] = prefix = f'{prefix}{node}/'
+
+    if detached:
+        logger.warning('Categories %s were in a parent cycle and became roots', detached)
+        Category.objects.filter(id__in=detached).update(parent=None)
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.path = paths[category.id]
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='Путь'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_outbox_event'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='path',
+            field=models.TextField(db_index=True, default='', editable=False, verbose_name='Путь'),
+        ),
+    ]
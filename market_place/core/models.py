@@ -1,5 +1,13 @@
-from django.db import models
+import datetime
+import uuid
 
+from django.db import models, transaction
+from django.db.models import Value, Subquery
+from django.db.models.functions import Concat, Length, Substr
+from django.utils import timezone
+
+from common import messages
+from common.constants import OUTBOX_STATUSES, PENDING, DONE, FAILED
 from common.validators import validate_file_size, validate_extension
 
 
@@ -20,9 +28,34 @@ class Shop(models.Model):
         verbose_name_plural = 'Магазины'
 
 
+class CategoryManager(models.Manager):
+
+    def tree(self, root=None):
+        queryset = Category.objects.order_by(Length('path'), 'id')
+        if root is not None:
+            queryset = queryset.filter(path__startswith=root.path)
+        nodes = {}
+        roots = []
+        for category in queryset:
+            category.tree_children = []
+            parent = nodes.get(category.parent_id)
+            if parent is None:
+                roots.append(category)
+            else:
+                parent.tree_children.append(category)
+            nodes[category.id] = category
+        return roots
+
+    def subtree(self, category):
+        return Category.objects.filter(path__startswith=category.path)
+
+
 class Category(models.Model):
     parent = models.ForeignKey('self', on_delete=models.SET_NULL, related_name='children', null=True, blank=True)
     name = models.CharField(verbose_name='Наименование', max_length=100)
+    # one '/<pk>' segment per level, a text column keeps the depth unlimited
+    path = models.TextField(verbose_name='Путь', db_index=True, default='', editable=False)
+    objects = CategoryManager()
 
     class Meta:
         verbose_name = 'Категория'
@@ -34,6 +67,21 @@ class Category(models.Model):
     def __str__(self):
         return self.__unicode__()
 
+    def save(self, *args, **kwargs):
+        parent_path = self.parent.path if self.parent_id else '/'
+        with transaction.atomic():
+            old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).first() if self.pk else None
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError(messages.CATEGORY_CYCLE)
+            super().save(*args, **kwargs)
+            path = f'{parent_path}{self.pk}/'
+            if path != old_path:
+                Category.objects.filter(pk=self.pk).update(path=path)
+                if old_path:
+                    Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk) \
+                        .update(path=Concat(Value(path), Substr('path', len(old_path) + 1)))
+            self.path = path
+
 
 class Brand(models.Model):
     name = models.CharField(verbose_name='Наименование', max_length=200)
@@ -49,4 +97,51 @@ class Brand(models.Model):
         return self.name
 
     def __str__(self):
-        return self.__unicode__()
\ No newline at end of file
+        return self.__unicode__()
+
+
+class OutboxEventManager(models.Manager):
+
+    def enqueue(self, topic, **payload):
+        # written by the caller's transaction, so the event exists exactly when the change that caused it does
+        return self.create(topic=topic, payload=payload)
+
+    def claim(self, batch_size, lease):
+        # claiming moves available_at past the lease, events of a worker that died are claimed again afterwards
+        now = timezone.now()
+        token = uuid.uuid4().hex
+        ready = self.filter(status=PENDING, available_at__lte=now).order_by('available_at', 'id').values('id')
+        self.filter(id__in=Subquery(ready[:batch_size]), status=PENDING, available_at__lte=now) \
+            .update(claimed_by=token, available_at=now + datetime.timedelta(seconds=lease))
+        return token, list(self.filter(claimed_by=token, status=PENDING).order_by('id'))
+
+    def done(self, event, token):
+        return self.filter(id=event.id, claimed_by=token).update(status=DONE, processed_at=timezone.now())
+
+    def failed(self, event, token, error, max_attempts, retry_delay):
+        attempts = event.attempts + 1
+        delay = retry_delay * 2 ** (attempts - 1)
+        return self.filter(id=event.id, claimed_by=token).update(
+            attempts=attempts, last_error=error, status=FAILED if attempts >= max_attempts else PENDING,
+            available_at=timezone.now() + datetime.timedelta(seconds=delay))
+
+
+class OutboxEvent(models.Model):
+    topic = models.CharField(max_length=100, verbose_name='Событие')
+    payload = models.JSONField(default=dict, verbose_name='Данные')
+    status = models.CharField(choices=OUTBOX_STATUSES, default=PENDING, max_length=20, verbose_name='Статус')
+    attempts = models.IntegerField(default=0, verbose_name='Попытки')
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='Доступно с')
+    claimed_by = models.CharField(max_length=32, null=True, blank=True, verbose_name='Обработчик')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='Дата обработки')
+    objects = OutboxEventManager()
+
+    class Meta:
+        verbose_name = 'Событие'
+        verbose_name_plural = 'События'
+        indexes = [
+            models.Index(fields=['status', 'available_at']),
+            models.Index(fields=['claimed_by']),
+        ]
@@ -0,0 +1,39 @@
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+
+def handler(topic):
+    # handlers run in the worker, possibly more than once for one event, so they have to be idempotent
+    def register(func):
+        HANDLERS.setdefault(topic, []).append(func)
+        return func
+    return register
+
+
+def enqueue(topic, **payload):
+    return OutboxEvent.objects.enqueue(topic, **payload)
+
+
+def process(batch_size=None):
+    # handles one claimed batch, every event in its own transaction together with marking it done
+    token, events = OutboxEvent.objects.claim(batch_size or settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_LEASE)
+    for event in events:
+        try:
+            with transaction.atomic():
+                if event.topic not in HANDLERS:
+                    raise LookupError(f'no handler for {event.topic}')
+                for func in HANDLERS[event.topic]:
+                    func(**event.payload)
+                OutboxEvent.objects.done(event, token)
+        except Exception as e:
+            logger.error(f'outbox event {event.id} {event.topic} - {str(e)}')
+            OutboxEvent.objects.failed(event, token, str(e), settings.OUTBOX_MAX_ATTEMPTS, settings.OUTBOX_RETRY_DELAY)
+    return len(events)
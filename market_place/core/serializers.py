@@ -30,6 +30,14 @@ class CategorySerializer(serializers.Serializer):
             raise Exception(messages.SPECIAL_CHARACTERS)
         return value
 
+    def validate(self, attrs):
+        parent_id = attrs.get('parent_id')
+        if self.instance and parent_id:
+            parent = Category.objects.filter(id=parent_id).first()
+            if parent and parent.path.startswith(self.instance.path):
+                raise serializers.ValidationError(messages.CATEGORY_CYCLE)
+        return attrs
+
     def create(self, validated_data):
         category = Category.objects.create(**validated_data)
         return category
@@ -42,7 +50,7 @@ class CategorySerializer(serializers.Serializer):
 
 
 class CategoryListSerializer(serializers.ModelSerializer):
-    children = serializers.ListSerializer(read_only=True, child=RecursiveField())
+    children = serializers.ListSerializer(read_only=True, child=RecursiveField(), source='tree_children')
 
     class Meta:
         model = Category
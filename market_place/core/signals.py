@@ -0,0 +1,24 @@
+from django.db.models import Value
+from django.db.models.functions import StrIndex, Substr
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from common.cache import bump_version, track_changes
+from common.constants import CATEGORY_TREE
+from core.models import Category, Brand, City, Shop
+
+track_changes(Category, Brand, City, Shop)
+
+
+@receiver(post_delete, sender=Category)
+def reroot_category_children(sender, instance, **kwargs):
+    # children were detached by SET_NULL, so their subtrees become new roots
+    segment = f'/{instance.pk}/'
+    Category.objects.filter(path__contains=segment) \
+        .update(path=Substr('path', StrIndex('path', Value(segment)) + len(segment) - 1))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    bump_version(CATEGORY_TREE)
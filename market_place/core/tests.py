@@ -1,3 +1,337 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.core.checks import run_checks
+from django.test import TestCase, TransactionTestCase, AsyncClient, Client, override_settings
+from django.urls import clear_url_caches, resolve
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.test import APIClient
+
+import core.urls
+import market.urls
+import market_place.urls
+
+from common.benchmarks import benchmark, measure, report
+from common.cache import bump_version
+from common.constants import CATEGORY_TREE, PENDING, DONE, FAILED
+from core import outbox
+from core.models import Category, OutboxEvent, Brand, City, Shop
+from market.models import Product, ProductReview
+
+
+@override_settings(OUTBOX_MAX_ATTEMPTS=2, OUTBOX_RETRY_DELAY=10)
+class OutboxTest(TestCase):
+
+    def setUp(self):
+        self.calls = []
+        outbox.handler('test_event')(self.handle)
+        self.addCleanup(outbox.HANDLERS.pop, 'test_event')
+
+    def handle(self, value):
+        self.calls.append(value)
+        if value == 'broken':
+            raise ValueError(value)
+
+    def later(self):
+        OutboxEvent.objects.update(available_at=timezone.now() - datetime.timedelta(seconds=1))
+
+    def test_events_are_handled_once_and_failures_retried(self):
+        ok = outbox.enqueue('test_event', value='ok')
+        broken = outbox.enqueue('test_event', value='broken')
+        self.assertEqual(outbox.process(), 2)
+        self.assertEqual(outbox.process(), 0)
+        self.assertEqual(self.calls, ['ok', 'broken'])
+
+        broken.refresh_from_db()
+        self.assertEqual((broken.status, broken.attempts, broken.last_error), (PENDING, 1, 'broken'))
+        self.assertGreater(broken.available_at, timezone.now())
+        self.later()
+        self.assertEqual(outbox.process(), 1)
+        self.later()
+        self.assertEqual(outbox.process(), 0)
+        self.assertEqual(dict(OutboxEvent.objects.values_list('id', 'status')), {ok.id: DONE, broken.id: FAILED})
+
+    def test_claimed_events_are_not_handed_out_twice(self):
+        outbox.enqueue('test_event', value='ok')
+        token, events = OutboxEvent.objects.claim(10, lease=60)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(OutboxEvent.objects.claim(10, lease=60)[1], [])
+        # a lease that ran out hands the event to the next worker, the first one can no longer finish it
+        self.later()
+        self.assertEqual(outbox.process(), 1)
+        self.assertEqual(OutboxEvent.objects.done(events[0], token), 0)
+
+
+class CategoryPathTest(TestCase):
+
+    def test_deep_tree(self):
+        # deeper than a 255 character path allows
+        categories = [Category.objects.create(name='level 0')]
+        for level in range(1, 100):
+            categories.append(Category.objects.create(name=f'level {level}', parent=categories[-1]))
+        self.assertGreater(len(categories[-1].path), 255)
+        self.assertEqual(Category.objects.subtree(categories[50]).count(), 50)
+
+        categories[50].parent = None
+        categories[50].save()
+        categories[-1].refresh_from_db()
+        self.assertEqual(categories[-1].path, '/' + ''.join(f'{c.id}/' for c in categories[50:]))
+        root = Category.objects.tree(categories[50])[0]
+        depth = 0
+        while root.tree_children:
+            root = root.tree_children[0]
+            depth += 1
+        self.assertEqual(depth, 49)
+
+    def test_migration_breaks_parent_cycles(self):
+        fill_paths = importlib.import_module('core.migrations.0002_category_path').fill_paths
+        top = Category.objects.create(name='top')
+        middle = Category.objects.create(name='middle', parent=top)
+        bottom = Category.objects.create(name='bottom', parent=middle)
+        leaf = Category.objects.create(name='leaf', parent=bottom)
+        loop = Category.objects.create(name='loop')
+        Category.objects.filter(id=top.id).update(parent=bottom)
+        Category.objects.filter(id=loop.id).update(parent=loop)
+        Category.objects.update(path='')
+
+        with self.assertLogs('core.migrations.0002_category_path', 'WARNING'):
+            fill_paths(apps, None)
+        paths = dict(Category.objects.values_list('name', 'path'))
+        self.assertEqual(Category.objects.filter(parent=None).count(), 2)
+        self.assertEqual(paths['loop'], f'/{loop.id}/')
+        # every path runs from a root down the remaining parents
+        for category in Category.objects.all():
+            expected = f'{category.id}/'
+            parent = category.parent
+            while parent:
+                expected = f'{parent.id}/{expected}'
+                parent = parent.parent
+            self.assertEqual(category.path, '/' + expected)
+        self.assertTrue(paths['leaf'].endswith(f'/{bottom.id}/{leaf.id}/'))
+
+
+class CategoryTreeCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name='phones')
+        cls.laptops = Category.objects.create(name='laptops')
+        cls.cases = Category.objects.create(name='cases', parent=cls.phones)
+
+    def tree(self):
+        response = APIClient().get('/core/categories/')
+        self.assertEqual(response.status_code, 200)
+
+        def names(nodes):
+            return {node['name']: names(node['children']) for node in nodes}
+        return names(response.data), response['ETag']
+
+    def assertChanged(self, etag, expected):
+        self.assertEqual(APIClient().get('/core/categories/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        tree, new_etag = self.tree()
+        self.assertEqual(tree, expected)
+        self.assertNotEqual(new_etag, etag)
+        return new_etag
+
+    def test_edit_move_and_delete_invalidate_the_tree(self):
+        tree, etag = self.tree()
+        self.assertEqual(tree, {'phones': {'cases': {}}, 'laptops': {}})
+        self.assertEqual(APIClient().get('/core/categories/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.cases.name = 'covers'
+        self.cases.save()
+        etag = self.assertChanged(etag, {'phones': {'covers': {}}, 'laptops': {}})
+
+        self.cases.parent = self.laptops
+        self.cases.save()
+        etag = self.assertChanged(etag, {'phones': {}, 'laptops': {'covers': {}}})
+
+        self.laptops.delete()
+        self.assertChanged(etag, {'phones': {}, 'covers': {}})
+
+
+class ConditionalGetTest(TestCase):
+
+    def test_change_in_the_same_second_is_not_hidden(self):
+        Brand.objects.create(name='first')
+        response = APIClient().get('/core/brands/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(APIClient().get('/core/brands/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Brand.objects.create(name='second')
+        response = APIClient().get('/core/brands/', HTTP_IF_NONE_MATCH=etag,
+                                   HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class VersionCacheCheckTest(TestCase):
+
+    def test_production_needs_a_shared_version_cache(self):
+        with override_settings(DEBUG=False):
+            self.assertIn('common.W001', [message.id for message in run_checks()])
+        with override_settings(DEBUG=False, CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': tempfile.mkdtemp()}}):
+            self.assertNotIn('common.W001', [message.id for message in run_checks()])
+
+
+@benchmark
+class CategoryTreeBenchmark(TestCase):
+    roots = 20
+    children = 10
+    grandchildren = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(cls.roots):
+            root = Category.objects.create(name=f'root {i}')
+            for j in range(cls.children):
+                child = Category.objects.create(name=f'child {i} {j}', parent=root)
+                for k in range(cls.grandchildren):
+                    Category.objects.create(name=f'leaf {i} {j} {k}', parent=child)
+
+    def test_category_list(self):
+        client = APIClient()
+
+        def miss():
+            bump_version(CATEGORY_TREE)
+            return client.get('/core/categories/')
+
+        def hit():
+            return client.get('/core/categories/')
+
+        etag = hit()['ETag']
+
+        def revalidate():
+            return client.get('/core/categories/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(revalidate().status_code, 304)
+        report(f'{Category.objects.count()} categories', miss_ms=measure(miss), hit_ms=measure(hit),
+               not_modified_ms=measure(revalidate))
+
+
+def load_urls(async_reads):
+    # the url modules choose between sync and async read views when they are imported
+    with override_settings(ASYNC_READ_VIEWS=async_reads):
+        for module in (core.urls, market.urls, market_place.urls):
+            importlib.reload(module)
+    clear_url_caches()
+
+
+class AsyncReadViewTest(TransactionTestCase):
+
+    def setUp(self):
+        load_urls(True)
+        self.addCleanup(load_urls, False)
+
+    def test_reads_are_async_and_writes_still_work(self):
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/core/cities/').func))
+        self.assertTrue(asyncio.iscoroutinefunction(resolve('/market/products/1/').func))
+        self.assertFalse(asyncio.iscoroutinefunction(resolve('/market/characteristics/').func))
+        City.objects.create(name='city')
+        client = AsyncClient()
+
+        async def requests():
+            responses = await asyncio.gather(*[client.get('/core/cities/') for _ in range(5)])
+            self.assertEqual([[city['name'] for city in response.json()] for response in responses], [['city']] * 5)
+            response = await client.post('/core/cities/', {'name': 'other'}, content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+            response = await client.get('/core/cities/')
+            self.assertEqual(sorted(city['name'] for city in response.json()), ['city', 'other'])
+
+        async_to_sync(requests)()
+
+
+@benchmark
+class CatalogReadBenchmark(TransactionTestCase):
+    products = 10000
+    concurrency = 16
+    requests = 400
+    # per query, a networked database instead of the local SQLite file
+    latency = 0.002
+
+    def setUp(self):
+        city = City.objects.create(name='city')
+        Shop.objects.bulk_create([Shop(address=f'shop {i}', city=city) for i in range(20)])
+        Brand.objects.bulk_create([Brand(name=f'brand {i}') for i in range(100)])
+        for i in range(10):
+            root = Category.objects.create(name=f'root {i}')
+            for j in range(10):
+                Category.objects.create(name=f'child {i} {j}', parent=root)
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=i, real_price=i)
+                                     for i in range(self.products)], batch_size=5000)
+        product = Product.objects.first()
+        for i in range(20):
+            product.reviews.add(ProductReview.objects.create(rating=i % 5 + 1, review=f'review {i}'))
+        self.paths = ['/market/products/', f'/market/products/{product.id}/', '/core/categories/', '/core/brands/',
+                      '/core/cities/', '/core/shops/', f'/market/products/{product.id}/reviews']
+        self.addCleanup(load_urls, False)
+
+    def wsgi(self):
+        # threaded WSGI workers, one client per thread
+        def worker(paths):
+            client = Client()
+            for path in paths:
+                self.assertEqual(client.get(path).status_code, 200)
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            list(pool.map(worker, [self.paths * (self.requests // len(self.paths) // self.concurrency)
+                                   for _ in range(self.concurrency)]))
+
+    def asgi(self):
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def get(path):
+            async with semaphore:
+                self.assertEqual((await client.get(path)).status_code, 200)
+
+        async def requests():
+            # as many pool threads as the WSGI deployment has
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(self.concurrency))
+            await asyncio.gather(*[get(path) for path in self.paths * (self.requests // len(self.paths))])
+
+        async_to_sync(requests)()
+
+    def delay(self, execute, sql, params, many, context):
+        time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def add_delay(self, sender, connection, **kwargs):
+        # a thread reconnects with the same wrapper object
+        if self.delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self.delay)
+
+    def test_concurrent_reads(self):
+        requests = self.requests // len(self.paths) * len(self.paths)
+        # persistent connections in both deployments, the test client never closes the WSGI ones
+        self.addCleanup(connection.settings_dict.__setitem__, 'CONN_MAX_AGE', connection.settings_dict['CONN_MAX_AGE'])
+        connection.settings_dict['CONN_MAX_AGE'] = None
+        for latency in (False, True):
+            if latency:
+                # every thread opens its own connection, the wrapper goes on each of them
+                connection.ensure_connection()
+                connection.execute_wrappers.append(self.delay)
+                connection_created.connect(self.add_delay)
+            for name, async_reads, run in (('wsgi threads', False, self.wsgi), ('asgi sync views', False, self.asgi),
+                                           ('asgi async reads', True, self.asgi)):
+                load_urls(async_reads)
+                run()
+                started = time.perf_counter()
+                run()
+                report(f'{name}, {self.concurrency} concurrent, {self.latency * 1000 if latency else 0:.0f}ms latency',
+                       requests_per_sec=requests / (time.perf_counter() - started))
+        connection_created.disconnect(self.add_delay)
+        connection.execute_wrappers.remove(self.delay)
@@ -1,5 +1,6 @@
 from django.urls import path
 
+from common.views import read_view, read_views
 from core.views import category_list, category_detail, BrandList, CityView, ShopView
 
 from rest_framework import routers
@@ -11,7 +12,7 @@ router.register('shops', ShopView, basename='shops')
 
 
 urlpatterns = [
-    path('categories/', category_list),
+    path('categories/', read_view(category_list)),
     path('categories/<int:category_id>', category_detail),
 ]
-urlpatterns += router.urls
\ No newline at end of file
+urlpatterns += read_views(router.urls)
\ No newline at end of file
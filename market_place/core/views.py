@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework import status, viewsets
@@ -6,6 +7,10 @@ from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
+from common.mixins import ConditionalGetMixin
+from common.pagination import KeysetPagination
+from common.cache import get_version, make_etag, etag_matches, CACHE_TIMEOUT
+from common.constants import CATEGORY_TREE
 from core.filters import BrandFilter
 from core.models import Category, Brand, City, Shop
 from core.serializers import CategorySerializer, CategoryListSerializer, BrandSerializer, CitySerializer, ShopSerializer
@@ -18,9 +23,16 @@ logger = logging.getLogger(__name__)
 def category_list(request):
     if request.method == 'GET':
         logger.info('category list')
-        categories = Category.objects.filter(parent__isnull=True)
-        serializer = CategoryListSerializer(categories, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        version = get_version(CATEGORY_TREE)
+        etag = make_etag(CATEGORY_TREE, version)
+        if etag_matches(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        key = f'{CATEGORY_TREE}:{version}'
+        data = cache.get(key)
+        if data is None:
+            data = CategoryListSerializer(Category.objects.tree(), many=True).data
+            cache.set(key, data, CACHE_TIMEOUT)
+        return Response(data, status=status.HTTP_200_OK, headers={'ETag': etag})
 
     elif request.method == 'POST':
         serializer = CategorySerializer(data=request.data)
@@ -41,7 +53,7 @@ def category_detail(request, category_id):
         logger.error({str(e)})
         return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
     if request.method == 'GET':
-        serializer = CategoryListSerializer(category)
+        serializer = CategoryListSerializer(Category.objects.tree(category)[0])
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     elif request.method == 'PUT':
@@ -58,8 +70,10 @@ def category_detail(request, category_id):
         return Response({'info': 'deleted'})
 
 
-class BrandList(viewsets.ModelViewSet):
+class BrandList(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Brand.objects.all()
+    version_models = (Brand,)
+    pagination_class = KeysetPagination
     permission_classes = (AllowAny,)
     serializer_class = BrandSerializer
     filter_backends = (DjangoFilterBackend,
@@ -70,11 +84,13 @@ class BrandList(viewsets.ModelViewSet):
     parser_classes = [MultiPartParser, FormParser, JSONParser]
 
 
-class CityView(viewsets.ModelViewSet):
+class CityView(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = City.objects.all()
+    version_models = (City,)
     serializer_class = CitySerializer
 
 
-class ShopView(viewsets.ModelViewSet):
+class ShopView(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Shop.objects.all()
+    version_models = (Shop,)
     serializer_class = ShopSerializer
\ No newline at end of file
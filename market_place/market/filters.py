@@ -2,10 +2,13 @@ from decimal import Decimal
 
 from django_filters import CharFilter
 from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
 
 from common.filters import FilterSet
+from common.utils import id_values
 from . import models
-from .models import Product
+from .models import Product, CharacteristicIndex
+from .search import get_search_index
 
 
 class PropertyFilter(FilterSet):
@@ -24,6 +27,7 @@ class ProductFilter(FilterSet):
     category = CharFilter(method='filter_category')
     brand = CharFilter(method='filter_brand')
     characteristics = CharFilter(method='filter_characteristics')
+    characteristics_any = CharFilter(method='filter_characteristics_any')
     recommended = CharFilter(method='filter_recommended')
     popular = CharFilter(method='filter_popular')
     new = CharFilter(method='filter_new')
@@ -31,6 +35,7 @@ class ProductFilter(FilterSet):
     min_price = filters.NumberFilter(field_name='current_price', lookup_expr='gte')
     by_price_cheap = CharFilter(method='filter_by_price_cheap')
     by_price_exp = CharFilter(method='filter_by_price_exp')
+    by_rating = CharFilter(method='filter_by_rating')
 
     def filter_category(self, queryset, name, value):
         return queryset.filter(category__in=self.request.GET.getlist('category'))
@@ -39,10 +44,11 @@ class ProductFilter(FilterSet):
         return queryset.filter(brand__in=self.request.GET.getlist('brand'))
 
     def filter_characteristics(self, queryset, name, value):
-        result = queryset
-        for c in self.request.GET.getlist('characteristics'):
-            result = result.filter(characteristics__in=[c])
-        return result
+        return CharacteristicIndex.objects.filter_products(queryset, self.request.GET.getlist('characteristics'))
+
+    def filter_characteristics_any(self, queryset, name, value):
+        return CharacteristicIndex.objects.filter_products(queryset, self.request.GET.getlist('characteristics_any'),
+                                                           match_all=False)
 
     def filter_recommended(self, queryset, name, value):
         return queryset.filter(is_recommended=True)
@@ -59,6 +65,23 @@ class ProductFilter(FilterSet):
     def filter_by_price_cheap(self, queryset, name, value):
         return queryset.order_by('current_price')
 
+    def filter_by_rating(self, queryset, name, value):
+        return queryset.order_by('-rating')
+
     class Meta:
         model = models.Product
-        fields = []
\ No newline at end of file
+        fields = []
+
+
+class ProductSearchFilter(SearchFilter):
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        product_ids = get_search_index().search(query)
+        if not product_ids:
+            return queryset.none()
+        # without an explicit ordering KeysetPagination pages through the matches in the index's order
+        request.ranked_ids = product_ids
+        return queryset.filter(id__in=id_values(product_ids))
@@ -0,0 +1,236 @@
+import csv
+import json
+import time
+
+from django.db import connection, transaction
+
+from common import messages
+from common.cache import bump_model_version
+from common.utils import id_values
+from core.models import Brand, Category
+from market.models import Product, Property, ProductCharacteristics, CharacteristicIndex
+from market.search import get_search_index
+
+IMPORT_CHUNK_SIZE = 2000
+# past this many rows the characteristic index is rebuilt once at the end instead of rewritten per chunk
+INDEX_REBUILD_THRESHOLD = 50000
+CATEGORY_SEPARATOR = '/'
+CHARACTERISTIC_SEPARATOR = ';'
+TRUE_VALUES = ('1', 'true', 'yes', 'да')
+
+
+def read_csv(file):
+    # characteristics go in one column as "Цвет=Черный;Память=128 ГБ"
+    reader = csv.DictReader(file)
+    for record in reader:
+        characteristics = record.get('characteristics') or ''
+        record['characteristics'] = [item.split('=', 1) for item in characteristics.split(CHARACTERISTIC_SEPARATOR)
+                                     if item.strip()]
+        yield reader.line_num, record
+
+
+def read_jsonl(file):
+    for line_number, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError:
+            yield line_number, None
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+class ProductImporter:
+    # upserts products by sku in chunked transactions, the through rows go in with bulk inserts
+    product_fields = ['name', 'current_price', 'real_price', 'discount', 'category_id', 'brand_id',
+                      'is_recommended', 'is_popular', 'is_new']
+
+    def __init__(self, chunk_size=IMPORT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.created = 0
+        self.updated = 0
+        self.skipped = []
+        self.brands = {}
+        self.categories = {}
+        self.properties = {}
+        self.characteristics = {}
+        self.changed_models = set()
+        self.rebuild_index = False
+
+    def run(self, records):
+        # yields the number of processed rows and elapsed seconds after every chunk
+        started = time.perf_counter()
+        self.load()
+        rows = 0
+        chunk = []
+        for line_number, record in records:
+            try:
+                chunk.append(self.clean(record))
+            except ValueError as e:
+                self.skipped.append((line_number, str(e)))
+            rows += 1
+            if rows > INDEX_REBUILD_THRESHOLD:
+                self.rebuild_index = True
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+                yield rows, time.perf_counter() - started
+        if chunk:
+            self.import_chunk(chunk)
+        if self.rebuild_index:
+            CharacteristicIndex.objects.rebuild()
+        for model in self.changed_models:
+            bump_model_version(model)
+        yield rows, time.perf_counter() - started
+
+    def load(self):
+        for brand_id, name in Brand.objects.order_by('-id').values_list('id', 'name'):
+            self.brands[name] = brand_id
+        for category_id, parent_id, name in Category.objects.order_by('-id').values_list('id', 'parent_id', 'name'):
+            self.categories[(parent_id, name)] = category_id
+        for property_id, name in Property.objects.order_by('-id').values_list('id', 'name'):
+            self.properties[name] = property_id
+
+    @staticmethod
+    def clean(record):
+        if not isinstance(record, dict):
+            raise ValueError(messages.INVALID_IMPORT_RECORD)
+        sku = str(record.get('sku') or '').strip()
+        if not sku:
+            raise ValueError(messages.NO_SKU)
+        name = str(record.get('name') or '').strip()
+        if not name:
+            raise ValueError(messages.NO_PRODUCT_NAME)
+        try:
+            current_price = int(record['current_price'])
+            real_price = int(record.get('real_price') or current_price)
+            discount = int(record['discount']) if record.get('discount') not in (None, '') else None
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(messages.INVALID_PRICE)
+        characteristics = record.get('characteristics') or []
+        if isinstance(characteristics, dict):
+            characteristics = characteristics.items()
+        try:
+            characteristics = [(str(prop).strip(), str(value).strip()) for prop, value in characteristics]
+        except (TypeError, ValueError):
+            raise ValueError(messages.INVALID_CHARACTERISTICS)
+        category = record.get('category') or ''
+        if isinstance(category, str):
+            category = category.split(CATEGORY_SEPARATOR)
+        return {
+            'sku': sku,
+            'name': name,
+            'current_price': current_price,
+            'real_price': real_price,
+            'discount': discount,
+            'brand': str(record.get('brand') or '').strip(),
+            'category': [str(name).strip() for name in category if str(name).strip()],
+            'characteristics': [(prop, value) for prop, value in characteristics if prop and value],
+            'is_recommended': str(record.get('is_recommended')).lower() in TRUE_VALUES,
+            'is_popular': str(record.get('is_popular')).lower() in TRUE_VALUES,
+            'is_new': str(record.get('is_new')).lower() in TRUE_VALUES,
+        }
+
+    def import_chunk(self, chunk):
+        # a later row with the same sku wins
+        chunk = list({record['sku']: record for record in chunk}.values())
+        with transaction.atomic():
+            self.resolve_brands(chunk)
+            self.resolve_categories(chunk)
+            self.resolve_characteristics(chunk)
+            product_ids = self.upsert_products(chunk)
+            self.replace_characteristics(chunk, product_ids)
+            get_search_index().index(product_ids.values())
+
+    def resolve_brands(self, chunk):
+        names = {record['brand'] for record in chunk if record['brand']} - set(self.brands)
+        if names:
+            Brand.objects.bulk_create([Brand(name=name) for name in names])
+            self.brands.update({name: brand_id for brand_id, name in Brand.objects.filter(name__in=names)
+                               .order_by('-id').values_list('id', 'name')})
+            self.changed_models.add(Brand)
+
+    def resolve_categories(self, chunk):
+        # categories are few, they are created one by one so every node gets its materialized path
+        for record in chunk:
+            parent_id = None
+            for name in record['category']:
+                category_id = self.categories.get((parent_id, name))
+                if category_id is None:
+                    category_id = Category.objects.create(name=name, parent_id=parent_id).id
+                    self.categories[(parent_id, name)] = category_id
+                parent_id = category_id
+            record['category_id'] = parent_id
+
+    def resolve_characteristics(self, chunk):
+        names = {prop for record in chunk for prop, _ in record['characteristics']} - set(self.properties)
+        if names:
+            Property.objects.bulk_create([Property(name=name) for name in names])
+            self.properties.update({name: property_id for property_id, name in Property.objects
+                                   .filter(name__in=names).order_by('-id').values_list('id', 'name')})
+            self.changed_models.add(Property)
+
+        keys = {(self.properties[prop], value) for record in chunk for prop, value in record['characteristics']}
+        missing = keys - set(self.characteristics)
+        if missing:
+            self.load_characteristics(missing)
+            missing -= set(self.characteristics)
+        if missing:
+            ProductCharacteristics.objects.bulk_create(
+                [ProductCharacteristics(property_id=property_id, value=value) for property_id, value in missing])
+            self.load_characteristics(missing)
+            self.changed_models.add(ProductCharacteristics)
+
+    def load_characteristics(self, keys):
+        property_ids = {property_id for property_id, _ in keys}
+        values = {value for _, value in keys}
+        for characteristic_id, property_id, value in ProductCharacteristics.objects \
+                .filter(property_id__in=id_values(property_ids), value__in=id_values(values)) \
+                .order_by('-id').values_list('id', 'property_id', 'value'):
+            if (property_id, value) in keys:
+                self.characteristics[(property_id, value)] = characteristic_id
+
+    def upsert_products(self, chunk):
+        skus = [record['sku'] for record in chunk]
+        existing = dict(Product.objects.filter(sku__in=id_values(skus)).values_list('sku', 'id'))
+        products = [Product(id=existing.get(record['sku']), sku=record['sku'],
+                            brand_id=self.brands.get(record['brand']),
+                            **{field: record[field] for field in self.product_fields if field != 'brand_id'})
+                    for record in chunk]
+        Product.objects.bulk_create([product for product in products if product.id is None])
+        Product.objects.bulk_update([product for product in products if product.id is not None], self.product_fields)
+        self.updated += len(existing)
+        self.created += len(chunk) - len(existing)
+        self.changed_models.add(Product)
+        # SQLite does not return primary keys from bulk inserts
+        return dict(Product.objects.filter(sku__in=id_values(skus)).values_list('sku', 'id'))
+
+    def replace_characteristics(self, chunk, product_ids):
+        through = Product.characteristics.through
+        rows = {(self.characteristics[(self.properties[prop], value)], product_ids[record['sku']])
+                for record in chunk for prop, value in record['characteristics']}
+        old_rows = {(characteristic_id, product_id): row_id for row_id, characteristic_id, product_id in through.objects
+                    .filter(product_id__in=id_values(product_ids.values()))
+                    .values_list('id', 'productcharacteristics_id', 'product_id')}
+        removed = set(old_rows) - rows
+        added = rows - set(old_rows)
+        if removed:
+            through.objects.filter(id__in=id_values([old_rows[row] for row in removed])).delete()
+        # the through rows are plain id pairs, a prepared statement skips building a model instance per row
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {through._meta.db_table} (productcharacteristics_id, product_id) '
+                               f'VALUES (%s, %s)', list(added))
+        if not self.rebuild_index:
+            CharacteristicIndex.objects.apply(self.group(added), self.group(removed))
+
+    @staticmethod
+    def group(rows):
+        groups = {}
+        for characteristic_id, product_id in rows:
+            groups.setdefault(characteristic_id, set()).add(product_id)
+        return groups
@@ -0,0 +1,38 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from common import messages
+from market.importer import ProductImporter, READERS, IMPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or JSONL file, existing products are updated by sku'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, "-" reads stdin')
+        parser.add_argument('--format', choices=sorted(READERS), help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(messages.UNKNOWN_IMPORT_FORMAT)
+
+        importer = ProductImporter(chunk_size=options['chunk_size'])
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8', newline='')
+        try:
+            for rows, elapsed in importer.run(READERS[file_format](file)):
+                if options['verbosity'] > 0:
+                    self.stdout.write(f'{rows} rows, {rows / elapsed:.0f} rows/sec')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        for line_number, error in importer.skipped:
+            self.stderr.write(f'line {line_number}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/sec): '
+            f'{importer.created} created, {importer.updated} updated, {len(importer.skipped)} skipped'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from market.models import CharacteristicIndex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild characteristic posting lists from product characteristics'
+
+    def handle(self, *args, **options):
+        count = CharacteristicIndex.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Characteristic index rebuilt: {count} characteristics'))
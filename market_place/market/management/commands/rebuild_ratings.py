@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from market.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalized product rating counters from reviews'
+
+    def handle(self, *args, **options):
+        updated = Product.objects.rebuild_ratings()
+        self.stdout.write(self.style.SUCCESS(f'Ratings rebuilt for {updated} products'))
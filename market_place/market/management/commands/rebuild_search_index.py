@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from market.search import get_search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index'
+
+    def handle(self, *args, **options):
+        get_search_index().rebuild()
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
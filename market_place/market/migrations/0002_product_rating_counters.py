@@ -0,0 +1,43 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:55
+
+from django.db import migrations, models
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When, ExpressionWrapper
+from django.db.models.functions import Cast, Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    Product = apps.get_model('market', 'Product')
+    ProductReview = apps.get_model('market', 'ProductReview')
+    reviews = ProductReview.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    Product.objects.update(
+        rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+        rating_count=Coalesce(Subquery(reviews.annotate(total=Count('id')).values('total')), 0))
+    Product.objects.update(rating=Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=ExpressionWrapper(Cast('rating_sum', FloatField()) / F('rating_count'), output_field=FloatField())))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating',
+            field=models.FloatField(db_index=True, default=0, verbose_name='Рейтинг'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.IntegerField(default=0, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.IntegerField(default=0, verbose_name='Сумма оценок'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_index(apps, schema_editor):
+    Product = apps.get_model('market', 'Product')
+    ProductCharacteristics = apps.get_model('market', 'ProductCharacteristics')
+    CharacteristicIndex = apps.get_model('market', 'CharacteristicIndex')
+    postings = {characteristic_id: [] for characteristic_id in ProductCharacteristics.objects.values_list('id', flat=True)}
+    rows = Product.characteristics.through.objects.order_by('product_id') \
+        .values_list('productcharacteristics_id', 'product_id')
+    for characteristic_id, product_id in rows.iterator():
+        postings[characteristic_id].append(product_id)
+    CharacteristicIndex.objects.bulk_create(
+        [CharacteristicIndex(characteristic_id=characteristic_id, product_ids=product_ids)
+         for characteristic_id, product_ids in postings.items()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0002_product_rating_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CharacteristicIndex',
+            fields=[
+                ('characteristic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='index', serialize=False, to='market.productcharacteristics', verbose_name='Характеристика')),
+                ('product_ids', models.JSONField(default=list, verbose_name='Товары')),
+            ],
+            options={
+                'verbose_name': 'Индекс характеристики',
+                'verbose_name_plural': 'Индекс характеристик',
+            },
+        ),
+        migrations.RunPython(fill_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0003_characteristic_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='rating',
+            field=models.FloatField(default=0, verbose_name='Рейтинг'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['current_price', 'id'], name='market_prod_current_283c38_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['rating', 'id'], name='market_prod_rating_d3e9c6_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:05
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS market_product_fts "
+                          "USING fts5(name, brand, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4 5 6')")
+    schema_editor.execute("""
+        INSERT INTO market_product_fts (rowid, name, brand, description)
+        SELECT p.id, p.name, COALESCE(b.name, ''),
+               COALESCE((SELECT group_concat(c.value, ' ')
+                         FROM market_product_characteristics pc
+                         JOIN market_productcharacteristics c ON c.id = pc.productcharacteristics_id
+                         JOIN market_property pr ON pr.id = c.property_id
+                         WHERE pc.product_id = p.id AND pr.is_description), '')
+        FROM market_product p LEFT JOIN core_brand b ON b.id = p.brand_id
+    """)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS market_product_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_category_path'),
+        ('market', '0004_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0006_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productavailability',
+            index=models.Index(fields=['product', 'amount', 'shop'], name='market_prod_product_57f32f_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0007_availability_stock_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productavailability',
+            name='market_prod_product_57f32f_idx',
+        ),
+        migrations.AddField(
+            model_name='productavailability',
+            name='reserved',
+            field=models.IntegerField(default=0, editable=False, verbose_name='Зарезервировано'),
+        ),
+        migrations.AddIndex(
+            model_name='productavailability',
+            index=models.Index(fields=['product', 'shop', 'amount', 'reserved'], name='market_prod_product_d7a37e_idx'),
+        ),
+    ]
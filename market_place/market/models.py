@@ -1,13 +1,24 @@
+import time
+from itertools import groupby
+from operator import itemgetter
+
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models import Q
-
-from core.models import Category, Brand
+from django.db import models, transaction
+from django.db.models import F, Q, Prefetch, Case, When, Value, Sum, Count, Subquery, OuterRef, Exists, \
+    FloatField, ExpressionWrapper
+from django.db.models.functions import Cast, Coalesce
+
+from core.models import Category, Brand, Shop
+from common import messages
+from common.cache import bump_model_version
+from common.utils import id_values
 from common.validators import validate_file_size, validate_extension
 
 User = get_user_model()
 
+BULK_CHUNK_SIZE = 500
+
 
 class GroupProperties(models.Model):
     name = models.CharField(verbose_name='Наименование', max_length=200)
@@ -73,30 +84,92 @@ class ProductReview(models.Model):
 class ProductManager(models.Manager):
 
     def category_filter(self, category):
-        return Product.objects.filter(Q(category=category) |
-                                      Q(category__parent=category) |
-                                      Q(category__parent__parent=category))
-
-    def set_discounts(self, product_ids, discount):
-        products = Product.objects.filter(id__in=product_ids)
-        for p in products:
-            discount_price = p.real_price - p.real_price * (discount / 100)
-            p.current_price = discount_price
-            p.discount = discount
-            p.save()
-
-    def remove_discounts(self, product_ids):
-        for p in Product.objects.filter(id__in=product_ids):
-            p.discount = None
-            p.current_price = p.real_price
-            p.save()
+        if isinstance(category, Category):
+            path = category.path
+        else:
+            path = Subquery(Category.objects.filter(pk=category).values('path'))
+        return Product.objects.filter(category__path__startswith=path)
+
+    def set_discounts(self, discount, product_ids=None, category=None, brand=None):
+        discount = int(discount)
+        # integer division truncates the same way int() did for the old per-row float price
+        return self._bulk_update(product_ids, category, brand,
+                                 discount=discount,
+                                 current_price=F('real_price') * (100 - discount) / 100)
+
+    def remove_discounts(self, product_ids=None, category=None, brand=None):
+        return self._bulk_update(product_ids, category, brand, discount=None, current_price=F('real_price'))
+
+    def _bulk_update(self, product_ids, category, brand, **values):
+        if product_ids is None and category is None and brand is None:
+            raise ValueError(messages.NO_PRODUCTS_SELECTED)
+        queryset = Product.objects.all()
+        if category is not None:
+            queryset = queryset.filter(id__in=self.category_filter(category).values('id'))
+        if brand is not None:
+            queryset = queryset.filter(brand_id=brand)
+        started = time.perf_counter()
+        updated = 0
+        with transaction.atomic():
+            if product_ids is None:
+                updated = queryset.update(**values)
+            else:
+                product_ids = list(product_ids)
+                for i in range(0, len(product_ids), BULK_CHUNK_SIZE):
+                    updated += queryset.filter(id__in=product_ids[i:i + BULK_CHUNK_SIZE]).update(**values)
+        bump_model_version(Product)
+        return {'updated': updated, 'elapsed': round(time.perf_counter() - started, 4)}
 
     def discounts(self):
         return Product.objects.filter(discount__isnull=False)
 
+    def with_details(self):
+        descriptions = ProductCharacteristics.objects.filter(property__is_description=True).select_related('property')
+        return Product.objects.select_related('brand', 'category') \
+            .prefetch_related(Prefetch('characteristics', queryset=descriptions, to_attr='description_characteristics'))
+
+    def add_review(self, product, review):
+        with transaction.atomic():
+            product.reviews.add(review)
+            self._change_rating(Product.objects.filter(id=product.id), review.rating, 1)
+
+    def remove_review(self, review):
+        with transaction.atomic():
+            product_ids = list(Product.objects.filter(reviews=review).values_list('id', flat=True))
+            review.delete()
+            self._change_rating(Product.objects.filter(id__in=product_ids), -review.rating, -1)
+
+    def rebuild_ratings(self):
+        reviews = ProductReview.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        with transaction.atomic():
+            Product.objects.update(
+                rating_sum=Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0),
+                rating_count=Coalesce(Subquery(reviews.annotate(total=Count('id')).values('total')), 0))
+            updated = Product.objects.update(rating=Case(
+                When(rating_count=0, then=Value(0.0)),
+                default=ExpressionWrapper(Cast('rating_sum', FloatField()) / F('rating_count'),
+                                          output_field=FloatField())))
+        bump_model_version(Product)
+        return updated
+
+    def _change_rating(self, queryset, points, count):
+        # rating_sum and rating_count on the right-hand side are read before the update,
+        # so the average is computed from the new totals in the same statement
+        new_sum = F('rating_sum') + points
+        new_count = F('rating_count') + count
+        updated = queryset.update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating=Case(When(rating_count__lte=-count, then=Value(0.0)),
+                        default=ExpressionWrapper(Cast(new_sum, FloatField()) / new_count,
+                                                  output_field=FloatField())))
+        bump_model_version(Product)
+        return updated
+
 
 class Product(models.Model):
     name = models.CharField(verbose_name='Наименование', max_length=200)
+    sku = models.CharField(verbose_name='Артикул', max_length=64, unique=True, null=True, blank=True)
     discount = models.IntegerField(verbose_name='Скидка', null=True, blank=True)
     current_price = models.IntegerField(verbose_name='Текущая цена')
     real_price = models.IntegerField(verbose_name='Настоящая цена', default='current_price')
@@ -113,23 +186,105 @@ class Product(models.Model):
     is_recommended = models.BooleanField(verbose_name='Рекомендованный', default=False)
     is_popular = models.BooleanField(verbose_name='Популярный', default=False)
     is_new = models.BooleanField(verbose_name='Новинка', default=False)
+    rating = models.FloatField(verbose_name='Рейтинг', default=0)
+    rating_sum = models.IntegerField(verbose_name='Сумма оценок', default=0)
+    rating_count = models.IntegerField(verbose_name='Количество оценок', default=0)
     objects = ProductManager()
 
     class Meta:
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
+        indexes = [
+            models.Index(fields=['current_price', 'id']),
+            models.Index(fields=['rating', 'id']),
+        ]
 
     def __str__(self):
         return self.name
 
-    @property
-    def rating(self):
-        reviews = self.reviews.all()
-        if reviews.count() == 0:
-            return 0
-        data = reviews.aggregate(sum_points=models.Sum('rating'))
-        overall_rating = data['sum_points'] / reviews.count()
-        return "{:.2f}".format(overall_rating)
+
+class CharacteristicIndexManager(models.Manager):
+
+    def products(self, characteristic_ids, match_all=True):
+        characteristic_ids = set(characteristic_ids)
+        postings = [set(ids) for ids in CharacteristicIndex.objects.filter(characteristic_id__in=characteristic_ids)
+                    .values_list('product_ids', flat=True)]
+        if not postings:
+            return []
+        if match_all:
+            if len(postings) < len(characteristic_ids):
+                return []
+            postings.sort(key=len)
+            return sorted(postings[0].intersection(*postings[1:]))
+        return sorted(set().union(*postings))
+
+    def filter_products(self, queryset, characteristic_ids, match_all=True):
+        characteristic_ids = [int(c) for c in characteristic_ids if str(c).isdigit()]
+        if not characteristic_ids:
+            return queryset
+        return queryset.filter(id__in=id_values(self.products(characteristic_ids, match_all)))
+
+    def add(self, characteristic_ids, product_ids):
+        product_ids = set(product_ids)
+        self._change(characteristic_ids, lambda characteristic_id, ids: ids | product_ids)
+
+    def remove(self, characteristic_ids, product_ids):
+        product_ids = set(product_ids)
+        self._change(characteristic_ids, lambda characteristic_id, ids: ids - product_ids)
+
+    def apply(self, added, removed=None):
+        # added and removed map characteristic ids to the product ids each of them gained or lost
+        removed = removed or {}
+        self._change(set(added) | set(removed),
+                     lambda characteristic_id, ids: ids - removed.get(characteristic_id, set())
+                     | added.get(characteristic_id, set()))
+
+    def rebuild(self):
+        through = Product.characteristics.through
+        rows = through.objects.order_by('productcharacteristics_id', 'product_id') \
+            .values_list('productcharacteristics_id', 'product_id').iterator()
+        with transaction.atomic():
+            CharacteristicIndex.objects.all().delete()
+            batch = []
+            for characteristic_id, group in groupby(rows, key=itemgetter(0)):
+                batch.append(CharacteristicIndex(characteristic_id=characteristic_id,
+                                                 product_ids=[product_id for _, product_id in group]))
+                if len(batch) >= BULK_CHUNK_SIZE:
+                    CharacteristicIndex.objects.bulk_create(batch)
+                    batch = []
+            CharacteristicIndex.objects.bulk_create(batch)
+            empty = ProductCharacteristics.objects.filter(index__isnull=True).values_list('id', flat=True)
+            CharacteristicIndex.objects.bulk_create(
+                [CharacteristicIndex(characteristic_id=characteristic_id) for characteristic_id in empty],
+                batch_size=BULK_CHUNK_SIZE)
+            return CharacteristicIndex.objects.count()
+
+    def _change(self, characteristic_ids, change):
+        characteristic_ids = set(characteristic_ids)
+        with transaction.atomic():
+            rows = list(CharacteristicIndex.objects.select_for_update()
+                        .filter(characteristic_id__in=characteristic_ids))
+            missing = characteristic_ids - {row.characteristic_id for row in rows}
+            if missing:
+                # a concurrent writer may create the same rows, they are inserted empty and locked again
+                CharacteristicIndex.objects.bulk_create(
+                    [CharacteristicIndex(characteristic_id=characteristic_id) for characteristic_id in missing],
+                    ignore_conflicts=True)
+                rows += CharacteristicIndex.objects.select_for_update().filter(characteristic_id__in=missing)
+            for row in rows:
+                row.product_ids = sorted(change(row.characteristic_id, set(row.product_ids)))
+            CharacteristicIndex.objects.bulk_update(rows, ['product_ids'])
+
+
+class CharacteristicIndex(models.Model):
+    characteristic = models.OneToOneField(ProductCharacteristics, on_delete=models.CASCADE, primary_key=True,
+                                          related_name='index', verbose_name='Характеристика')
+    product_ids = models.JSONField(verbose_name='Товары', default=list)
+    objects = CharacteristicIndexManager()
+
+    class Meta:
+        verbose_name = 'Индекс характеристики'
+        verbose_name_plural = 'Индекс характеристик'
 
 
 class ProductUnit(models.Model):
@@ -141,9 +296,79 @@ class ProductUnit(models.Model):
         abstract = True
 
 
+class ProductAvailabilityManager(models.Manager):
+
+    def shops_for(self, items, city):
+        # items maps product ids to required amounts; one grouped query keeps the shops of the city
+        # that can hand out every line, the ones with the most free stock of these products first
+        items = {product_id: amount for product_id, amount in items.items() if amount > 0}
+        if not items:
+            return []
+        # the city goes in as EXISTS, so the planner drives the search from the product stock index
+        # instead of walking every row of every shop in the city
+        in_city = Exists(Shop.objects.filter(pk=OuterRef('shop_id'), city=city))
+        return list(ProductAvailability.objects.filter(self.enough(items), in_city)
+                    .values('shop_id')
+                    .annotate(lines=Count('product_id', distinct=True), stock=Sum(F('amount') - F('reserved')))
+                    .filter(lines=len(items))
+                    .order_by('-stock', 'shop_id')
+                    .values_list('shop_id', flat=True))
+
+    @staticmethod
+    def enough(items):
+        # rows that can still hand out the required amount of any of the lines
+        condition = Q()
+        for product_id, amount in items.items():
+            condition |= Q(product_id=product_id, amount__gte=F('reserved') + amount)
+        return condition
+
+    def with_available(self):
+        return self.annotate(available=F('amount') - F('reserved'))
+
+    def available(self, product_ids, shop):
+        # served from the (product, shop, amount, reserved) index alone
+        return dict(ProductAvailability.objects.filter(product_id__in=product_ids, shop=shop)
+                    .values_list('product_id').annotate(available=Sum(F('amount') - F('reserved'))))
+
+    def reserve(self, shop, items):
+        # one UPDATE holds every line in the shop; rows short of free stock are left alone, so the caller
+        # compares the number of updated rows with the number of lines and rolls back on a mismatch
+        items = {product_id: amount for product_id, amount in items.items() if amount > 0}
+        if not items:
+            return 0
+        return ProductAvailability.objects.filter(self.enough(items), shop=shop).update(
+            reserved=F('reserved') + Case(*[When(product_id=product_id, then=Value(amount))
+                                            for product_id, amount in items.items()]))
+
+    def release(self, holds):
+        # holds map (shop id, product id) pairs to held amounts
+        return self._change_stock(holds, reserved=-1)
+
+    def consume(self, holds):
+        # held stock leaves the shop
+        return self._change_stock(holds, reserved=-1, amount=-1)
+
+    def _change_stock(self, holds, **signs):
+        holds = {key: amount for key, amount in holds.items() if amount > 0}
+        if not holds:
+            return 0
+        change = Case(*[When(shop_id=shop_id, product_id=product_id, then=Value(amount))
+                        for (shop_id, product_id), amount in holds.items()], default=Value(0))
+        condition = Q()
+        for shop_id, product_id in holds:
+            condition |= Q(shop_id=shop_id, product_id=product_id)
+        return ProductAvailability.objects.filter(condition).update(
+            **{field: F(field) + sign * change for field, sign in signs.items()})
+
+
 class ProductAvailability(ProductUnit):
     shop = models.ForeignKey('core.Shop', on_delete=models.CASCADE, related_name='avalability', verbose_name='Магазин')
+    reserved = models.IntegerField(verbose_name='Зарезервировано', default=0, editable=False)
+    objects = ProductAvailabilityManager()
 
     class Meta:
         verbose_name = 'Наличие товара'
         verbose_name_plural = 'Наличие товаров'
+        indexes = [
+            models.Index(fields=['product', 'shop', 'amount', 'reserved']),
+        ]
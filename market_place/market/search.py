@@ -0,0 +1,110 @@
+import re
+
+from django.db import connection
+from django.db.models import Q, Case, When, Value
+
+from market.models import Product, BULK_CHUNK_SIZE
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+class ProductSearchIndex:
+    # ranked product search over name, brand name and description characteristic values; this base version
+    # is the fallback for backends without a local full-text engine and reads the product tables directly,
+    # so there is no index to maintain. Every token has to match, the last one as a prefix
+
+    def search(self, query, limit=None):
+        tokens = self.tokens(query)
+        if not tokens:
+            return []
+        descriptions = Product.characteristics.through.objects.filter(
+            productcharacteristics__property__is_description=True)
+        queryset = Product.objects.all()
+        for token in tokens:
+            in_description = descriptions.filter(productcharacteristics__value__icontains=token).values('product_id')
+            queryset = queryset.filter(Q(name__icontains=token) | Q(brand__name__icontains=token)
+                                       | Q(id__in=in_description))
+        # a name match ranks above a brand match, which ranks above a description match
+        rank = sum((Case(When(**{f'{field}__icontains': token}, then=Value(weight)), default=Value(0))
+                    for token in tokens for field, weight in (('name', 10), ('brand__name', 5))), Value(0))
+        ids = queryset.annotate(search_rank=rank).order_by('-search_rank', '-rating', 'id').values_list('id', flat=True)
+        return list(ids[:limit] if limit else ids)
+
+    def index(self, product_ids):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def rebuild(self):
+        pass
+
+    @staticmethod
+    def tokens(query):
+        return TOKEN_RE.findall(query.lower())
+
+    @staticmethod
+    def documents(product_ids):
+        descriptions = {}
+        values = Product.characteristics.through.objects \
+            .filter(product_id__in=product_ids, productcharacteristics__property__is_description=True) \
+            .values_list('product_id', 'productcharacteristics__value')
+        for product_id, value in values:
+            descriptions.setdefault(product_id, []).append(value)
+        for product_id, name, brand in Product.objects.filter(id__in=product_ids) \
+                .values_list('id', 'name', 'brand__name'):
+            yield product_id, name, brand or '', ' '.join(descriptions.get(product_id, []))
+
+
+class SqliteSearchIndex(ProductSearchIndex):
+    table = 'market_product_fts'
+    # bm25 column weights: name, brand, description
+    weights = (10.0, 5.0, 1.0)
+
+    def search(self, query, limit=None):
+        tokens = self.tokens(query)
+        if not tokens:
+            return []
+        # the last token is still being typed, it matches as a prefix; short prefixes come from the table's
+        # prefix indexes, longer ones scan a narrow range of terms
+        match = ' '.join([f'"{token}"' for token in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+        # bm25 ranks every match, the newest product wins a tie; a negative LIMIT returns them all
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                           f'ORDER BY bm25({self.table}, %s, %s, %s), rowid DESC LIMIT %s',
+                           [match, *self.weights, limit or -1])
+            return [row[0] for row in cursor.fetchall()]
+
+    def index(self, product_ids):
+        product_ids = list(product_ids)
+        for i in range(0, len(product_ids), BULK_CHUNK_SIZE):
+            chunk = product_ids[i:i + BULK_CHUNK_SIZE]
+            self.remove(chunk)
+            with connection.cursor() as cursor:
+                cursor.executemany(f'INSERT INTO {self.table} (rowid, name, brand, description) '
+                                   f'VALUES (%s, %s, %s, %s)', list(self.documents(chunk)))
+
+    def remove(self, product_ids):
+        product_ids = list(product_ids)
+        with connection.cursor() as cursor:
+            for i in range(0, len(product_ids), BULK_CHUNK_SIZE):
+                chunk = product_ids[i:i + BULK_CHUNK_SIZE]
+                cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({", ".join(["%s"] * len(chunk))})', chunk)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        last_id = 0
+        while True:
+            product_ids = list(Product.objects.filter(id__gt=last_id).order_by('id')
+                               .values_list('id', flat=True)[:BULK_CHUNK_SIZE])
+            if not product_ids:
+                break
+            self.index(product_ids)
+            last_id = product_ids[-1]
+
+
+def get_search_index():
+    if connection.vendor == 'sqlite':
+        return SqliteSearchIndex()
+    return ProductSearchIndex()
@@ -49,7 +49,7 @@ class CharacteristicsSerializer(CharacteristicsBaseSerializer):
 
 
 class ProductSerializer(serializers.ModelSerializer):
-    rating = serializers.FloatField(read_only=True)
+    rating = serializers.DecimalField(max_digits=3, decimal_places=2, coerce_to_string=False, read_only=True)
 
     class Meta:
         model = Product
@@ -61,11 +61,13 @@ class ProductDetailSerializer(ProductSerializer):
     characteristics = serializers.SerializerMethodField()
 
     class Meta(ProductSerializer.Meta):
-        fields = ProductSerializer.Meta.fields + ['category', 'brand', 'characteristics', 'is_recommended',
+        fields = ProductSerializer.Meta.fields + ['sku', 'category', 'brand', 'characteristics', 'is_recommended',
                                                   'is_popular']
 
     def get_characteristics(self, obj):
-        characteristics = obj.characteristics.filter(property__is_description=True)
+        characteristics = getattr(obj, 'description_characteristics', None)
+        if characteristics is None:
+            characteristics = obj.characteristics.filter(property__is_description=True).select_related('property')
         return CharacteristicsSerializer(characteristics, many=True).data
 
 
@@ -73,19 +75,20 @@ class ProductCreateSerializer(ProductSerializer):
     characteristics = serializers.ListSerializer(child=serializers.IntegerField(), write_only=True)
 
     class Meta(ProductSerializer.Meta):
-        fields = ProductSerializer.Meta.fields + ['category', 'brand', 'characteristics', 'is_recommended',
+        fields = ProductSerializer.Meta.fields + ['sku', 'category', 'brand', 'characteristics', 'is_recommended',
                                                   'is_popular']
 
     def create(self, validated_data):
         characteristics_ids = validated_data.pop('characteristics')
         product = Product.objects.create(**validated_data)
         characteristics = ProductCharacteristics.objects.filter(id__in=characteristics_ids)
-        for ch in characteristics:
-            product.characteristics.add(ch.id)
+        product.characteristics.add(*characteristics)
         return product
 
 
 class ProductAvailabilitySerializer(serializers.ModelSerializer):
+    available = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = ProductAvailability
-        fields = ['id', 'product', 'shop', 'amount']
\ No newline at end of file
+        fields = ['id', 'product', 'shop', 'amount', 'reserved', 'available']
\ No newline at end of file
@@ -0,0 +1,81 @@
+from django.db.models.signals import m2m_changed, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from common.cache import track_changes, bump_model_version
+from core.models import Brand
+from market.models import Product, ProductCharacteristics, CharacteristicIndex, Property, GroupProperties
+from market.search import get_search_index
+
+track_changes(Product, ProductCharacteristics, Property, GroupProperties)
+
+
+@receiver(post_save, sender=ProductCharacteristics)
+def create_characteristic_index(sender, instance, created, **kwargs):
+    if created:
+        CharacteristicIndex.objects.get_or_create(characteristic=instance)
+
+
+@receiver(m2m_changed, sender=Product.characteristics.through)
+def update_characteristic_index(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        if reverse:
+            CharacteristicIndex.objects.filter(characteristic_id=instance.pk).update(product_ids=[])
+        else:
+            characteristic_ids = instance.characteristics.values_list('id', flat=True)
+            CharacteristicIndex.objects.remove(characteristic_ids, [instance.pk])
+    elif action in ('post_add', 'post_remove') and pk_set:
+        characteristic_ids, product_ids = ([instance.pk], pk_set) if reverse else (pk_set, [instance.pk])
+        if action == 'post_add':
+            CharacteristicIndex.objects.add(characteristic_ids, product_ids)
+        else:
+            CharacteristicIndex.objects.remove(characteristic_ids, product_ids)
+
+
+@receiver(pre_delete, sender=Product)
+def remove_from_characteristic_index(sender, instance, **kwargs):
+    characteristic_ids = instance.characteristics.values_list('id', flat=True)
+    CharacteristicIndex.objects.remove(characteristic_ids, [instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    get_search_index().index([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_search(sender, instance, **kwargs):
+    get_search_index().remove([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.characteristics.through)
+def index_product_characteristics(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._search_product_ids = list(instance.product.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove', 'post_clear'):
+        bump_model_version(Product)
+        if not reverse:
+            product_ids = [instance.pk]
+        elif action == 'post_clear':
+            product_ids = getattr(instance, '_search_product_ids', [])
+        else:
+            product_ids = pk_set or []
+        get_search_index().index(product_ids)
+
+
+@receiver(post_save, sender=Brand)
+def index_brand_products(sender, instance, created, **kwargs):
+    if not created:
+        get_search_index().index(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=ProductCharacteristics)
+def index_characteristic_products(sender, instance, created, **kwargs):
+    if not created:
+        get_search_index().index(instance.product.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Property)
+def index_property_products(sender, instance, created, **kwargs):
+    if not created:
+        get_search_index().index(Product.objects.filter(characteristics__property=instance)
+                                 .values_list('id', flat=True).distinct())
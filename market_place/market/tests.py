@@ -1,3 +1,483 @@
+import json
+import random
+import tempfile
+import time
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db.models import F
 from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from common import messages
+from common.benchmarks import benchmark, measure, report
+from common.pagination import KeysetPagination
+from core.models import Brand, Category
+from market.models import Product, Property, ProductCharacteristics, CharacteristicIndex, ProductReview, \
+    GroupProperties
+from market.search import get_search_index, ProductSearchIndex
+
+
+class ProductDetailQueriesTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='product', current_price=100, real_price=100,
+                                             brand=Brand.objects.create(name='brand'),
+                                             category=Category.objects.create(name='category'))
+        cls.description = Property.objects.create(name='description', is_description=True)
+        cls.hidden = Property.objects.create(name='hidden')
+
+    def add_characteristics(self, count):
+        for i in range(count):
+            self.product.characteristics.add(
+                ProductCharacteristics.objects.create(property=self.description, value=f'value {i}'),
+                ProductCharacteristics.objects.create(property=self.hidden, value=f'hidden {i}'))
+
+    def test_retrieve_query_count_does_not_grow_with_characteristics(self):
+        client = APIClient()
+        for count in (1, 10):
+            self.add_characteristics(count)
+            with self.assertNumQueries(2):
+                response = client.get(f'/market/products/{self.product.id}/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data['brand']['name'], 'brand')
+            self.assertTrue(all(c['property'] == 'description' for c in response.data['characteristics']))
+
+        self.assertEqual(len(response.data['characteristics']), 11)
+
+
+class ProductRatingTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100, real_price=100)
+                                     for i in range(5)])
+        cls.product = Product.objects.order_by('id').first()
+
+    def test_review_changes_rating_with_a_fixed_number_of_queries(self):
+        reviews = [ProductReview.objects.create(rating=rating) for rating in (5, 4, 1)]
+        for review in reviews:
+            # the m2m insert and one UPDATE of the counters inside a savepoint
+            with self.assertNumQueries(4):
+                Product.objects.add_review(self.product, review)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating), (10, 3, 10 / 3))
+
+        with self.assertNumQueries(6):
+            Product.objects.remove_review(reviews[0])
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating), (5, 2, 2.5))
+        for review in reviews[1:]:
+            Product.objects.remove_review(review)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating), (0, 0, 0))
+
+    def test_list_reads_the_stored_rating(self):
+        for rating in (5, 3):
+            Product.objects.add_review(self.product, ProductReview.objects.create(rating=rating))
+        with self.assertNumQueries(1):
+            response = APIClient().get('/market/products/')
+        self.assertEqual({row['id']: row['rating'] for row in response.data['results']}[self.product.id], 4)
+
+    def test_rebuild_ratings(self):
+        Product.objects.add_review(self.product, ProductReview.objects.create(rating=2))
+        Product.objects.filter(id=self.product.id).update(rating_sum=0, rating_count=0, rating=0)
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating), (2, 1, 2))
+
+
+class DiscountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        root = Category.objects.create(name='root')
+        child = Category.objects.create(name='child', parent=root)
+        other = Category.objects.create(name='other')
+        cls.brand = Brand.objects.create(name='brand')
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=999, real_price=999,
+                                             category=(root, child, other)[i % 3], brand=cls.brand if i < 3 else None)
+                                     for i in range(9)])
+        cls.root = root
+        cls.ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+
+    def prices(self):
+        return dict(Product.objects.values_list('id', 'current_price'))
+
+    def test_id_list_is_updated_in_chunks(self):
+        with patch('market.models.BULK_CHUNK_SIZE', 2), self.assertNumQueries(5):
+            # one UPDATE per chunk of two ids inside one savepoint
+            result = Product.objects.set_discounts(10, product_ids=self.ids[:5])
+        self.assertEqual(result['updated'], 5)
+        prices = self.prices()
+        self.assertEqual([prices[i] for i in self.ids], [899] * 5 + [999] * 4)
+        self.assertEqual(Product.objects.discounts().count(), 5)
+
+        Product.objects.remove_discounts(product_ids=self.ids)
+        self.assertEqual(set(self.prices().values()), {999})
+        self.assertFalse(Product.objects.discounts().exists())
+
+    def test_category_subtree_and_brand(self):
+        self.assertEqual(Product.objects.set_discounts(50, category=self.root.id)['updated'], 6)
+        self.assertEqual(Product.objects.set_discounts(20, category=self.root, brand=self.brand.id)['updated'], 2)
+        self.assertEqual(sorted(self.prices().values()), [499] * 4 + [799] * 2 + [999] * 3)
+
+    def test_nothing_selected(self):
+        with self.assertRaises(ValueError):
+            Product.objects.set_discounts(10)
+
+
+class CharacteristicIndexSyncTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100, real_price=100)
+                                     for i in range(4)])
+        cls.products = list(Product.objects.order_by('id'))
+        cls.group = GroupProperties.objects.create(name='group')
+        cls.color = Property.objects.create(name='color', group=cls.group)
+        cls.size = Property.objects.create(name='size', group=cls.group)
+        cls.red = ProductCharacteristics.objects.create(property=cls.color, value='red')
+        cls.blue = ProductCharacteristics.objects.create(property=cls.color, value='blue')
+        cls.large = ProductCharacteristics.objects.create(property=cls.size, value='large')
+
+    def assertIndexInSync(self):
+        expected = {characteristic_id: [] for characteristic_id in
+                    ProductCharacteristics.objects.values_list('id', flat=True)}
+        for characteristic_id, product_id in Product.characteristics.through.objects.order_by('product_id') \
+                .values_list('productcharacteristics_id', 'product_id'):
+            expected[characteristic_id].append(product_id)
+        self.assertEqual(dict(CharacteristicIndex.objects.values_list('characteristic_id', 'product_ids')), expected)
+
+    def test_index_follows_characteristic_changes(self):
+        first, second, third, fourth = self.products
+        first.characteristics.add(self.red, self.large)
+        second.characteristics.add(self.red)
+        self.blue.product.add(third, fourth)
+        self.assertIndexInSync()
+        self.assertEqual(CharacteristicIndex.objects.products([self.red.id, self.large.id]), [first.id])
+
+        first.characteristics.remove(self.red)
+        self.blue.product.remove(fourth)
+        self.assertIndexInSync()
+
+        second.characteristics.set([self.blue, self.large])
+        self.red.product.add(fourth)
+        self.assertIndexInSync()
+
+        first.characteristics.clear()
+        self.blue.product.clear()
+        self.assertIndexInSync()
+
+        green = ProductCharacteristics.objects.create(property=self.color, value='green')
+        self.assertEqual(CharacteristicIndex.objects.get(characteristic=green).product_ids, [])
+        green.product.add(first)
+        fourth.delete()
+        self.assertIndexInSync()
+
+    def test_deleting_properties_and_groups(self):
+        for product in self.products:
+            product.characteristics.add(self.red, self.large)
+        self.group.delete()
+        self.assertIndexInSync()
+        self.size.delete()
+        self.assertIndexInSync()
+        self.assertEqual(list(CharacteristicIndex.objects.values_list('characteristic_id', flat=True).order_by('pk')),
+                         [self.red.id, self.blue.id])
+
+    def test_missing_rows_are_created(self):
+        CharacteristicIndex.objects.all().delete()
+        CharacteristicIndex.objects.add([self.red.id, self.blue.id], [self.products[0].id])
+        CharacteristicIndex.objects.add([self.red.id], [self.products[1].id])
+        self.assertEqual(dict(CharacteristicIndex.objects.values_list('characteristic_id', 'product_ids')),
+                         {self.red.id: [self.products[0].id, self.products[1].id], self.blue.id: [self.products[0].id]})
+
+
+class NullableOrderingPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        discounts = [None, 10, None, 5, 10, None, 20]
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100, real_price=100, discount=discount)
+                                     for i, discount in enumerate(discounts)])
+
+    def pages(self, url, link):
+        client = APIClient()
+        ids = []
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([row['id'] for row in response.data['results']])
+            url = response.data[link]
+        return ids
+
+    def test_pages_through_null_values(self):
+        products = list(Product.objects.values_list('id', 'discount'))
+        for ordering, descending in (('discount', False), ('-discount', True)):
+            # NULLs sort above every value
+            values = sorted([p for p in products if p[1] is not None], key=lambda p: (p[1], p[0]), reverse=descending)
+            nulls = sorted([p for p in products if p[1] is None], reverse=descending)
+            expected = [product_id for product_id, _ in (nulls + values if descending else values + nulls)]
+
+            pages = self.pages(f'/market/products/?ordering={ordering}&page_size=2', 'next')
+            self.assertEqual([product_id for page in pages for product_id in page], expected)
+            last = APIClient().get(f'/market/products/?ordering={ordering}&page_size=2')
+            for _ in range(len(pages) - 1):
+                last = APIClient().get(last.data['next'])
+            back = self.pages(last.data['previous'], 'previous')
+            self.assertEqual([product_id for page in reversed(back) for product_id in page], expected[:-len(pages[-1])])
+
+    def test_pages_through_an_annotation(self):
+        queryset = Product.objects.annotate(saving=F('real_price') - F('discount')).order_by('-saving')
+        expected = list(queryset.order_by(F('saving').desc(nulls_first=True), '-id').values_list('id', flat=True))
+        ids, url = [], '/market/products/?page_size=3'
+        while url:
+            paginator = KeysetPagination()
+            request = Request(APIRequestFactory().get(url))
+            ids += [product.id for product in paginator.paginate_queryset(queryset, request)]
+            url = paginator.get_next_link()
+        self.assertEqual(ids, expected)
+
+
+class ProductSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.brand = Brand.objects.create(name='Phonemaker')
+        cls.feature = Property.objects.create(name='feature', is_description=True)
+        cls.waterproof = ProductCharacteristics.objects.create(property=cls.feature, value='waterproof smartphone case')
+        cls.named = Product.objects.create(name='Smartphone X', current_price=100, real_price=100)
+        cls.described = Product.objects.create(name='Case', current_price=100, real_price=100)
+        cls.described.characteristics.add(cls.waterproof)
+        cls.branded = Product.objects.create(name='Charger', brand=cls.brand, current_price=100, real_price=100)
+        # newer products that only match in the description must not push out the better match
+        for i in range(5):
+            Product.objects.create(name=f'Cover {i}', current_price=100, real_price=100) \
+                .characteristics.add(cls.waterproof)
+
+    def search(self, query):
+        return get_search_index().search(query)
+
+    def test_name_match_ranks_first(self):
+        ids = self.search('smartphone')
+        self.assertEqual(ids[0], self.named.id)
+        self.assertIn(self.described.id, ids)
+        self.assertNotIn(self.branded.id, ids)
+        self.assertEqual(self.search('phonemaker'), [self.branded.id])
+
+    def test_last_token_is_prefix_matched(self):
+        self.assertEqual(self.search('smartph')[0], self.named.id)
+        self.assertEqual(self.search('water smartpho'), [])
+        self.assertIn(self.described.id, self.search('waterproof smartpho'))
+        self.assertEqual(self.search('smartphone x'), [self.named.id])
+
+    def test_index_follows_product_changes(self):
+        self.named.name = 'Tablet Y'
+        self.named.save()
+        self.assertNotIn(self.named.id, self.search('smartphone'))
+        self.assertEqual(self.search('tablet'), [self.named.id])
+        self.named.delete()
+        self.assertEqual(self.search('tablet'), [])
+
+    def test_fallback_index(self):
+        index = ProductSearchIndex()
+        ids = index.search('smartph')
+        self.assertEqual(ids[0], self.named.id)
+        self.assertIn(self.described.id, ids)
+        self.assertEqual(index.search('phonemaker'), [self.branded.id])
+        self.assertEqual(index.search('smartphone x'), [self.named.id])
+
+
+class ProductImportTest(TestCase):
+
+    def run_import(self, records, suffix='.jsonl'):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, encoding='utf-8') as file:
+            file.write(records)
+            file.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_products', file.name, '--chunk-size', '2', stdout=out, stderr=err)
+        return err.getvalue()
+
+    def characteristics(self, sku):
+        return dict(Product.objects.get(sku=sku).characteristics.values_list('property__name', 'value'))
+
+    def assertIndexInSync(self):
+        expected = {}
+        for characteristic_id, product_id in Product.characteristics.through.objects.order_by('product_id') \
+                .values_list('productcharacteristics_id', 'product_id'):
+            expected.setdefault(characteristic_id, []).append(product_id)
+        self.assertEqual({characteristic_id: product_ids for characteristic_id, product_ids in CharacteristicIndex
+                          .objects.values_list('characteristic_id', 'product_ids') if product_ids}, expected)
+
+    def test_import_and_upsert_by_sku(self):
+        lines = [
+            {'sku': 'a1', 'name': 'Phone', 'current_price': 100, 'brand': 'Acme', 'category': 'phones/smart',
+             'characteristics': {'color': 'red', 'memory': '128'}},
+            {'sku': 'a2', 'name': 'Tablet', 'current_price': 200, 'characteristics': {'color': 'red'}},
+            {'name': 'no sku', 'current_price': 1},
+            {'sku': 'a3', 'name': 'Laptop', 'current_price': 'cheap'},
+            {'sku': 'a4', 'name': 'Watch', 'current_price': 50, 'discount': 10, 'brand': 'Acme'},
+        ]
+        err = self.run_import('\n'.join([json.dumps(line) for line in lines] + ['{broken']) + '\n')
+        self.assertEqual(err.splitlines(), ['line 3: ' + messages.NO_SKU, 'line 4: ' + messages.INVALID_PRICE,
+                                            'line 6: ' + messages.INVALID_IMPORT_RECORD])
+        self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['a1', 'a2', 'a4'])
+        phone = Product.objects.get(sku='a1')
+        self.assertEqual((phone.brand.name, phone.category.name, phone.category.parent.name),
+                         ('Acme', 'smart', 'phones'))
+        self.assertEqual(Brand.objects.filter(name='Acme').count(), 1)
+        self.assertEqual(self.characteristics('a1'), {'color': 'red', 'memory': '128'})
+        self.assertEqual(self.characteristics('a2'), {'color': 'red'})
+        self.assertIndexInSync()
+
+        self.run_import('sku,name,current_price,characteristics\n'
+                        'a1,Phone 2,150,color=blue;memory=128\n'
+                        'a5,Case,10,color=red\n', suffix='.csv')
+        self.assertEqual(Product.objects.count(), 4)
+        phone.refresh_from_db()
+        self.assertEqual((phone.name, phone.current_price, phone.real_price), ('Phone 2', 150, 150))
+        self.assertEqual(self.characteristics('a1'), {'color': 'blue', 'memory': '128'})
+        self.assertEqual(self.characteristics('a5'), {'color': 'red'})
+        self.assertEqual(ProductCharacteristics.objects.filter(property__name='color', value='red').count(), 1)
+        self.assertIndexInSync()
+        self.assertEqual(get_search_index().search('phone'), [phone.id])
+
+
+class ProductSearchApiTest(TestCase):
+    products = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        Product.objects.bulk_create([Product(name=f'phone {i}' if i % 3 else f'phone phone {i}', current_price=i,
+                                             real_price=i) for i in range(cls.products)]
+                                    + [Product(name='laptop', current_price=1, real_price=1)])
+        get_search_index().rebuild()
+
+    def pages(self, url, link):
+        ids = []
+        while url:
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.append([row['id'] for row in response.data['results']])
+            url = response.data[link]
+        return ids
+
+    def test_pages_follow_the_search_ranking(self):
+        ranked = get_search_index().search('phone')
+        self.assertEqual(len(ranked), self.products)
+        pages = self.pages('/market/products/?search=phone&page_size=40', 'next')
+        self.assertEqual([product_id for page in pages for product_id in page], ranked)
+        last = APIClient().get('/market/products/?search=phone&page_size=40')
+        for _ in range(len(pages) - 1):
+            last = APIClient().get(last.data['next'])
+        back = self.pages(last.data['previous'], 'previous')
+        self.assertEqual([product_id for page in reversed(back) for product_id in page], ranked[:-len(pages[-1])])
+
+    def test_search_with_ordering_and_filters(self):
+        pages = self.pages('/market/products/?search=phone&ordering=-current_price&page_size=100', 'next')
+        prices = [Product.objects.get(id=product_id).current_price for page in pages for product_id in page]
+        self.assertEqual(prices, list(range(self.products - 1, -1, -1)))
+        self.assertEqual(self.pages('/market/products/?search=tablet', 'next'), [[]])
+
+    def test_deleted_product_does_not_break_the_cursor(self):
+        response = APIClient().get('/market/products/?search=phone&page_size=10')
+        first = response.data['results']
+        Product.objects.filter(id=first[-1]['id']).delete()
+        response = APIClient().get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], get_search_index().search('phone')[9:19])
+
+
+@benchmark
+class CharacteristicFilterBenchmark(TestCase):
+    products = 100000
+    properties = 6
+    values = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(1)
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=i, real_price=i)
+                                     for i in range(cls.products)], batch_size=5000)
+        characteristics = []
+        for i in range(cls.properties):
+            prop = Property.objects.create(name=f'property {i}')
+            ProductCharacteristics.objects.bulk_create(
+                [ProductCharacteristics(property=prop, value=str(v)) for v in range(cls.values)])
+            characteristics.append(list(prop.values.order_by('id')))
+        through = Product.characteristics.through
+        through.objects.bulk_create([through(product_id=product_id, productcharacteristics_id=random.choice(values).id)
+                                     for product_id in Product.objects.values_list('id', flat=True)
+                                     for values in characteristics], batch_size=5000)
+        CharacteristicIndex.objects.rebuild()
+        cls.characteristics = characteristics
+
+    def test_filter(self):
+        for selected in range(1, self.properties + 1):
+            ids = [values[0].id for values in self.characteristics[:selected]]
+
+            def joins():
+                queryset = Product.objects.all()
+                for c in ids:
+                    queryset = queryset.filter(characteristics__in=[c])
+                return list(queryset.values_list('id', flat=True))
+
+            def index():
+                return list(CharacteristicIndex.objects.filter_products(Product.objects.all(), ids)
+                            .values_list('id', flat=True))
+
+            self.assertEqual(joins(), index())
+            report(f'{selected} characteristics', joins_ms=measure(joins), index_ms=measure(index))
+
+
+@benchmark
+class ProductSearchBenchmark(TestCase):
+    products = 1000000
+    words = ['phone', 'laptop', 'tablet', 'monitor', 'camera', 'watch', 'speaker', 'router', 'printer', 'console']
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(1)
+        Brand.objects.bulk_create([Brand(name=f'brand{i}') for i in range(100)])
+        brand_ids = list(Brand.objects.values_list('id', flat=True))
+        for start in range(0, cls.products, 50000):
+            Product.objects.bulk_create([Product(name=f'{random.choice(cls.words)} {random.choice(cls.words)} m{i}',
+                                                 brand_id=random.choice(brand_ids), current_price=i, real_price=i)
+                                         for i in range(start, min(start + 50000, cls.products))], batch_size=5000)
+        get_search_index().rebuild()
+
+    def test_search(self):
+        index = get_search_index()
+        for query in ('phone', 'cam', 'laptop brand7', 'phone watch', 'speakers', 'm12345'):
+            report(f'search "{query}" over {self.products} products', ms=measure(lambda: index.search(query)))
+
+
+@benchmark
+class ProductImportBenchmark(TestCase):
+    products = 500000
+    properties = 10
+    values = 20
+
+    def test_import(self):
+        random.seed(1)
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', encoding='utf-8') as file:
+            for i in range(self.products):
+                file.write(json.dumps({
+                    'sku': f'sku-{i}', 'name': f'product {i}', 'current_price': random.randint(100, 100000),
+                    'brand': f'brand {i % 100}', 'category': f'category {i % 10}/subcategory {i % 50}',
+                    'characteristics': {f'property {p}': f'value {random.randrange(self.values)}'
+                                        for p in range(self.properties)},
+                }) + '\n')
+            file.flush()
+            out = StringIO()
+            started = time.perf_counter()
+            call_command('import_products', file.name, stdout=out)
+            elapsed = time.perf_counter() - started
 
-# Create your tests here.
+        self.assertEqual(Product.objects.count(), self.products)
+        self.assertEqual(Product.characteristics.through.objects.count(), self.products * self.properties)
+        self.assertEqual(sum(len(ids) for ids in CharacteristicIndex.objects.values_list('product_ids', flat=True)),
+                         self.products * self.properties)
+        report(f'import {self.products} products', seconds=elapsed, rows_per_sec=self.products / elapsed)
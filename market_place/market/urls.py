@@ -1,5 +1,6 @@
 from django.urls import path
 
+from common.views import read_view, read_views
 from market.views import ProductList, DiscountView, RemoveDiscountView, ProductReviewView, \
     ProductReviewDetailsView, CharacteristicsView, PropertiesView, GroupPropertiesView, ProductAvailabilityView
 
@@ -16,8 +17,9 @@ router.register('product-availability', ProductAvailabilityView, basename='produ
 urlpatterns = [
     path('products/set-discount', DiscountView.as_view({'post': 'post'})),
     path('products/remove-discount', RemoveDiscountView.as_view({'post': 'post'})),
-    path('products/<int:product_id>/reviews', ProductReviewView.as_view({'get': 'list', 'post': 'create'})),
+    path('products/<int:product_id>/reviews',
+         read_view(ProductReviewView.as_view({'get': 'list', 'post': 'create'}))),
     path('products/<int:product_id>/reviews/<int:review_id>', ProductReviewDetailsView.as_view({'delete': 'destroy'})),
 
 ]
-urlpatterns += router.urls
\ No newline at end of file
+urlpatterns += read_views(router.urls, names=('products-list', 'products-detail'))
\ No newline at end of file
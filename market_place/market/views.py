@@ -1,12 +1,16 @@
 import json
 
+from django.db import transaction
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
 from rest_framework import viewsets, status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from market.filters import ProductFilter
+from common.mixins import ConditionalGetMixin
+from common.pagination import KeysetPagination
+from core.models import Brand, Category
+from market.filters import ProductFilter, ProductSearchFilter
 from market.models import Product, ProductReview, ProductCharacteristics, Property, GroupProperties, \
     ProductAvailability
 from market.serializers import ProductSerializer, ProductDetailSerializer, ProductReviewSerilalizer, \
@@ -18,12 +22,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-class ProductList(viewsets.ModelViewSet):
+class ProductList(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
-    filter_backends = (DjangoFilterBackend, SearchFilter, OrderingFilter)
-    search_fields = ('name',)
+    version_models = (Product, Brand, Category, ProductCharacteristics, Property)
+    pagination_class = KeysetPagination
+    filter_backends = (DjangoFilterBackend, ProductSearchFilter, OrderingFilter)
     filter_class = ProductFilter
 
+    def get_queryset(self):
+        if self.action in ('list', 'create'):
+            return Product.objects.all()
+        return Product.objects.with_details()
+
     def get_serializer_class(self):
         if self.action == 'list':
             logger.info('list of products')
@@ -34,13 +44,15 @@ class ProductList(viewsets.ModelViewSet):
         return ProductDetailSerializer
 
 
-class GroupPropertiesView(viewsets.ModelViewSet):
+class GroupPropertiesView(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = GroupProperties.objects.all()
+    version_models = (GroupProperties,)
     serializer_class = GroupPropertiesSerializer
 
 
-class PropertiesView(viewsets.ModelViewSet):
+class PropertiesView(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Property.objects.all()
+    version_models = (Property, GroupProperties)
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -51,6 +63,7 @@ class PropertiesView(viewsets.ModelViewSet):
 
 class CharacteristicsView(viewsets.ModelViewSet):
     queryset = ProductCharacteristics.objects.all()
+    pagination_class = KeysetPagination
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -84,8 +97,9 @@ class ProductReviewView(viewsets.ViewSet):
             product = Product.objects.get(id=product_id)
             serializer = ProductReviewSerilalizer(data=request.data)
             if serializer.is_valid():
-                review = serializer.save(user=request.user)
-                product.reviews.add(review)
+                with transaction.atomic():
+                    review = serializer.save(user=request.user)
+                    Product.objects.add_review(product, review)
                 return Response({'success': True}, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -100,7 +114,7 @@ class ProductReviewDetailsView(viewsets.ViewSet):
         try:
             logger.info(f'delete review: {review_id}')
             review = ProductReview.objects.get(id=review_id)
-            review.delete()
+            Product.objects.remove_review(review)
             return Response({'success': True})
         except ProductReview.DoesNotExist as e:
             logger.error(f'delete review: {review_id}')
@@ -112,11 +126,12 @@ class DiscountView(viewsets.ViewSet):
         try:
             logger.info('create discount')
             data = json.loads(request.body)
-            Product.objects.set_discounts(data['product_ids'], data['discount'])
-            return Response({'success': True})
+            result = Product.objects.set_discounts(data['discount'], product_ids=data.get('product_ids'),
+                                                   category=data.get('category'), brand=data.get('brand'))
+            return Response({'success': True, **result})
         except Exception as e:
             logger.error(f'create discount - {str(e)}')
-            return Response({'error': e})
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class RemoveDiscountView(viewsets.ViewSet):
@@ -124,14 +139,15 @@ class RemoveDiscountView(viewsets.ViewSet):
         try:
             logger.info('remove discounts')
             data = json.loads(request.body)
-            product_ids = data['product_ids']
-            Product.objects.remove_discounts(product_ids)
-            return Response({'success': True})
+            result = Product.objects.remove_discounts(product_ids=data.get('product_ids'),
+                                                      category=data.get('category'), brand=data.get('brand'))
+            return Response({'success': True, **result})
         except Exception as e:
-            logger.error('remove discounts')
-            return Response({'error': e})
+            logger.error(f'remove discounts - {str(e)}')
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class ProductAvailabilityView(viewsets.ModelViewSet):
-    queryset = ProductAvailability.objects.all()
+    queryset = ProductAvailability.objects.with_available()
+    pagination_class = KeysetPagination
     serializer_class = ProductAvailabilitySerializer
\ No newline at end of file
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'market_place.settings')
+# catalog reads run concurrently in a thread pool, see common.views.async_read
+os.environ.setdefault('ASYNC_READ_VIEWS', '1')
 
 application = get_asgi_application()
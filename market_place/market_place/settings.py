@@ -33,13 +33,42 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'common.middleware.PathScopedMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+# API authentication profiles: 'jwt' takes bearer tokens only, 'basic' also takes Basic credentials and caches
+# verified ones for BASIC_AUTH_CACHE_TIMEOUT seconds, 'session' is the former setup with sessions on every path
+API_AUTH_PROFILES = {
+    'jwt': (
+        'auth_.authentication.ClaimsJWTAuthentication',
+    ),
+    'basic': (
+        'auth_.authentication.ClaimsJWTAuthentication',
+        'auth_.authentication.CachedBasicAuthentication',
+    ),
+    'session': (
+        'auth_.authentication.ClaimsJWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ),
+}
+API_AUTH_PROFILE = os.getenv('API_AUTH_PROFILE', 'jwt')
+
+# the session middleware runs for these paths only, see common.middleware.PathScopedMiddleware
+SESSION_PATHS = ('/',) if API_AUTH_PROFILE == 'session' else ('/admin/',)
+SESSION_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+# the admin finds its middleware inside PathScopedMiddleware, not in MIDDLEWARE
+SILENCED_SYSTEM_CHECKS = ['admin.E408', 'admin.E409', 'admin.E410']
+
+BASIC_AUTH_CACHE = 'default'
+BASIC_AUTH_CACHE_TIMEOUT = 60
 
 ROOT_URLCONF = 'market_place.urls'
 
@@ -60,15 +89,32 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'market_place.wsgi.application'
+ASGI_APPLICATION = 'market_place.asgi.application'
+# set by asgi.py, the catalog read views are served by async views under ASGI
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS') == '1'
 
 
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # a file, not the in-memory default, so the checkout concurrency test can share it between processes
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# the version counters behind cached responses and ETags, the token blacklist filter and cache-backed carts have to
+# be seen by every worker; the LocMemCache default lives in one process and fits only a single-process deployment,
+# any other one sets CACHE_BACKEND and CACHE_LOCATION to a shared backend such as memcached
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+VERSION_CACHE = 'default'
 
 AUTH_USER_MODEL = 'auth_.User'
 
@@ -105,21 +151,44 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# seconds a checkout holds stock in the shop before the order has to be completed
+STOCK_RESERVATION_TTL = 60 * 60 * 24
+
+# "db" writes every cart change to the cart tables, "cache" keeps carts in the CART_CACHE cache and writes them
+# at checkout or when flush_carts runs; the cache has to be shared by all processes, outlive a flush interval and
+# add keys atomically for the cart locks, as memcached and redis do
+CART_STORAGE = 'db'
+CART_CACHE = 'default'
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# new orders go to the least loaded manager on shift in the city of the shop that fills them, if there is one
+ORDER_ASSIGNMENT_BY_CITY = True
+
+# run_outbox_worker claims OUTBOX_BATCH_SIZE events for OUTBOX_LEASE seconds; a failed event is retried after
+# OUTBOX_RETRY_DELAY seconds, doubling every attempt, and is left as FAILED after OUTBOX_MAX_ATTEMPTS
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_LEASE = 60
+OUTBOX_RETRY_DELAY = 10
+OUTBOX_MAX_ATTEMPTS = 5
+
+# refresh tokens are checked against a Bloom filter of the blacklist first, see auth_.tokens.BlacklistFilter;
+# the filter needs VERSION_CACHE shared by all workers, otherwise every check goes to the database (auth_.W001)
+TOKEN_BLACKLIST_CAPACITY = 1000000
+TOKEN_BLACKLIST_POLL = 5
+TOKEN_BLACKLIST_REBUILD = 60 * 60
+
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': ['rest_framework.filters.SearchFilter',
                                 'django_filters.rest_framework.DjangoFilterBackend'],
-    'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
-        'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
-    )
+    'DEFAULT_AUTHENTICATION_CLASSES': API_AUTH_PROFILES[API_AUTH_PROFILE],
 }
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': datetime.timedelta(days=1),
     'REFRESH_TOKEN_LIFETIME': datetime.timedelta(days=15),
     'ROTATE_REFRESH_TOKENS': True,
-    'BLACKLIST_AFTER_ROTATION': True
-
+    'BLACKLIST_AFTER_ROTATION': True,
+    'TOKEN_OBTAIN_SERIALIZER': 'auth_.authentication.ClaimsTokenObtainSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'auth_.authentication.ClaimsTokenRefreshSerializer',
 }
 LOGGING = {
     'version': 1,
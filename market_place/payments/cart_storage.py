@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Sum
+
+from common.cache import is_shared, cache_lock
+from common.constants import UPDATE
+from market.models import Product
+from payments.models import Cart, CartItem
+from payments.serializers import CartSerializer, CartItemSerializer
+
+DIRTY_CARTS_KEY = 'carts:dirty'
+
+
+class CartStorage:
+    # where a user's cart lives between checkouts, the responses look the same for every storage
+
+    def data(self, user):
+        raise NotImplementedError
+
+    def apply(self, user, operations):
+        raise NotImplementedError
+
+    def flush(self, user_id):
+        pass
+
+    def flush_all(self):
+        return 0
+
+    def checked_out(self, user_id, flushed):
+        pass
+
+
+class DatabaseCartStorage(CartStorage):
+
+    def data(self, user):
+        return CartSerializer(Cart.objects.personal(user=user)).data
+
+    def apply(self, user, operations):
+        Cart.objects.apply(user, operations)
+
+
+class CacheCartStorage(CartStorage):
+    # carts are kept as {product_id: amount} in the cache and written to the cart tables at checkout
+    # or by flush_carts; a cart and the set of changed carts are rewritten under locks taken with cache.add
+
+    def __init__(self):
+        if not is_shared(settings.CART_CACHE):
+            raise ImproperlyConfigured(f'CART_STORAGE = "cache" needs the "{settings.CART_CACHE}" cache to be '
+                                       f'shared by all workers.')
+        self.cache = caches[settings.CART_CACHE]
+        self.timeout = settings.CART_CACHE_TIMEOUT
+
+    @staticmethod
+    def key(user_id):
+        return f'cart:{user_id}'
+
+    @staticmethod
+    def lock_key(key):
+        return f'lock:{key}'
+
+    def items(self, user_id):
+        items = self.cache.get(self.key(user_id))
+        if items is None:
+            items = self.stored_items(user_id)
+            self.cache.add(self.key(user_id), items, self.timeout)
+        return items
+
+    @staticmethod
+    def stored_items(user_id):
+        return dict(CartItem.objects.filter(cart__user=user_id).values('product_id').annotate(total=Sum('amount'))
+                    .values_list('product_id', 'total'))
+
+    def data(self, user):
+        items = self.items(user.id)
+        products = Product.objects.in_bulk(list(items))
+        cart_items = [CartItem(product=products[product_id], amount=amount)
+                      for product_id, amount in items.items() if product_id in products]
+        return {
+            'user': user.id,
+            'cart_items': CartItemSerializer(cart_items, many=True).data,
+            'total_sum': sum(item.amount * item.product.current_price for item in cart_items),
+        }
+
+    def apply(self, user, operations):
+        changes = Cart.objects.parse_operations(operations)
+        Cart.objects.check_products({product_id for _, product_id, _ in changes})
+        key = self.key(user.id)
+        with cache_lock(self.cache, self.lock_key(key)):
+            items = Cart.objects.fold(self.items(user.id), changes)
+            self.cache.set(key, {product_id: amount for product_id, amount in items.items() if amount > 0},
+                           self.timeout)
+        self.changed(user.id)
+
+    def changed(self, user_id):
+        # the cart is written before the set is read, a flush that takes the user out of the set reads it later
+        if user_id in (self.cache.get(DIRTY_CARTS_KEY) or set()):
+            return
+        with cache_lock(self.cache, self.lock_key(DIRTY_CARTS_KEY)):
+            dirty = self.cache.get(DIRTY_CARTS_KEY) or set()
+            self.cache.set(DIRTY_CARTS_KEY, dirty | {user_id}, None)
+
+    def flush(self, user_id):
+        # returns the flushed cart, checked_out clears it only while it is unchanged
+        items = self.cache.get(self.key(user_id))
+        if items is None:
+            return None
+        stored = self.stored_items(user_id)
+        # lines of products deleted since they were added are dropped with the products
+        existing = set(Product.objects.filter(id__in=list(items)).values_list('id', flat=True))
+        operations = [{'op': UPDATE, 'product_id': product_id, 'amount': items.get(product_id, 0)}
+                      for product_id in (existing | set(stored)) if items.get(product_id, 0) != stored.get(product_id)]
+        if operations:
+            Cart.objects.apply(user_id, operations)
+        return items
+
+    def flush_all(self):
+        with cache_lock(self.cache, self.lock_key(DIRTY_CARTS_KEY)):
+            user_ids = self.cache.get(DIRTY_CARTS_KEY) or set()
+            self.cache.delete(DIRTY_CARTS_KEY)
+        for user_id in user_ids:
+            self.flush(user_id)
+        return len(user_ids)
+
+    def checked_out(self, user_id, flushed):
+        # a change made after the flush keeps the cart, it is written to the database by the next flush
+        key = self.key(user_id)
+        with cache_lock(self.cache, self.lock_key(key)):
+            if self.cache.get(key) == flushed:
+                self.cache.set(key, {}, self.timeout)
+                return
+        self.changed(user_id)
+
+
+CART_STORAGES = {
+    'db': DatabaseCartStorage,
+    'cache': CacheCartStorage,
+}
+
+
+def get_cart_storage():
+    return CART_STORAGES[settings.CART_STORAGE]()
@@ -0,0 +1,16 @@
+from django_filters import rest_framework as filters
+
+from common.constants import ORDER_STATUSES, CANCELED
+from common.filters import FilterSet
+from . import models
+
+
+class OrderFilter(FilterSet):
+    status = filters.ChoiceFilter(choices=ORDER_STATUSES + ((CANCELED, CANCELED),))
+    assignee = filters.NumberFilter(field_name='assignee_id')
+    date_from = filters.IsoDateTimeFilter(field_name='date_created', lookup_expr='gte')
+    date_to = filters.IsoDateTimeFilter(field_name='date_created', lookup_expr='lte')
+
+    class Meta:
+        model = models.Order
+        fields = []
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from market.models import BULK_CHUNK_SIZE
+from payments.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Release stock held by reservations whose time ran out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        expired = StockReservation.objects.expire(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'{expired} reservations expired'))
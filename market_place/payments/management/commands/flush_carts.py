@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from payments.cart_storage import get_cart_storage
+
+
+class Command(BaseCommand):
+    help = 'Write carts kept in the cache to the database'
+
+    def handle(self, *args, **options):
+        flushed = get_cart_storage().flush_all()
+        self.stdout.write(self.style.SUCCESS(f'{flushed} carts flushed'))
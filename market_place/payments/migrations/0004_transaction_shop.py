@@ -0,0 +1,41 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:41
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.db.models.deletion
+
+
+def fill_shops(apps, schema_editor):
+    Transaction = apps.get_model('payments', 'Transaction')
+    ProductAvailability = apps.get_model('market', 'ProductAvailability')
+    Transaction.objects.filter(availability__isnull=False).update(shop=Subquery(
+        ProductAvailability.objects.filter(pk=OuterRef('availability_id')).values('shop_id')[:1]))
+
+
+def fill_availability(apps, schema_editor):
+    Transaction = apps.get_model('payments', 'Transaction')
+    ProductAvailability = apps.get_model('market', 'ProductAvailability')
+    Transaction.objects.filter(shop__isnull=False).update(availability=Subquery(
+        ProductAvailability.objects.filter(shop_id=OuterRef('shop_id')).order_by('id').values('id')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_category_path'),
+        ('market', '0006_product_sku'),
+        ('payments', '0003_alter_cart_user'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='core.shop', verbose_name='Магазин'),
+        ),
+        migrations.RunPython(fill_shops, fill_availability),
+        migrations.RemoveField(
+            model_name='transaction',
+            name='availability',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('market', '0008_availability_reserved'),
+        ('core', '0002_category_path'),
+        ('payments', '0004_transaction_shop'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество товаров')),
+                ('status', models.CharField(choices=[('ACTIVE', 'ACTIVE'), ('COMPLETED', 'COMPLETED'), ('RELEASED', 'RELEASED'), ('EXPIRED', 'EXPIRED')], default='ACTIVE', max_length=20, verbose_name='Статус')),
+                ('expires_at', models.DateTimeField(verbose_name='Действует до')),
+                ('closed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата закрытия')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='market.product', verbose_name='Товар')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='core.shop', verbose_name='Магазин')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='payments.transaction', verbose_name='Транзакция')),
+            ],
+            options={
+                'verbose_name': 'Резерв товара',
+                'verbose_name_plural': 'Резервы товаров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stockreservation',
+            index=models.Index(fields=['status', 'expires_at'], name='payments_st_status_8f6e22_idx'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_lines(apps, schema_editor):
+    # older transactions point at a snapshot cart, its items at today's prices are the best copy there is;
+    # snapshot carts have no owner, so their user stays empty
+    Transaction = apps.get_model('payments', 'Transaction')
+    OrderLine = apps.get_model('payments', 'OrderLine')
+    through = apps.get_model('payments', 'Cart').cart_items.through
+    for checkout in Transaction.objects.filter(cart__isnull=False):
+        lines = {}
+        for product_id, name, price, amount in through.objects.filter(cart_id=checkout.cart_id) \
+                .values_list('cartitem__product_id', 'cartitem__product__name', 'cartitem__product__current_price',
+                             'cartitem__amount'):
+            line = lines.setdefault(product_id, OrderLine(transaction=checkout, product_id=product_id,
+                                                          name=name or '', price=price or 0, amount=0))
+            line.amount += amount
+        OrderLine.objects.bulk_create(lines.values())
+        checkout.total_sum = sum(line.price * line.amount for line in lines.values())
+        checkout.save(update_fields=['total_sum'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('market', '0008_availability_reserved'),
+        ('payments', '0005_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='total_sum',
+            field=models.IntegerField(default=0, verbose_name='Сумма'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to=settings.AUTH_USER_MODEL, verbose_name='Покупатель'),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, verbose_name='Наименование')),
+                ('price', models.IntegerField(verbose_name='Цена за единицу')),
+                ('amount', models.IntegerField(verbose_name='Количество товаров')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='order_lines', to='market.product', verbose_name='Товар')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='payments.transaction', verbose_name='Транзакция')),
+            ],
+            options={
+                'verbose_name': 'Позиция заказа',
+                'verbose_name_plural': 'Позиции заказов',
+            },
+        ),
+        migrations.RunPython(fill_lines, migrations.RunPython.noop),
+    ]
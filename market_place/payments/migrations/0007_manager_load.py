@@ -0,0 +1,48 @@
+# Generated by Django 3.2.25 on 2026-10-18 08:58
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+import django.db.models.deletion
+
+
+def fill_loads(apps, schema_editor):
+    User = apps.get_model('auth_', 'User')
+    ManagerLoad = apps.get_model('payments', 'ManagerLoad')
+    managers = User.objects.filter(roles='MANAGER').annotate(
+        open_orders=Count('orders', filter=~Q(orders__status__in=('DONE', 'CANCELED'))))
+    ManagerLoad.objects.bulk_create([ManagerLoad(manager_id=manager.id, city_id=manager.cur_city_id,
+                                                 open_orders=manager.open_orders) for manager in managers])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_', '0002_user_cur_city'),
+        ('core', '0002_category_path'),
+        ('payments', '0006_order_lines'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManagerLoad',
+            fields=[
+                ('manager', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='load', serialize=False, to='auth_.user', verbose_name='Менеджер')),
+                ('on_shift', models.BooleanField(default=True, verbose_name='На смене')),
+                ('open_orders', models.IntegerField(default=0, verbose_name='Открытые заказы')),
+                ('city', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.city', verbose_name='Город')),
+            ],
+            options={
+                'verbose_name': 'Загрузка менеджера',
+                'verbose_name_plural': 'Загрузка менеджеров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='managerload',
+            index=models.Index(fields=['on_shift', 'open_orders'], name='payments_ma_on_shif_553f55_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='managerload',
+            index=models.Index(fields=['on_shift', 'city', 'open_orders'], name='payments_ma_on_shif_d689d4_idx'),
+        ),
+        migrations.RunPython(fill_loads, migrations.RunPython.noop),
+    ]
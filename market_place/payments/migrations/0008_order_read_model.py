@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:01
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+import django.utils.timezone
+
+
+def fill_dates(apps, schema_editor):
+    Order = apps.get_model('payments', 'Order')
+    Transaction = apps.get_model('payments', 'Transaction')
+    Order.objects.filter(transaction__isnull=False).update(date_created=Subquery(
+        Transaction.objects.filter(pk=OuterRef('transaction_id')).values('date_created')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_', '0002_user_cur_city'),
+        ('payments', '0007_manager_load'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='date_created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now, verbose_name='Дата создания'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['assignee', 'status', 'date_created'], name='payments_or_assigne_a29d78_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'date_created'], name='payments_or_status_6de9d0_idx'),
+        ),
+    ]
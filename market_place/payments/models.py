@@ -1,9 +1,19 @@
+import datetime
+import heapq
+
+from django.conf import settings
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.functional import cached_property
 
-from common.constants import DONT_ENOUGH_MONEY, MONEY_ENOUGH, ORDER_STATUSES, AVAILABLE, DONT_AVAILABLE
+from common import messages
+from common.constants import ORDER_STATUSES, AVAILABLE, DONT_AVAILABLE, CANCELED, DONE, RESERVATION_STATUSES, ACTIVE, \
+    COMPLETED, RELEASED, EXPIRED, CART_OPERATIONS, ADD, UPDATE, REMOVE, PENDING, MANAGER
 from common.utils import random_nums, random_csv
-from market.models import ProductAvailability, ProductUnit
+from market.models import ProductAvailability, ProductUnit, BULK_CHUNK_SIZE
 
 
 class CreditCard(models.Model):
@@ -27,107 +37,251 @@ class CartItem(ProductUnit):
 
 class CartManager(models.Manager):
     def personal(self, user):
-        return Cart.objects.get(user=user)
+        return self.with_total_sum().get(id=self.cart_id(user))
+
+    def cart_id(self, user):
+        # the cart is created on first use, a user saved a moment ago may not have one yet
+        user_id = getattr(user, 'pk', user)
+        cart_id = self.filter(user_id=user_id).order_by('id').values_list('id', flat=True).first()
+        if cart_id is None:
+            cart_id = self.create(user_id=user_id).id
+        return cart_id
+
+    def with_total_sum(self):
+        # the annotation takes the place of Cart.total_sum, so the cart and its total come in one query
+        return self.annotate(total_sum=Coalesce(
+            Sum(F('cart_items__amount') * F('cart_items__product__current_price')), 0))
 
     def add_product(self, user, product_id, amount):
-        from market.models import Product
-        product = Product.objects.get(id=product_id)
-        cart = Cart.objects.personal(user=user)
-        item = cart.cart_items.filter(product=product).first()
-        if item:
-            item.amount = amount
-            item.save()
-        else:
-            item = CartItem.objects.create(product=product, amount=amount)
-            cart.cart_items.add(item)
-            cart.save()
+        self.apply(user, [{'op': UPDATE, 'product_id': product_id, 'amount': amount}])
 
     def remove_product(self, user, product_id):
+        self.apply(user, [{'op': REMOVE, 'product_id': product_id}])
+
+    def apply(self, user, operations):
+        # add increases a line, update sets it, remove drops it; the operations are folded in memory
+        # and written with at most one delete, one bulk update and the inserts of the new lines and their links
+        changes = self.parse_operations(operations)
+        product_ids = {product_id for _, product_id, _ in changes}
+        cart_id = self.cart_id(user)
+        with transaction.atomic():
+            # the cart row is locked before its lines are read, concurrent changes to one cart queue behind it;
+            # the lock is a write, so on SQLite the transaction holds the write lock from the start like checkout
+            self.filter(id=cart_id).update(user_id=F('user_id'))
+            self.check_products(product_ids)
+            items = {item.product_id: item for item in CartItem.objects.filter(cart=cart_id,
+                                                                               product_id__in=product_ids)}
+            amounts = self.fold({product_id: item.amount for product_id, item in items.items()}, changes)
+            removed = [item.id for product_id, item in items.items() if amounts[product_id] <= 0]
+            changed = [item for product_id, item in items.items() if 0 < amounts[product_id] != item.amount]
+            for item in changed:
+                item.amount = amounts[item.product_id]
+            created = [CartItem(product_id=product_id, amount=amount) for product_id, amount in amounts.items()
+                       if amount > 0 and product_id not in items]
+
+            if removed:
+                CartItem.objects.filter(id__in=removed).delete()
+            if changed:
+                CartItem.objects.bulk_update(changed, ['amount'])
+            if created:
+                if connection.features.can_return_rows_from_bulk_insert:
+                    CartItem.objects.bulk_create(created)
+                else:
+                    # without RETURNING a bulk insert gives no ids, and a line has no cart column to find it by
+                    # until it is linked; a batch creates a few lines, each insert returns its own id
+                    for item in created:
+                        item.save(force_insert=True)
+                through = Cart.cart_items.through
+                through.objects.bulk_create([through(cart_id=cart_id, cartitem_id=item.pk) for item in created])
+        return cart_id
+
+    @staticmethod
+    def check_products(product_ids):
         from market.models import Product
-        Product.objects.get(id=product_id)
-        cart = Cart.objects.personal(user=user)
-        item = cart.cart_items.filter(product__id=product_id).first()
-        cart.cart_items.remove(item)
-        cart.save()
+        if Product.objects.filter(id__in=product_ids).count() != len(product_ids):
+            raise ValueError(messages.PRODUCT_NOT_FOUND)
+
+    @staticmethod
+    def fold(amounts, changes):
+        # removed lines stay in the result with a zero amount
+        amounts = dict(amounts)
+        for op, product_id, amount in changes:
+            if op == ADD:
+                amounts[product_id] = amounts.get(product_id, 0) + amount
+            elif op == UPDATE:
+                amounts[product_id] = amount
+            else:
+                amounts[product_id] = 0
+        return amounts
+
+    @staticmethod
+    def parse_operations(operations):
+        changes = []
+        try:
+            for operation in operations:
+                op = operation['op']
+                amount = int(operation.get('amount', 1)) if op != REMOVE else 0
+                if op not in CART_OPERATIONS or amount < 0 or (op == ADD and amount == 0):
+                    raise ValueError
+                changes.append((op, int(operation['product_id']), amount))
+        except (KeyError, TypeError, ValueError):
+            raise ValueError(messages.INVALID_CART_OPERATION)
+        return changes
 
 
 class Cart(models.Model):
     user = models.ForeignKey('auth_.User', on_delete=models.CASCADE, verbose_name='Пользователь', related_name='cart',
                              null=True, blank=True)
     cart_items = models.ManyToManyField(CartItem, related_name='cart', verbose_name='Объекты корзины')
-    total_sum = models.IntegerField(default=0, verbose_name='Сумма')
     objects = CartManager()
 
     class Meta:
         verbose_name = 'Корзина покупок'
         verbose_name_plural = 'Корзины покупок'
 
-    @property
+    @cached_property
     def total_sum(self):
-        sum = 0
-        for item in self.cart_items.all():
-            sum_item = item.amount * item.product.current_price
-            sum += sum_item
-        self.total_sum = sum
-        self.save()
-        return sum
-
-    def check_balance(self):
-        card = self.user.credit_card
-        if card:
-            if card.balance >= self.total_sum:
-                return MONEY_ENOUGH
-            return DONT_ENOUGH_MONEY
-
-    def withdraw_money(self):
-        card = self.user.credit_card
-        if card:
-            card.balance -= self.total_sum
-            card.save()
-
-    def empty_cart(self):
-        for item in self.cart_items.all():
-            self.cart_items.remove(item)
-        self.save()
+        # computed by one aggregate query, reading the total never writes the cart
+        return self.cart_items.aggregate(
+            total=Coalesce(Sum(F('amount') * F('product__current_price')), 0))['total']
+
+    def item_amounts(self):
+        return dict(self.cart_items.values('product_id').annotate(total=Sum('amount'))
+                    .values_list('product_id', 'total'))
+
+    def available_shops(self):
+        return ProductAvailability.objects.shops_for(self.item_amounts(), city=self.user.cur_city_id)
 
     def check_availability(self):
-        city = self.user.cur_city
-        items = self.cart_items.all()
-        available = ProductAvailability.objects.filter(shop__city=city)
-        for a in available:
-            has_products = True
-            for item in items:
-                product_items = available.filter(product=item.product, amount__gte=item.amount)
-                if not product_items:
-                    has_products = False
-            if has_products:
-                return (AVAILABLE,a.id)
+        shops = self.available_shops()
+        if shops:
+            return (AVAILABLE, shops[0])
         return (DONT_AVAILABLE, '')
 
 
-    @total_sum.setter
-    def total_sum(self, value):
-        self._total_sum = value
+# how many ranked shops checkout tries before it gives up on a cart
+CHECKOUT_SHOP_ATTEMPTS = 3
+
+
+class TransactionManager(models.Manager):
+
+    def checkout(self, user):
+        # every step runs in one database transaction and every write is conditional, so concurrent
+        # checkouts can neither overdraw the card nor hold more stock than a shop has free
+        with transaction.atomic():
+            # the first statement is a write, so on SQLite the transaction holds the write lock from the start
+            # and concurrent checkouts queue behind it instead of failing on a lock upgrade
+            checkout = Transaction.objects.create(user=user)
+            rows = list(Cart.cart_items.through.objects.filter(cart__user=user)
+                        .values_list('cartitem_id', 'cartitem__product_id', 'cartitem__product__name',
+                                     'cartitem__product__current_price', 'cartitem__amount'))
+            if not rows:
+                raise ValueError(messages.EMPTY_CART)
+            # the order keeps its own copy of names and prices, later catalog changes do not touch it
+            lines = {}
+            for _, product_id, name, price, amount in rows:
+                line = lines.setdefault(product_id, OrderLine(transaction=checkout, product_id=product_id,
+                                                              name=name, price=price, amount=0))
+                line.amount += amount
+            items = {product_id: line.amount for product_id, line in lines.items()}
+            total_sum = sum(line.price * line.amount for line in lines.values())
+
+            if not CreditCard.objects.filter(user=user, balance__gte=total_sum) \
+                    .update(balance=F('balance') - total_sum):
+                if not CreditCard.objects.filter(user=user).exists():
+                    raise CreditCard.DoesNotExist
+                raise ValueError(messages.NO_MONEY)
+
+            for shop_id in ProductAvailability.objects.shops_for(items, city=user.cur_city_id)[:CHECKOUT_SHOP_ATTEMPTS]:
+                try:
+                    with transaction.atomic():
+                        # a concurrent checkout may have emptied the shop since it was ranked
+                        if ProductAvailability.objects.reserve(shop_id, items) != len(items):
+                            raise ValueError(messages.NOT_AVAILABLE)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(messages.NOT_AVAILABLE)
+
+            OrderLine.objects.bulk_create(lines.values())
+            CartItem.objects.filter(id__in=[row[0] for row in rows]).delete()
+            checkout.shop_id = shop_id
+            checkout.total_sum = total_sum
+            checkout.save(update_fields=['shop', 'total_sum'])
+            # the order is created once the shop is known, so it can go to a manager of the shop's city
+            Order.objects.create(transaction=checkout)
+            StockReservation.objects.hold(checkout, shop_id, items)
+            return checkout
 
 
 class Transaction(models.Model):
+    user = models.ForeignKey('auth_.User', on_delete=models.SET_NULL, related_name='transactions',
+                             verbose_name='Покупатель', null=True, blank=True)
+    # the snapshot cart of transactions made before order lines existed
     cart = models.ForeignKey('Cart', on_delete=models.CASCADE, related_name='transaction', verbose_name='Корзина',
                              null=True, blank=True)
+    total_sum = models.IntegerField(verbose_name='Сумма', default=0)
     date_created = models.DateTimeField(auto_now=True, verbose_name='Дата создания')
-    availability = models.ForeignKey('market.ProductAvailability', on_delete=models.SET_NULL, related_name='transaction',
-                                     verbose_name='Наличие товара', null=True, blank=True)
+    shop = models.ForeignKey('core.Shop', on_delete=models.SET_NULL, related_name='transactions',
+                             verbose_name='Магазин', null=True, blank=True)
+    objects = TransactionManager()
 
     class Meta:
         verbose_name = 'Транзакция'
         verbose_name_plural = 'Транзакции'
 
 
+class OrderLine(models.Model):
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='lines',
+                                    verbose_name='Транзакция')
+    product = models.ForeignKey('market.Product', on_delete=models.SET_NULL, related_name='order_lines',
+                                verbose_name='Товар', null=True, blank=True)
+    name = models.CharField(verbose_name='Наименование', max_length=200)
+    price = models.IntegerField(verbose_name='Цена за единицу')
+    amount = models.IntegerField(verbose_name='Количество товаров')
+
+    class Meta:
+        verbose_name = 'Позиция заказа'
+        verbose_name_plural = 'Позиции заказов'
+
+
 class OrderManager(models.Manager):
     def user_orders(self, user):
-        return Order.objects.filter(transaction__cart__user=user)
+        return self.with_lines().filter(transaction__user=user)
 
     def assignee_orders(self, assignee):
-        return Order.objects.filter(assignee=assignee)
+        return self.with_lines().filter(assignee=assignee)
+
+    def with_lines(self):
+        # a page of orders and all of its lines in two queries, newest first
+        return self.select_related('transaction').prefetch_related('transaction__lines').order_by('-date_created')
+
+    def open(self):
+        return self.exclude(status__in=(DONE, CANCELED))
+
+    def cancel(self, order_id):
+        # the status flip decides which request releases the holds, so they are released once; a completed
+        # order keeps its consumed stock and its manager's counter
+        with transaction.atomic():
+            if not Order.objects.filter(id=order_id).exclude(status__in=(DONE, CANCELED)).update(status=CANCELED):
+                return False
+            transaction_id, assignee_id = Order.objects.filter(id=order_id) \
+                .values_list('transaction_id', 'assignee_id').get()
+            Order.objects.filter(id=order_id).update(assignee=None)
+            ManagerLoad.objects.closed(assignee_id)
+            StockReservation.objects.release(transaction_id)
+            return True
+
+    def complete(self, order_id):
+        with transaction.atomic():
+            if not Order.objects.filter(id=order_id).exclude(status__in=(DONE, CANCELED)).update(status=DONE):
+                return False
+            transaction_id, assignee_id = Order.objects.filter(id=order_id) \
+                .values_list('transaction_id', 'assignee_id').get()
+            ManagerLoad.objects.closed(assignee_id)
+            StockReservation.objects.complete(transaction_id)
+            return True
 
 
 class Order(models.Model):
@@ -136,8 +290,206 @@ class Order(models.Model):
     status = models.CharField(choices=ORDER_STATUSES, default='NOT_ASSIGNED', verbose_name='Cтатус', max_length=150)
     assignee = models.ForeignKey('auth_.User', on_delete=models.SET_NULL, related_name='orders', null=True,
                                  blank=True, verbose_name='Исполнитель')
+    date_created = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     objects = OrderManager()
 
     class Meta:
         verbose_name = 'Заказ'
-        verbose_name_plural = 'Заказы'
\ No newline at end of file
+        verbose_name_plural = 'Заказы'
+        indexes = [
+            models.Index(fields=['assignee', 'status', 'date_created']),
+            models.Index(fields=['status', 'date_created']),
+        ]
+
+
+class ManagerLoadManager(models.Manager):
+    # one counter row per manager keeps the open order count, so picking the least loaded manager reads
+    # one index instead of counting the orders of every user
+
+    def pick(self, city_id=None):
+        loads = self.filter(on_shift=True).order_by('open_orders', 'manager_id').values_list('manager_id', flat=True)
+        if city_id is not None and settings.ORDER_ASSIGNMENT_BY_CITY:
+            manager_id = loads.filter(city_id=city_id).first()
+            if manager_id is not None:
+                return manager_id
+        return loads.first()
+
+    def assign(self, order):
+        from auth_.models import User
+        city_id = None
+        if settings.ORDER_ASSIGNMENT_BY_CITY:
+            city_id = Transaction.objects.filter(id=order.transaction_id).values_list('shop__city_id', flat=True).first()
+        with transaction.atomic():
+            manager_id = self.pick(city_id)
+            if manager_id is None:
+                # directors are not counted, they take the orders while no manager is on shift
+                manager_id = User.objects.directors().values_list('id', flat=True).first()
+                if manager_id is None:
+                    return None
+            # only an open order nobody took yet is assigned, so running the assignment twice changes nothing
+            if not Order.objects.open().filter(id=order.id, assignee__isnull=True) \
+                    .update(assignee_id=manager_id, status=PENDING):
+                return None
+            self.filter(manager_id=manager_id).update(open_orders=F('open_orders') + 1)
+        order.assignee_id = manager_id
+        order.status = PENDING
+        return manager_id
+
+    def closed(self, manager_id):
+        if manager_id is not None:
+            self.filter(manager_id=manager_id, open_orders__gt=0).update(open_orders=F('open_orders') - 1)
+
+    def start_shift(self, manager_id):
+        return self.filter(manager_id=manager_id).update(on_shift=True)
+
+    def end_shift(self, manager_id):
+        # the open orders of the manager are spread over the others, the least loaded manager of the order's
+        # city first; heaps of (open orders, manager) are kept per city and for everyone, stale entries are skipped
+        from auth_.models import User
+        with transaction.atomic():
+            if not self.filter(manager_id=manager_id, on_shift=True).update(on_shift=False, open_orders=0):
+                return {}
+            orders = list(Order.objects.open().filter(assignee_id=manager_id)
+                          .values_list('id', 'transaction__shop__city_id'))
+            counts = {}
+            cities = {}
+            heaps = {None: []}
+            for open_orders, other_id, city_id in self.filter(on_shift=True) \
+                    .values_list('open_orders', 'manager_id', 'city_id'):
+                counts[other_id] = open_orders
+                cities[other_id] = city_id
+                heaps[None].append((open_orders, other_id))
+                heaps.setdefault(city_id, []).append((open_orders, other_id))
+            for heap in heaps.values():
+                heapq.heapify(heap)
+
+            assigned = {}
+            for order_id, city_id in orders:
+                other_id = None
+                if settings.ORDER_ASSIGNMENT_BY_CITY and city_id is not None:
+                    other_id = self._least(heaps.get(city_id, []), counts)
+                if other_id is None:
+                    other_id = self._least(heaps[None], counts)
+                assigned.setdefault(other_id, []).append(order_id)
+                if other_id is not None:
+                    counts[other_id] += 1
+                    heapq.heappush(heaps[None], (counts[other_id], other_id))
+                    heapq.heappush(heaps[cities[other_id]], (counts[other_id], other_id))
+
+            if None in assigned:
+                # nobody else is on shift, the orders go to a director like new ones do
+                director_id = User.objects.directors().values_list('id', flat=True).first()
+                assigned.setdefault(director_id, []).extend(assigned.pop(None))
+            for other_id, order_ids in assigned.items():
+                Order.objects.filter(id__in=order_ids).update(assignee_id=other_id)
+                if other_id in counts:
+                    self.filter(manager_id=other_id).update(open_orders=F('open_orders') + len(order_ids))
+            return {other_id: len(order_ids) for other_id, order_ids in assigned.items()}
+
+    @staticmethod
+    def _least(heap, counts):
+        while heap and heap[0][0] != counts[heap[0][1]]:
+            heapq.heappop(heap)
+        return heap[0][1] if heap else None
+
+    def sync(self, user):
+        if user.roles == MANAGER:
+            self.update_or_create(manager=user, defaults={'city_id': user.cur_city_id})
+        else:
+            self.filter(manager=user).delete()
+
+    def rebuild(self):
+        # counts the open orders again, for counters that drifted from manual edits
+        for load in self.all():
+            load.open_orders = Order.objects.open().filter(assignee_id=load.manager_id).count()
+            load.save(update_fields=['open_orders'])
+
+
+class ManagerLoad(models.Model):
+    manager = models.OneToOneField('auth_.User', on_delete=models.CASCADE, primary_key=True, related_name='load',
+                                   verbose_name='Менеджер')
+    city = models.ForeignKey('core.City', on_delete=models.SET_NULL, null=True, blank=True, related_name='+',
+                             verbose_name='Город')
+    on_shift = models.BooleanField(default=True, verbose_name='На смене')
+    open_orders = models.IntegerField(default=0, verbose_name='Открытые заказы')
+    objects = ManagerLoadManager()
+
+    class Meta:
+        verbose_name = 'Загрузка менеджера'
+        verbose_name_plural = 'Загрузка менеджеров'
+        indexes = [
+            models.Index(fields=['on_shift', 'open_orders']),
+            models.Index(fields=['on_shift', 'city', 'open_orders']),
+        ]
+
+
+class StockReservationManager(models.Manager):
+
+    def hold(self, checkout, shop_id, items):
+        # the stock is already counted in ProductAvailability.reserved, the rows say whose it is and until when
+        expires_at = timezone.now() + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+        return self.bulk_create([StockReservation(transaction=checkout, shop_id=shop_id, product_id=product_id,
+                                                  amount=amount, expires_at=expires_at)
+                                 for product_id, amount in items.items()])
+
+    def complete(self, transaction_id):
+        with transaction.atomic():
+            holds, _ = self._close(COMPLETED, self.filter(transaction_id=transaction_id, status=ACTIVE))
+            ProductAvailability.objects.consume(holds)
+            # holds the sweeper expired before completion are taken again if the shop still has the stock
+            lapsed, _ = self._close(COMPLETED, self.filter(transaction_id=transaction_id, status=EXPIRED))
+            for shop_id in {shop_id for shop_id, _ in lapsed}:
+                items = {product_id: amount for (shop, product_id), amount in lapsed.items() if shop == shop_id}
+                if ProductAvailability.objects.reserve(shop_id, items) != len(items):
+                    raise ValueError(messages.NOT_AVAILABLE)
+            ProductAvailability.objects.consume(lapsed)
+
+    def release(self, transaction_id):
+        with transaction.atomic():
+            holds, _ = self._close(RELEASED, self.filter(transaction_id=transaction_id, status=ACTIVE))
+            ProductAvailability.objects.release(holds)
+
+    def expire(self, now=None, chunk_size=BULK_CHUNK_SIZE):
+        now = now or timezone.now()
+        expired = 0
+        while True:
+            with transaction.atomic():
+                chunk = self.filter(status=ACTIVE, expires_at__lte=now).order_by('expires_at')[:chunk_size]
+                holds, closed = self._close(EXPIRED, chunk)
+                if not closed:
+                    return expired
+                ProductAvailability.objects.release(holds)
+                expired += closed
+
+    def _close(self, new_status, queryset):
+        # the holds to close are locked and their ids read first, the update and the sums then go by those ids;
+        # on SQLite the transaction that writes first wins and a stale one fails instead of closing them twice
+        ids = list(queryset.select_for_update().values_list('id', flat=True))
+        holds = {}
+        if not ids:
+            return holds, 0
+        closed = self.filter(id__in=ids).update(status=new_status, closed_at=timezone.now())
+        for shop_id, product_id, amount in self.filter(id__in=ids).values_list('shop_id', 'product_id', 'amount'):
+            holds[(shop_id, product_id)] = holds.get((shop_id, product_id), 0) + amount
+        return holds, closed
+
+
+class StockReservation(models.Model):
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='reservations',
+                                    verbose_name='Транзакция')
+    shop = models.ForeignKey('core.Shop', on_delete=models.CASCADE, related_name='reservations',
+                             verbose_name='Магазин')
+    product = models.ForeignKey('market.Product', on_delete=models.CASCADE, related_name='reservations',
+                                verbose_name='Товар')
+    amount = models.IntegerField(verbose_name='Количество товаров')
+    status = models.CharField(choices=RESERVATION_STATUSES, default=ACTIVE, verbose_name='Статус', max_length=20)
+    expires_at = models.DateTimeField(verbose_name='Действует до')
+    closed_at = models.DateTimeField(verbose_name='Дата закрытия', null=True, blank=True)
+    objects = StockReservationManager()
+
+    class Meta:
+        verbose_name = 'Резерв товара'
+        verbose_name_plural = 'Резервы товаров'
+        indexes = [
+            models.Index(fields=['status', 'expires_at']),
+        ]
@@ -2,7 +2,7 @@ import datetime
 
 from rest_framework import serializers
 
-from payments.models import CreditCard, Order, Transaction, Cart, CartItem
+from payments.models import CreditCard, Order, Transaction, Cart, CartItem, OrderLine
 from market.serializers import ProductSerializer
 from common import messages
 
@@ -32,22 +32,29 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['user', 'cart_items', 'total_sum']
 
     def get_cart_items(self, obj):
-        print(obj.cart_items.all())
-        return CartItemSerializer(obj.cart_items.all(), many=True).data
+        return CartItemSerializer(obj.cart_items.select_related('product'), many=True).data
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderLine
+        fields = ['product', 'name', 'price', 'amount']
 
 
 class TransactionSerializer(serializers.ModelSerializer):
+    lines = OrderLineSerializer(many=True, read_only=True)
+
     class Meta:
         model = Transaction
-        fields = ['cart', 'availability']
+        fields = ['id', 'shop', 'total_sum', 'lines']
 
 
 class TransactionReadSerializer(serializers.ModelSerializer):
-    cart = CartSerializer()
+    lines = OrderLineSerializer(many=True, read_only=True)
 
     class Meta:
         model = Transaction
-        fields = ['cart', 'date_created']
+        fields = ['date_created', 'shop', 'total_sum', 'lines']
 
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -55,7 +62,7 @@ class OrderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'transaction', 'status', 'assignee']
+        fields = ['id', 'transaction', 'status', 'assignee', 'date_created']
 
 
 class CartItemSerializer(serializers.ModelSerializer):
@@ -2,36 +2,27 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 
 from auth_.models import User
-from common.constants import PENDING, DONE
-from market.models import ProductAvailability
-from payments.models import Order, Transaction
+from common.constants import ORDER_CREATED, USER_CREATED, USER_CHANGED
+from core import outbox
+from payments.models import Order, ManagerLoad
 
 
-@receiver(post_save, sender=Transaction)
-def set_assignee(sender, instance, created, **kwargs):
-    if created:
-        Order.objects.create(transaction=instance)
-
+@receiver(post_save, sender=Order)
+def order_created(sender, instance, created, **kwargs):
+    if created and instance.assignee_id is None:
+        outbox.enqueue(ORDER_CREATED, order_id=instance.id)
 
-def save_assignee(instance, assignee):
-    instance.assignee = assignee
-    instance.status = PENDING
-    instance.save()
 
+@outbox.handler(ORDER_CREATED)
+def set_assignee(order_id):
+    order = Order.objects.filter(id=order_id).first()
+    if order is not None:
+        ManagerLoad.objects.assign(order)
 
-@receiver(post_save, sender=Order)
-def set_assignee(sender, instance, created, **kwargs):
-    if created:
-        assignee_min_tasks = User.objects.count_orders().first()
-        director = User.objects.directors().first()
-        if assignee_min_tasks:
-            save_assignee(instance, assignee_min_tasks)
-        elif director:
-            save_assignee(instance, director)
 
-
-@receiver(post_save, sender=Order)
-def completion_check(sender, instance, created, **kwargs):
-    if instance.status == DONE:
-        instance.transaction.availability.amount -= 1
-        instance.transaction.availability.save()
\ No newline at end of file
+@outbox.handler(USER_CREATED)
+@outbox.handler(USER_CHANGED)
+def sync_manager_load(user_id):
+    user = User.objects.filter(id=user_id).first()
+    if user is not None:
+        ManagerLoad.objects.sync(user)
@@ -1,3 +1,542 @@
-from django.test import TestCase
+import datetime
+import json
+import multiprocessing
+import random
+import tempfile
+import time
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, connections
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from auth_.models import User
+from common import messages
+from common.benchmarks import benchmark, measure, report
+from common.constants import AVAILABLE, ACTIVE, MANAGER, CUSTOMER, DONE, PENDING
+from core import outbox
+from core.models import City, Shop
+from market.models import Product, ProductAvailability
+from payments.cart_storage import get_cart_storage
+from payments.signals import set_assignee
+from payments.models import Cart, CartItem, CreditCard, Transaction, Order, StockReservation, ManagerLoad, \
+    OrderLine
+
+
+def create_user(username, city, balance):
+    user = User.objects.create_user(username, 'password', f'{username}@mail.kz', username, username)
+    user.cur_city = city
+    user.save()
+    CreditCard.objects.create(user=user, balance=balance, valid_thru='2030-01-01')
+    return user
+
+
+def checkout_worker(product_id, user_ids):
+    results = []
+    for user_id in user_ids:
+        user = User.objects.get(id=user_id)
+        Cart.objects.add_product(user, product_id, 1)
+        started = time.perf_counter()
+        try:
+            Transaction.objects.checkout(user)
+            results.append((True, time.perf_counter() - started))
+        except ValueError:
+            results.append((False, time.perf_counter() - started))
+    connections.close_all()
+    return results
+
+
+class CheckoutTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.city = City.objects.create(name='city')
+        cls.shop = Shop.objects.create(address='shop', city=cls.city)
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100, real_price=100)
+                                     for i in range(10)])
+        cls.products = list(Product.objects.values_list('id', flat=True))
+        ProductAvailability.objects.bulk_create([ProductAvailability(shop=cls.shop, product_id=product_id, amount=5)
+                                                 for product_id in cls.products])
+        cls.user = create_user('user', cls.city, 10000)
+
+    def stock(self):
+        return dict(ProductAvailability.objects.with_available().values_list('product_id', 'available'))
+
+    def held(self, product_id):
+        return ProductAvailability.objects.values_list('amount', 'reserved').get(product_id=product_id)
+
+    def test_query_count_does_not_grow_with_cart(self):
+        for count in (1, 10):
+            for product_id in self.products[:count]:
+                Cart.objects.add_product(self.user, product_id, 2)
+            with self.assertNumQueries(17):
+                Transaction.objects.checkout(self.user)
+
+        self.assertEqual(CreditCard.objects.get(user=self.user).balance, 10000 - 11 * 200)
+        self.assertEqual(self.stock()[self.products[0]], 1)
+        self.assertEqual(self.stock()[self.products[9]], 3)
+        self.assertFalse(Cart.objects.personal(self.user).cart_items.exists())
+
+    def test_order_lines_keep_checkout_prices(self):
+        Cart.objects.add_product(self.user, self.products[0], 2)
+        Cart.objects.add_product(self.user, self.products[1], 1)
+        checkout = Transaction.objects.checkout(self.user)
+        Product.objects.filter(id=self.products[0]).update(name='renamed', current_price=50)
+
+        order = Order.objects.user_orders(self.user).get()
+        self.assertEqual(order.transaction_id, checkout.id)
+        self.assertEqual(checkout.total_sum, 300)
+        self.assertEqual(list(checkout.lines.order_by('product_id').values_list('name', 'price', 'amount')),
+                         [('product 0', 100, 2), ('product 1', 100, 1)])
+        self.assertFalse(CartItem.objects.exists())
+
+    def test_failed_checkout_leaves_everything_untouched(self):
+        Cart.objects.add_product(self.user, self.products[0], 6)
+        stock = self.stock()
+        with self.assertRaises(ValueError):
+            Transaction.objects.checkout(self.user)
+
+        self.assertEqual(self.stock(), stock)
+        self.assertEqual(CreditCard.objects.get(user=self.user).balance, 10000)
+        self.assertEqual(Cart.objects.personal(self.user).total_sum, 600)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_holds_are_consumed_released_or_expired_once(self):
+        product_id = self.products[0]
+        orders = []
+        for amount in (2, 1, 1):
+            Cart.objects.add_product(self.user, product_id, amount)
+            orders.append(Transaction.objects.checkout(self.user).order.get().id)
+        done, canceled, lapsed = orders
+        self.assertEqual(self.held(product_id), (5, 4))
+
+        for _ in range(2):
+            Order.objects.complete(done)
+        self.assertEqual(self.held(product_id), (3, 2))
+
+        for _ in range(2):
+            Order.objects.cancel(canceled)
+        self.assertEqual(self.held(product_id), (3, 1))
+
+        later = timezone.now() + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL + 1)
+        self.assertEqual(StockReservation.objects.expire(now=later), 1)
+        self.assertEqual(StockReservation.objects.expire(now=later), 0)
+        self.assertEqual(self.held(product_id), (3, 0))
+
+        # a lapsed hold is taken again on completion while the shop still has the stock
+        Order.objects.complete(lapsed)
+        self.assertEqual(self.held(product_id), (2, 0))
+        self.assertFalse(StockReservation.objects.filter(status=ACTIVE).exists())
+
+    def test_holds_closed_in_the_same_instant_are_counted_once(self):
+        product_id = self.products[0]
+        for amount in (2, 1):
+            Cart.objects.add_product(self.user, product_id, amount)
+            Transaction.objects.checkout(self.user)
+        self.assertEqual(self.held(product_id), (5, 3))
+        # every chunk gets the same closing time, the sums still cover only the holds of their own chunk
+        later = timezone.now() + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL + 1)
+        with patch('payments.models.timezone.now', return_value=later):
+            self.assertEqual(StockReservation.objects.expire(now=later, chunk_size=1), 2)
+        self.assertEqual(self.held(product_id), (5, 0))
+
+
+class OrderAssignmentTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cities = [City.objects.create(name=f'city {i}') for i in range(2)]
+        cls.shops = [Shop.objects.create(address=f'shop {i}', city=city) for i, city in enumerate(cls.cities)]
+        cls.product = Product.objects.create(name='product', current_price=10, real_price=10)
+        for shop in cls.shops:
+            ProductAvailability.objects.create(shop=shop, product=cls.product, amount=100)
+        cls.managers = []
+        for i, city in enumerate([cls.cities[0], cls.cities[0], cls.cities[1]]):
+            manager = create_user(f'manager{i}', city, 0)
+            manager.roles = MANAGER
+            manager.save()
+            cls.managers.append(manager.id)
+        cls.customers = [create_user(f'customer{i}', city, 1000) for i, city in enumerate(cls.cities)]
+        outbox.process()
+
+    def order(self, customer):
+        Cart.objects.add_product(customer, self.product.id, 1)
+        checkout = Transaction.objects.checkout(customer)
+        outbox.process()
+        return checkout.order.get()
+
+    def loads(self):
+        return dict(ManagerLoad.objects.values_list('manager_id', 'open_orders'))
+
+    def test_orders_go_to_least_loaded_manager_of_the_city(self):
+        first, second, other = self.managers
+        orders = [self.order(self.customers[0]) for _ in range(4)] + [self.order(self.customers[1])]
+        self.assertEqual([order.assignee_id for order in orders], [first, second, first, second, other])
+        self.assertEqual(self.loads(), {first: 2, second: 2, other: 1})
+        # a redelivered event leaves the order and the counters alone
+        set_assignee(orders[0].id)
+        self.assertEqual(self.loads(), {first: 2, second: 2, other: 1})
+
+        Order.objects.complete(orders[0].id)
+        Order.objects.cancel(orders[1].id)
+        self.assertEqual(self.loads(), {first: 1, second: 1, other: 1})
+
+        # the orders of a manager going off shift stay in the city while someone there is on shift
+        self.assertEqual(ManagerLoad.objects.end_shift(first), {second: 1})
+        self.assertEqual(self.loads(), {first: 0, second: 2, other: 1})
+        self.assertEqual(ManagerLoad.objects.end_shift(second), {other: 2})
+        self.assertEqual(self.order(self.customers[0]).assignee_id, other)
+        self.assertFalse(Order.objects.filter(assignee__roles=CUSTOMER).exists())
+
+        ManagerLoad.objects.start_shift(first)
+        self.assertEqual(self.order(self.customers[0]).assignee_id, first)
+
+    def test_completed_order_cannot_be_canceled(self):
+        first, second, _ = self.managers
+        orders = [self.order(self.customers[0]) for _ in range(2)]
+        held = ProductAvailability.objects.values_list('amount', 'reserved').get(shop=self.shops[0])
+        self.assertTrue(Order.objects.complete(orders[0].id))
+        self.assertEqual(self.loads()[first], 0)
+
+        self.assertFalse(Order.objects.cancel(orders[0].id))
+        self.assertEqual(Order.objects.get(id=orders[0].id).status, DONE)
+        self.assertEqual(self.loads(), {first: 0, second: 1, self.managers[2]: 0})
+        self.assertEqual(ProductAvailability.objects.values_list('amount', 'reserved').get(shop=self.shops[0]),
+                         (held[0] - 1, held[1] - 1))
+
+
+class OrderReadTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='city')
+        shop = Shop.objects.create(address='shop', city=city)
+        cls.manager = create_user('manager', city, 0)
+        cls.manager.roles = MANAGER
+        cls.manager.save()
+        cls.customers = [create_user(f'customer{i}', city, 0) for i in range(2)]
+        Transaction.objects.bulk_create([Transaction(user=cls.customers[i % 2], shop=shop, total_sum=10)
+                                         for i in range(60)])
+        transactions = list(Transaction.objects.order_by('id'))
+        OrderLine.objects.bulk_create([OrderLine(transaction=checkout, name=f'product {i}', price=5, amount=1)
+                                       for checkout in transactions for i in range(2)])
+        Order.objects.bulk_create([Order(transaction=checkout, assignee=cls.manager,
+                                         status=DONE if i % 3 == 0 else PENDING)
+                                   for i, checkout in enumerate(transactions)])
+
+    def get(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(url).data
+
+    def test_manager_inbox_pages_in_two_queries(self):
+        seen = []
+        url = '/payments/orders/managers/?status=PENDING&page_size=15'
+        while url:
+            with self.assertNumQueries(2):
+                page = self.get(self.manager, url)
+            seen += [order['id'] for order in page['results']]
+            self.assertTrue(all(len(order['transaction']['lines']) == 2 for order in page['results']))
+            url = page['next']
+        self.assertEqual(seen, list(Order.objects.filter(status=PENDING).order_by('-date_created', '-id')
+                                    .values_list('id', flat=True)))
+
+    def test_customers_see_their_own_orders(self):
+        orders = self.get(self.customers[0], '/payments/orders/?page_size=100')['results']
+        self.assertEqual(len(orders), 30)
+        self.assertEqual({Order.objects.get(id=order['id']).transaction.user_id for order in orders},
+                         {self.customers[0].id})
+
+
+class CartApplyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='city')
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100, real_price=100)
+                                     for i in range(4)])
+        cls.products = list(Product.objects.order_by('id').values_list('id', flat=True))
+        cls.user = create_user('user', city, 10000)
+        cls.other = create_user('other', city, 10000)
+
+    def lines(self, user):
+        return dict(Cart.objects.personal(user).cart_items.values_list('product_id', 'amount'))
+
+    def test_batch_is_folded_and_written_once(self):
+        first, second, third, fourth = self.products
+        Cart.objects.apply(self.user, [{'op': 'update', 'product_id': first, 'amount': 2},
+                                       {'op': 'add', 'product_id': second}])
+        Cart.objects.apply(self.other, [{'op': 'add', 'product_id': first, 'amount': 5}])
+        with self.assertNumQueries(13):
+            Cart.objects.apply(self.user, [
+                {'op': 'add', 'product_id': first, 'amount': 3},
+                {'op': 'remove', 'product_id': second},
+                {'op': 'add', 'product_id': third, 'amount': 2},
+                {'op': 'add', 'product_id': third},
+                {'op': 'update', 'product_id': fourth, 'amount': 4},
+            ])
+        self.assertEqual(self.lines(self.user), {first: 5, third: 3, fourth: 4})
+        self.assertEqual(self.lines(self.other), {first: 5})
+        # every line belongs to exactly one cart
+        self.assertEqual(Cart.cart_items.through.objects.count(), CartItem.objects.count())
+
+    def test_invalid_batch_changes_nothing(self):
+        Cart.objects.add_product(self.user, self.products[0], 1)
+        for operations, error in (
+                ([{'op': 'add', 'product_id': self.products[1]}, {'op': 'add', 'product_id': 0}],
+                 messages.PRODUCT_NOT_FOUND),
+                ([{'op': 'add', 'product_id': self.products[1]}, {'op': 'add', 'product_id': self.products[2],
+                                                                  'amount': -1}],
+                 messages.INVALID_CART_OPERATION),
+                ([{'op': 'clear'}], messages.INVALID_CART_OPERATION)):
+            with self.assertRaisesMessage(ValueError, error):
+                Cart.objects.apply(self.user, operations)
+        self.assertEqual(self.lines(self.user), {self.products[0]: 1})
+
+    def test_batch_endpoint(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post('/payments/cart/batch/', json.dumps({'operations': [
+            {'op': 'add', 'product_id': self.products[0], 'amount': 2},
+            {'op': 'update', 'product_id': self.products[1], 'amount': 3},
+        ]}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_sum'], 500)
+        response = client.post('/payments/cart/batch/', json.dumps({'operations': [{'op': 'add'}]}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.lines(self.user), {self.products[0]: 2, self.products[1]: 3})
+
+
+class CartTotalTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='city')
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100 * (i + 1), real_price=100)
+                                     for i in range(3)])
+        cls.products = list(Product.objects.order_by('id').values_list('id', flat=True))
+        cls.user = create_user('user', city, 10000)
+        for product_id in cls.products:
+            Cart.objects.add_product(cls.user, product_id, 2)
+
+    def test_total_is_one_aggregate_query(self):
+        cart_id = Cart.objects.cart_id(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(Cart.objects.with_total_sum().get(id=cart_id).total_sum, 1200)
+        cart = Cart.objects.get(id=cart_id)
+        with self.assertNumQueries(1):
+            self.assertEqual(cart.total_sum, 1200)
+            self.assertEqual(cart.total_sum, 1200)
+        # the total follows the current prices
+        Product.objects.filter(id=self.products[0]).update(current_price=50)
+        self.assertEqual(Cart.objects.personal(self.user).total_sum, 1100)
+
+    def test_reading_the_cart_does_not_write(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/payments/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_sum'], 1200)
+        self.assertEqual(len(response.data['cart_items']), 3)
+        self.assertEqual(len(queries), 3)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+
+
+@override_settings(CART_STORAGE='cache', CART_CACHE='carts', CACHES={**settings.CACHES, 'carts': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp()}})
+class CacheCartStorageTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        city = City.objects.create(name='city')
+        shop = Shop.objects.create(address='shop', city=city)
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=100, real_price=100)
+                                     for i in range(3)])
+        cls.products = list(Product.objects.values_list('id', flat=True))
+        ProductAvailability.objects.bulk_create([ProductAvailability(shop=shop, product_id=product_id, amount=5)
+                                                 for product_id in cls.products])
+        cls.user = create_user('user', city, 10000)
+
+    def setUp(self):
+        caches[settings.CART_CACHE].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    def test_cart_is_written_at_flush_and_checkout_only(self):
+        self.post('/payments/cart/', {'product_id': self.products[0], 'amount': 2})
+        response = self.post('/payments/cart/batch/', {'operations': [
+            {'op': 'add', 'product_id': self.products[1], 'amount': 3},
+            {'op': 'add', 'product_id': self.products[2]},
+            {'op': 'remove', 'product_id': self.products[2]},
+        ]})
+        self.assertEqual(response.data['total_sum'], 500)
+        self.assertEqual(self.client.get('/payments/cart/').data['total_sum'], 500)
+        self.assertFalse(CartItem.objects.exists())
+
+        self.assertEqual(get_cart_storage().flush_all(), 1)
+        self.assertEqual(Cart.objects.personal(self.user).item_amounts(), {self.products[0]: 2, self.products[1]: 3})
+        self.assertEqual(get_cart_storage().flush_all(), 0)
+
+        self.post('/payments/cart/', {'product_id': self.products[0], 'amount': 1})
+        response = self.post('/payments/transaction/', {})
+        self.assertEqual(response.data['total_sum'], 400)
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(self.client.get('/payments/cart/').data['cart_items'], [])
+
+    def test_change_during_flush_is_flushed_next_time(self):
+        storage = get_cart_storage()
+        self.post('/payments/cart/', {'product_id': self.products[0], 'amount': 2})
+        flush = storage.flush
+
+        def flush_and_change(user_id):
+            flush(user_id)
+            self.post('/payments/cart/', {'product_id': self.products[1], 'amount': 1})
+        with patch.object(storage, 'flush', flush_and_change):
+            self.assertEqual(storage.flush_all(), 1)
+        self.assertEqual(storage.flush_all(), 1)
+        self.assertEqual(Cart.objects.personal(self.user).item_amounts(), {self.products[0]: 2, self.products[1]: 1})
+
+    def test_change_after_flush_survives_checkout(self):
+        storage = get_cart_storage()
+        self.post('/payments/cart/', {'product_id': self.products[0], 'amount': 1})
+        storage.flush_all()
+        flushed = storage.flush(self.user.id)
+        Transaction.objects.checkout(self.user)
+        self.post('/payments/cart/', {'product_id': self.products[1], 'amount': 2})
+        storage.checked_out(self.user.id, flushed)
+        self.assertEqual(self.client.get('/payments/cart/').data['total_sum'], 300)
+        self.assertEqual(storage.flush_all(), 1)
+        self.assertEqual(Cart.objects.personal(self.user).item_amounts(), {self.products[0]: 1, self.products[1]: 2})
+
+        flushed = storage.flush(self.user.id)
+        storage.checked_out(self.user.id, flushed)
+        self.assertEqual(self.client.get('/payments/cart/').data['cart_items'], [])
+
+    def test_locked_cart_is_not_overwritten(self):
+        storage = get_cart_storage()
+        storage.cache.add(storage.lock_key(storage.key(self.user.id)), 'other', 60)
+        with patch('common.cache.LOCK_WAIT', 0), self.assertRaises(TimeoutError):
+            with patch.object(storage, 'items', side_effect=AssertionError):
+                storage.apply(self.user, [{'op': 'add', 'product_id': self.products[0]}])
+        storage.cache.delete(storage.lock_key(storage.key(self.user.id)))
+        storage.apply(self.user, [{'op': 'add', 'product_id': self.products[0]}])
+        self.assertEqual(storage.items(self.user.id), {self.products[0]: 1})
+
+    @override_settings(CART_CACHE='default')
+    def test_cache_has_to_be_shared(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_cart_storage()
+
+
+class CheckoutConcurrencyTest(TransactionTestCase):
+    processes = 8
+    users = 40
+    stock = (15, 10)
+    # every user can pay for one unit only and tries to check out twice
+    balance = 150
+    price = 100
+
+    def test_no_oversell_or_overdraft(self):
+        self.checkouts()
+
+    def checkouts(self):
+        city = City.objects.create(name='city')
+        product = Product.objects.create(name='product', current_price=self.price, real_price=self.price)
+        for i, amount in enumerate(self.stock):
+            ProductAvailability.objects.create(shop=Shop.objects.create(address=f'shop {i}', city=city),
+                                               product=product, amount=amount)
+        user_ids = [create_user(f'user{i}', city, self.balance).id for i in range(self.users)]
+        attempts = user_ids * 2
+        random.Random(1).shuffle(attempts)
+
+        # the workers are forked, each one opens its own connection to the test database file
+        connections.close_all()
+        started = time.perf_counter()
+        with multiprocessing.get_context('fork').Pool(self.processes) as pool:
+            results = pool.starmap(checkout_worker, [(product.id, attempts[i::self.processes])
+                                                     for i in range(self.processes)])
+        elapsed = time.perf_counter() - started
+        results = [result for worker in results for result in worker]
+
+        succeeded = sum(1 for ok, _ in results if ok)
+        self.assertEqual(succeeded, sum(self.stock))
+        self.assertEqual(Transaction.objects.count(), succeeded)
+        self.assertEqual(list(ProductAvailability.objects.order_by('id').values_list('amount', 'reserved')),
+                         list(zip(self.stock, self.stock)))
+        self.assertEqual(StockReservation.objects.aggregate(total=Sum('amount'))['total'], succeeded)
+        self.assertFalse(CreditCard.objects.filter(balance__lt=0).exists())
+        self.assertEqual(sum(CreditCard.objects.values_list('balance', flat=True)),
+                         self.users * self.balance - succeeded * self.price)
+        return results, elapsed
+
+
+@benchmark
+class CheckoutConcurrencyBenchmark(CheckoutConcurrencyTest):
+    users = 400
+    stock = (150, 100)
+
+    def test_no_oversell_or_overdraft(self):
+        results, elapsed = self.checkouts()
+        report(f'{len(results)} concurrent checkouts in {self.processes} processes',
+               checkouts_per_sec=len(results) / elapsed,
+               slowest_ms=max(seconds for _, seconds in results) * 1000)
+
+
+@benchmark
+class ShopAvailabilityBenchmark(TestCase):
+    shops = 500
+    products = 1000
+    items = 30
+    # share of the catalog every shop stocks
+    assortment = 0.95
+
+    @classmethod
+    def setUpTestData(cls):
+        random.seed(1)
+        city = City.objects.create(name='city')
+        Shop.objects.bulk_create([Shop(address=f'shop {i}', city=city) for i in range(cls.shops)])
+        Product.objects.bulk_create([Product(name=f'product {i}', current_price=i, real_price=i)
+                                     for i in range(cls.products)])
+        product_ids = list(Product.objects.values_list('id', flat=True))
+        ProductAvailability.objects.bulk_create(
+            [ProductAvailability(shop_id=shop_id, product_id=product_id, amount=random.randint(0, 100))
+             for shop_id in Shop.objects.values_list('id', flat=True)
+             for product_id in product_ids if random.random() < cls.assortment], batch_size=5000)
+        cls.user = User.objects.create_user('user', 'password', 'user@mail.kz', 'user', 'user')
+        for product_id in random.sample(product_ids, cls.items):
+            Cart.objects.add_product(cls.user, product_id, random.randint(1, 3))
+
+    def test_check_availability(self):
+        cart = Cart.objects.personal(self.user)
+        items = cart.item_amounts()
+
+        def loop():
+            # the per shop and per item search the solver replaced
+            available = ProductAvailability.objects.filter(shop__city=self.user.cur_city)
+            for shop_id in available.values_list('shop_id', flat=True).distinct().order_by('shop_id'):
+                if all(available.filter(shop_id=shop_id, product_id=product_id, amount__gte=amount).exists()
+                       for product_id, amount in items.items()):
+                    return shop_id
+
+        shops = cart.available_shops()
+        self.assertEqual(loop() in shops, bool(shops))
+        self.assertTrue(shops)
+        self.assertEqual(cart.check_availability(), (AVAILABLE, shops[0]))
+        for shop_id in shops:
+            stock = dict(ProductAvailability.objects.filter(shop_id=shop_id, product_id__in=items)
+                         .values_list('product_id', 'amount'))
+            self.assertTrue(all(stock.get(product_id, 0) >= amount for product_id, amount in items.items()))
+
+        report(f'{self.items} items over {self.shops} shops, {len(shops)} candidates',
+               loop_ms=measure(loop, repeat=1), solver_ms=measure(cart.available_shops))
@@ -1,7 +1,7 @@
 from django.urls import path
 from rest_framework import routers
 
-from payments.views import CreditCardView, OrderView, CartView, CardDetails, TransactionView
+from payments.views import CreditCardView, OrderView, CartView, CardDetails, TransactionView, CartBatchView
 
 router = routers.SimpleRouter()
 router.register('credit-card', CreditCardView, basename='credit-card')
@@ -10,6 +10,7 @@ router.register('transaction', TransactionView, basename='transactions')
 
 urlpatterns = [
     path('cart/', CartView.as_view()),
+    path('cart/batch/', CartBatchView.as_view()),
     path('cart/details/', CardDetails.as_view())
 ]
 
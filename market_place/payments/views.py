@@ -6,10 +6,13 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from common.pagination import KeysetPagination
 from common.permissions import ManagerPermission
-from common.constants import CANCELED, DONE, DONT_ENOUGH_MONEY, DONT_AVAILABLE
-from payments.models import CreditCard, Order, Cart
-from payments.serializers import CreditCardSerializer, OrderSerializer, TransactionSerializer, CartSerializer
+from common.constants import UPDATE, REMOVE, ADMIN, DIRECTOR
+from payments.cart_storage import get_cart_storage
+from payments.filters import OrderFilter
+from payments.models import CreditCard, Order, Transaction, ManagerLoad
+from payments.serializers import CreditCardSerializer, OrderSerializer, TransactionSerializer
 
 import logging
 
@@ -44,8 +47,7 @@ class CartView(APIView):
     def get(self, request):
         try:
             logger.info('get cart')
-            cart = Cart.objects.personal(user=request.user)
-            return Response(CartSerializer(cart).data, status=status.HTTP_200_OK)
+            return Response(get_cart_storage().data(request.user), status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f'get cart - {str(e)}')
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -54,19 +56,38 @@ class CartView(APIView):
         try:
             logger.info('post items to cart')
             data = json.loads(request.body)
-            Cart.objects.add_product(user=request.user, product_id=data['product_id'], amount=data.get('amount', 1))
+            get_cart_storage().apply(request.user, [{'op': UPDATE, 'product_id': data['product_id'],
+                                                     'amount': data.get('amount', 1)}])
             return Response({'info': 'added'}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f"post item to cart - str(e)")
             return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class CartBatchView(APIView):
+    permission_classes = (IsAuthenticated, )
+
+    def post(self, request):
+        try:
+            logger.info('batch update cart')
+            data = json.loads(request.body)
+            storage = get_cart_storage()
+            storage.apply(request.user, data['operations'])
+            return Response(storage.data(request.user), status=status.HTTP_200_OK)
+        except (KeyError, ValueError) as e:
+            logger.error(f'batch update cart - {str(e)}')
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f'batch update cart - {str(e)}')
+            return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class CardDetails(APIView):
     def post(self, request):
         try:
             logger.info(f'delete item from cart {str(request.data)}')
             data = json.loads(request.body)
-            Cart.objects.remove_product(user=request.user, product_id=data['product_id'])
+            get_cart_storage().apply(request.user, [{'op': REMOVE, 'product_id': data['product_id']}])
             return Response({'info': 'deleted'}, status=status.HTTP_200_OK)
         except Exception as e:
             logger.error(f'delete item from cart {str(request.data)} - {str(e)}')
@@ -79,29 +100,17 @@ class TransactionView(viewsets.ViewSet, mixins.CreateModelMixin):
     def create(self, request):
         try:
             logger.info(f'create transaction: {request.data}')
-            cart = Cart.objects.get(user=request.user)
-            card = CreditCard.objects.get(user=request.user)
-            has_balance = cart.check_balance()
-            if has_balance == DONT_ENOUGH_MONEY:
-                raise Exception('У вас недостаточно средств на карте')
-            is_available = cart.check_availability()
-            if is_available[0] == DONT_AVAILABLE:
-                raise Exception('Данных товаров нет в наличии')
-            available = is_available[1]
-            new_cart = Cart.objects.create(total_sum=cart.total_sum)
-            for cart_item in cart.cart_items.all():
-                new_cart.cart_items.add(cart_item.id)
-            new_cart.save()
-            data = {"cart": new_cart.id, 'availability': available}
-            serializer = TransactionSerializer(data=data)
-            if serializer.is_valid():
-                serializer.save()
-                cart.withdraw_money()
-                cart.empty_cart()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            storage = get_cart_storage()
+            flushed = storage.flush(request.user.id)
+            transaction = Transaction.objects.checkout(request.user)
+            storage.checked_out(request.user.id, flushed)
+            return Response(TransactionSerializer(transaction).data, status=status.HTTP_201_CREATED)
         except CreditCard.DoesNotExist:
             logger.error(f'create transaction: {request.data} - credit card doesn\'t exist')
             return Response({"error": "Нет кредитной карты! Добавьте ее"}, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            logger.error(f'create transaction: {request.data} - {str(e)}')
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             logger.error(f'create transaction: {request.data} - {str(e)}')
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -109,32 +118,49 @@ class TransactionView(viewsets.ViewSet, mixins.CreateModelMixin):
 
 class OrderView(viewsets.ModelViewSet):
     permission_classes = (IsAuthenticated,)
-    queryset = Order.objects.all()
+    # the order lines are a snapshot, a page of orders reads them with one more query and no catalog joins
+    queryset = Order.objects.with_lines()
+    pagination_class = KeysetPagination
     serializer_class = OrderSerializer
+    filterset_class = OrderFilter
+
+    def get_queryset(self):
+        if self.request.user.roles in (ADMIN, DIRECTOR):
+            return Order.objects.with_lines()
+        return Order.objects.user_orders(self.request.user)
 
     @action(methods=['GET'], detail=False, url_path='managers', url_name='managers',
             permission_classes=(ManagerPermission,))
     def managers_orders(self, request):
         logger.info(f'managers\' orders')
-        queryset = Order.objects.assignee_orders(assignee=request.user)
-        serializer = OrderSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        queryset = self.filter_queryset(Order.objects.assignee_orders(assignee=request.user))
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(OrderSerializer(page, many=True).data)
+
+    @action(methods=['PUT'], detail=False, url_path='managers/shift', url_name='managers-shift',
+            permission_classes=(ManagerPermission,))
+    def managers_shift(self, request):
+        logger.info(f'manager shift {request.data}')
+        if request.data.get('on_shift', True):
+            ManagerLoad.objects.start_shift(request.user.id)
+            return Response({'info': 'on shift'}, status=status.HTTP_200_OK)
+        reassigned = ManagerLoad.objects.end_shift(request.user.id)
+        return Response({'info': 'off shift', 'reassigned': sum(reassigned.values())}, status=status.HTTP_200_OK)
 
     @action(methods=['PUT'], detail=True, url_path='cancel', url_name='cancel',
             permission_classes=(IsAuthenticated,))
     def user_cancel(self, request, pk):
         logger.info('user cancel order')
-        order = Order.objects.get(id=pk)
-        order.status = CANCELED
-        order.assignee = None
-        order.save()
+        Order.objects.cancel(pk)
         return Response({'info': 'canceled'}, status=status.HTTP_200_OK)
 
     @action(methods=['PUT'], detail=True, url_path='complete', url_name='complete',
             permission_classes=(IsAuthenticated,))
     def complete_order(self, request, pk):
         logger.info(f'order completed {pk}')
-        order = Order.objects.get(id=pk)
-        order.status = DONE
-        order.save()
-        return Response({'info': 'completed'}, status=status.HTTP_200_OK)
\ No newline at end of file
+        try:
+            Order.objects.complete(pk)
+            return Response({'info': 'completed'}, status=status.HTTP_200_OK)
+        except ValueError as e:
+            logger.error(f'order completed {pk} - {str(e)}')
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file